@@ -0,0 +1,59 @@
+"""Benchmark FeatureStore update throughput and memory per million users."""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scorer.feature_store import FeatureStore
+
+def sample_events(n, n_users, seed=0):
+    rng = np.random.default_rng(seed)
+    users = rng.integers(0, n_users, n)
+    return [
+        {
+            "user_id": "user_{:07d}".format(user),
+            "device_id": "device_{:07d}".format(device),
+            "merchant_id": "merchant_{:05d}".format(merchant),
+            "amount": amount,
+            "timestamp": timestamp,
+        }
+        for user, device, merchant, amount, timestamp in zip(
+            users.tolist(),
+            (users * 2 + (rng.random(n) < 0.1)).tolist(),
+            rng.integers(0, max(n_users // 100, 1), n).tolist(),
+            rng.lognormal(4, 1, n).tolist(),
+            (1.7e9 + np.sort(rng.uniform(0, 86400, n))).tolist(),
+        )
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=200000)
+    parser.add_argument("--users", type=int, default=100000)
+    args = parser.parse_args()
+    events = sample_events(args.events, args.users)
+    store = FeatureStore(max_users=max(args.users, 1024))
+    start = time.perf_counter()
+    for txn in events:
+        store.observe(txn, arrival=txn["timestamp"])
+    elapsed = time.perf_counter() - start
+    # Second pass with tracing on, which is too slow to time
+    tracemalloc.start()
+    traced = FeatureStore(max_users=max(args.users, 1024))
+    for txn in events:
+        traced.observe(txn, arrival=txn["timestamp"])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    users = len(store.users)
+    print("Events: {:,} over {:,} users".format(len(events), users))
+    print("Updates/sec: {:,.0f} ({:.1f}us per transaction)".format(len(events) / elapsed, elapsed / len(events) * 1e6))
+    print("Bytes per user: {:.0f} (arrays + key index, all three stores)".format(peak / users))
+    print("Projected memory per million users: {:.0f} MB".format(peak / users * 1e6 / 2**20))
+    for name, stats in store.stats().items():
+        print("  {}: {}".format(name, stats))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Benchmark the flattened forest against sklearn's RandomForestClassifier.predict_proba."""
+import argparse
+import os
+import sys
+import time
+import joblib
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scorer.features import FEATURE_NAMES
+from scorer.flat_forest import FlatForest, flatten_forest
+from scorer.model_loader import resolve_model_path
+from training.train import train_model
+
+def load_or_train(model_path, seed=0):
+    if os.path.exists(model_path):
+        return joblib.load(model_path)
+    print("Model not found at {}, training on random features".format(model_path))
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(20000, len(FEATURE_NAMES)))
+    y = (X[:, 0] + X[:, 6] + rng.normal(scale=0.5, size=len(X)) > 1.5).astype(int)
+    return train_model(X, y)
+
+def single_row_latencies(predict, X):
+    timings = np.empty(len(X))
+    for i in range(len(X)):
+        row = X[i:i + 1]
+        start = time.perf_counter_ns()
+        predict(row)
+        timings[i] = (time.perf_counter_ns() - start) / 1000
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model-path", default=resolve_model_path(model_file="fraud_model.joblib")[0])
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+    model = load_or_train(args.model_path)
+    flat = FlatForest(flatten_forest(model))
+    rng = np.random.default_rng(1)
+    X = rng.normal(size=(args.batch_size, len(FEATURE_NAMES))) * 3
+    max_diff = np.abs(flat.predict_fraud(X) - model.predict_proba(X)[:, 1]).max()
+    print("Max |flat - sklearn| probability difference: {:.2e}".format(max_diff))
+    print("{:<10} {:>12} {:>12} {:>16}".format("engine", "row p50", "row p99", "batch rows/s"))
+    for name, predict in [("sklearn", model.predict_proba), ("flat", flat.predict_fraud)]:
+        single_row_latencies(predict, X[:50])
+        timings = single_row_latencies(predict, X[:args.rows])
+        start = time.perf_counter()
+        predict(X)
+        rows_per_sec = len(X) / (time.perf_counter() - start)
+        print("{:<10} {:>10.1f}us {:>10.1f}us {:>16,.0f}".format(
+            name, np.percentile(timings, 50), np.percentile(timings, 99), rows_per_sec))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Micro-benchmark of the single-transaction scoring path, stage by stage."""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scorer.app import Transaction
+from scorer.features import extract_features, features_to_array, feature_buffer, write_features
+from scorer.rules import RulesEngine
+from scorer.model_loader import get_model_loader, resolve_model_path
+
+def sample_transactions(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return [
+        Transaction(
+            transaction_id="txn_{:08d}".format(i),
+            user_id="user_{:05d}".format(int(rng.integers(0, 2000))),
+            merchant_id="merchant_{:04d}".format(int(rng.integers(0, 1000))),
+            device_id="device_{:06d}".format(int(rng.integers(0, 4000))),
+            amount=round(float(rng.lognormal(4, 1.5)), 2),
+            hour=int(rng.integers(0, 24)),
+            day_of_week=int(rng.integers(0, 7)),
+            velocity_1h=int(rng.integers(0, 15)),
+            is_new_device=bool(rng.random() < 0.2),
+        )
+        for i in range(n)
+    ]
+
+def time_stage(func, items):
+    """Per-call latency in microseconds for func over items."""
+    timings = np.empty(len(items))
+    for i, item in enumerate(items):
+        start = time.perf_counter_ns()
+        func(item)
+        timings[i] = (time.perf_counter_ns() - start) / 1000
+    return timings
+
+def legacy_features(txn):
+    return features_to_array(extract_features(txn.model_dump()))
+
+def fast_features(txn):
+    return write_features(feature_buffer(), txn.amount, txn.hour, txn.day_of_week, txn.velocity_1h, txn.is_new_device)
+
+def run(iterations, model_path):
+    txns = sample_transactions(iterations)
+    engine = RulesEngine()
+    stages = [
+        ("dict", lambda t: t.model_dump(), vars),
+        ("features", legacy_features, fast_features),
+        ("rules", lambda t: engine.evaluate(t.model_dump()), lambda t: engine.evaluate(vars(t))),
+    ]
+    if os.path.exists(model_path):
+        loader = get_model_loader()
+        loader.reload(model_path=model_path)
+        stages.append((
+            "model",
+            lambda t: loader.predict_proba(legacy_features(t)),
+            lambda t: loader.predict_proba(fast_features(t)),
+        ))
+    else:
+        print("Model not found at {}, skipping model stage".format(model_path))
+    results = {}
+    for name, legacy, fast in stages:
+        # Warm up both paths before measuring
+        time_stage(legacy, txns[:100])
+        time_stage(fast, txns[:100])
+        results[name] = {"legacy": time_stage(legacy, txns), "fast": time_stage(fast, txns)}
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--model-path", default=resolve_model_path()[0])
+    args = parser.parse_args()
+    results = run(args.iterations, args.model_path)
+    print("{:<10} {:>12} {:>12} {:>12} {:>12}".format("stage", "legacy p50", "legacy p99", "fast p50", "fast p99"))
+    for name, timings in results.items():
+        legacy, fast = timings["legacy"], timings["fast"]
+        print("{:<10} {:>10.2f}us {:>10.2f}us {:>10.2f}us {:>10.2f}us".format(
+            name, np.percentile(legacy, 50), np.percentile(legacy, 99),
+            np.percentile(fast, 50), np.percentile(fast, 99)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Benchmark scorer cold starts: import time, time to /live and /ready, and the first /score."""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import httpx
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["sklearn", "scipy", "pandas", "joblib", "pyarrow"]
+TRANSACTION = {"transaction_id": "txn_startup", "user_id": "user_00001", "merchant_id": "merchant_0001",
+               "device_id": "device_000001", "amount": 120.0, "hour": 14, "day_of_week": 2, "velocity_1h": 1,
+               "is_new_device": False}
+IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import scorer.app
+imported = time.perf_counter()
+heavy_after_import = [m for m in {heavy} if m in sys.modules]
+from scorer.model_loader import get_model_loader
+get_model_loader().current()
+loaded = time.perf_counter()
+print(json.dumps({{"import_s": imported - start, "load_s": loaded - imported, "heavy_after_import": heavy_after_import,
+                  "heavy_after_load": [m for m in {heavy} if m in sys.modules]}}))
+"""
+
+def model_env(model_file):
+    return dict(os.environ, FRAUD_MODEL_FILE=model_file, PYTHONPATH=ROOT)
+
+def import_profile(model_file):
+    """Import and model load time in a fresh interpreter, and which heavy modules each pulls in."""
+    output = subprocess.run([sys.executable, "-c", IMPORT_PROBE.format(heavy=HEAVY_MODULES)], env=model_env(model_file),
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def wait_for(client, path, deadline, process):
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("uvicorn exited with code {}".format(process.returncode))
+        try:
+            if client.get(path, timeout=1).status_code == 200:
+                return time.perf_counter()
+        except httpx.TransportError:
+            pass
+        time.sleep(0.005)
+    raise RuntimeError("{} did not answer".format(path))
+
+def cold_start(model_file, port, timeout=60):
+    """Seconds from process start to /live and /ready, then the first and a warm /score latency."""
+    # One client for every probe and request, so its setup cost is paid before the clock starts
+    client = httpx.Client(base_url="http://127.0.0.1:{}".format(port), timeout=timeout)
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", "scorer.app:app", "--app-dir", ROOT, "--port", str(port),
+                                "--log-level", "warning"], env=model_env(model_file))
+    try:
+        live = wait_for(client, "/live", start + timeout, process)
+        ready = wait_for(client, "/ready", start + timeout, process)
+        latencies = []
+        for _ in range(2):
+            request_start = time.perf_counter()
+            client.post("/score", json=TRANSACTION).raise_for_status()
+            latencies.append((time.perf_counter() - request_start) * 1000)
+    finally:
+        client.close()
+        process.terminate()
+        process.wait()
+    return {"live_s": live - start, "ready_s": ready - start, "first_score_ms": latencies[0], "warm_score_ms": latencies[1]}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model-files", nargs="+", default=["fraud_model.joblib", "fraud_model_flat.joblib"])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--output", help="Write the results as JSON")
+    args = parser.parse_args(argv)
+    results = {}
+    print("{:<26} {:>9} {:>9} {:>9} {:>9} {:>12} {:>11}  {}".format(
+        "artifact", "import", "load", "live", "ready", "first score", "warm score", "heavy modules after load"))
+    for model_file in args.model_files:
+        profiles = [import_profile(model_file) for _ in range(args.runs)]
+        starts = [cold_start(model_file, args.port) for _ in range(args.runs)]
+        result = {key: float(np.median([p[key] for p in profiles])) for key in ["import_s", "load_s"]}
+        result.update({key: float(np.median([s[key] for s in starts])) for key in starts[0]})
+        result["heavy_after_import"] = profiles[-1]["heavy_after_import"]
+        result["heavy_after_load"] = profiles[-1]["heavy_after_load"]
+        results[model_file] = result
+        print("{:<26} {:>8.3f}s {:>8.3f}s {:>8.3f}s {:>8.3f}s {:>10.1f}ms {:>9.1f}ms  {}".format(
+            model_file, result["import_s"], result["load_s"], result["live_s"], result["ready_s"],
+            result["first_score_ms"], result["warm_score_ms"], ", ".join(result["heavy_after_load"]) or "-"))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+if __name__ == "__main__":
+    main()
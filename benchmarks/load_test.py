@@ -0,0 +1,254 @@
+"""Replay JSONL or generated transactions against the scoring API and report latency by stage."""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import httpx
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from monitor.metrics import LatencyHistogram, QUANTILES
+from simulator.dataset import iter_transactions
+from simulator.generate import generate_transactions
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAYLOAD_FIELDS = ["transaction_id", "user_id", "merchant_id", "device_id", "amount", "hour", "day_of_week", "velocity_1h", "is_new_device"]
+
+def payloads_from_frame(df):
+    """API request bodies from generated or stored transactions."""
+    df = df[[c for c in PAYLOAD_FIELDS + ["timestamp"] if c in df.columns]].copy()
+    for col in df.select_dtypes("category"):
+        df[col] = df[col].astype(str)
+    if "timestamp" in df.columns:
+        df["timestamp"] = pd.to_datetime(df["timestamp"]).astype("int64") / 1e9
+    return df.to_dict("records")
+
+def load_payloads(args):
+    if args.input:
+        with open(args.input) as f:
+            payloads = [json.loads(line) for line in f if line.strip()]
+    elif args.data:
+        payloads = []
+        for df in iter_transactions(args.data):
+            payloads += payloads_from_frame(df)
+            if len(payloads) >= args.requests * args.batch_size:
+                break
+    else:
+        payloads = payloads_from_frame(generate_transactions(args.requests * args.batch_size, seed=args.seed))
+    if not payloads:
+        raise ValueError("No transactions to replay")
+    return payloads
+
+def request_bodies(payloads, n_requests, batch_size):
+    """n_requests bodies, cycling through the payloads; lists of batch_size for /score/batch."""
+    bodies = []
+    for i in range(n_requests):
+        if batch_size == 1:
+            bodies.append(payloads[i % len(payloads)])
+        else:
+            bodies.append([payloads[(i * batch_size + j) % len(payloads)] for j in range(batch_size)])
+    return bodies
+
+def parse_server_timing(header):
+    stages = {}
+    for item in filter(None, (part.strip() for part in header.split(","))):
+        name, _, duration = item.partition(";dur=")
+        stages[name] = float(duration)
+    return stages
+
+class Results:
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.stages = {}
+        self.errors = 0
+        self.status = {}
+
+    def record(self, latency_ms, response):
+        self.latency.record(latency_ms)
+        self.status[response.status_code] = self.status.get(response.status_code, 0) + 1
+        if response.status_code != 200:
+            self.errors += 1
+        for stage, duration_ms in parse_server_timing(response.headers.get("server-timing", "")).items():
+            self.stages.setdefault(stage, LatencyHistogram()).record(duration_ms)
+
+    def record_failure(self, latency_ms, kind):
+        """A request that got no response, counted under kind (e.g. "timeout") next to the status codes."""
+        self.latency.record(latency_ms)
+        self.status[kind] = self.status.get(kind, 0) + 1
+        self.errors += 1
+
+    def summary(self, elapsed_s, transactions_per_request):
+        def quantiles(hist):
+            stats = {name: round(hist.quantile(q), 3) for name, q in QUANTILES.items()}
+            stats["mean"] = round(hist.sum_ms / hist.total, 3) if hist.total else 0.0
+            stats["max"] = round(hist.max_ms, 3)
+            return stats
+        return {
+            "requests": self.latency.total,
+            "errors": self.errors,
+            "status_codes": {str(code): count for code, count in sorted(self.status.items(), key=lambda item: str(item[0]))},
+            "elapsed_s": round(elapsed_s, 3),
+            "requests_per_s": round(self.latency.total / elapsed_s, 1) if elapsed_s else 0.0,
+            "transactions_per_s": round(self.latency.total * transactions_per_request / elapsed_s, 1) if elapsed_s else 0.0,
+            "latency_ms": quantiles(self.latency),
+            "stages_ms": {stage: quantiles(hist) for stage, hist in self.stages.items()},
+        }
+
+async def send(client, path, body, results, started):
+    try:
+        response = await client.post(path, json=body)
+    except httpx.TimeoutException:
+        results.record_failure((time.perf_counter() - started) * 1000, "timeout")
+    except httpx.HTTPError:
+        results.record_failure((time.perf_counter() - started) * 1000, "transport_error")
+    else:
+        results.record((time.perf_counter() - started) * 1000, response)
+
+async def closed_loop(client, path, bodies, concurrency, results):
+    """concurrency clients, each sending its next request when the previous one returns."""
+    queue = iter(bodies)
+
+    async def worker():
+        for body in queue:
+            await send(client, path, body, results, time.perf_counter())
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+async def open_loop(client, path, bodies, rate, results, seed=0):
+    """Poisson arrivals at rate per second; latency counts from the scheduled send time, so queueing is not hidden."""
+    gaps = np.random.default_rng(seed).exponential(1 / rate, len(bodies))
+    start = time.perf_counter()
+    tasks = []
+    for body, scheduled in zip(bodies, start + np.cumsum(gaps)):
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(send(client, path, body, results, scheduled)))
+    await asyncio.gather(*tasks)
+
+async def run(client, args, warmup, bodies):
+    path = "/score/batch" if args.batch_size > 1 else "/score"
+    if warmup:
+        await closed_loop(client, path, warmup, args.concurrency, Results())
+    results = Results()
+    start = time.perf_counter()
+    if args.rate:
+        await open_loop(client, path, bodies, args.rate, results, args.seed)
+    else:
+        await closed_loop(client, path, bodies, args.concurrency, results)
+    return results.summary(time.perf_counter() - start, args.batch_size)
+
+def asgi_client(args):
+    from scorer.app import app
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://asgi", timeout=args.timeout)
+
+def start_server(workers, port):
+    """The production launcher (scorer/serve.py) with workers processes, returned once /ready answers."""
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "scorer", "serve.py"), "--port", str(port), "--workers", str(workers)],
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Launcher exited with code {}".format(process.returncode))
+        try:
+            if httpx.get("http://127.0.0.1:{}/ready".format(port), timeout=1).status_code == 200:
+                return process
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Launcher did not become ready")
+
+def process_memory(pid):
+    """RSS, PSS and USS in MB from /proc/<pid>/smaps_rollup (Linux).
+
+    USS (private pages) is what the process alone costs; PSS splits shared pages between their users.
+    """
+    fields = {}
+    with open("/proc/{}/smaps_rollup".format(pid)) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return {"rss_mb": round(fields["Rss"], 1), "pss_mb": round(fields["Pss"], 1),
+            "uss_mb": round(fields["Private_Clean"] + fields["Private_Dirty"], 1)}
+
+def server_memory(pid):
+    """Memory of the launcher and each of its workers; a worker's USS is the cost of adding one."""
+    with open("/proc/{0}/task/{0}/children".format(pid)) as f:
+        workers = [int(child) for child in f.read().split()]
+    worker_memory = [process_memory(child) for child in workers]
+    return {
+        "launcher": process_memory(pid),
+        "workers": worker_memory,
+        "per_worker_uss_mb": round(float(np.mean([m["uss_mb"] for m in worker_memory])), 1) if workers else 0.0,
+        "total_pss_mb": round(process_memory(pid)["pss_mb"] + sum(m["pss_mb"] for m in worker_memory), 1),
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--input", help="JSONL file of transaction request bodies")
+    source.add_argument("--data", help="Generated split to replay: CSV, shard directory or Parquet dataset")
+    parser.add_argument("--target", default="asgi",
+                        help="asgi for in-process, serve to start scorer/serve.py, or a base URL like http://127.0.0.1:8000")
+    parser.add_argument("--workers", type=int, default=2, help="Launcher workers with --target serve")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16, help="Closed-loop clients")
+    parser.add_argument("--rate", type=float, default=None, help="Open-loop arrivals per second instead of closed-loop clients")
+    parser.add_argument("--batch-size", type=int, default=1, help="Transactions per request; above 1 uses /score/batch")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    payloads = load_payloads(args)
+    bodies = request_bodies(payloads, args.requests + args.warmup, args.batch_size)
+    warmup, bodies = bodies[:args.warmup], bodies[args.warmup:]
+    process = None
+    if args.target == "asgi":
+        client = asgi_client(args)
+    else:
+        if args.target == "serve":
+            process = start_server(args.workers, args.port)
+            base_url = "http://127.0.0.1:{}".format(args.port)
+        else:
+            base_url = args.target
+        limits = httpx.Limits(max_connections=args.concurrency if not args.rate else None)
+        client = httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits)
+
+    async def session():
+        async with client:
+            return await run(client, args, warmup, bodies)
+
+    try:
+        summary = asyncio.run(session())
+        if process is not None and os.path.exists("/proc/{}/smaps_rollup".format(process.pid)):
+            # After the run, so it includes what serving traffic touched
+            summary["memory"] = server_memory(process.pid)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+    result = {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "mode": "open_loop" if args.rate else "closed_loop",
+        **summary,
+    }
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    return result
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,23 @@
-"""Streamlit dashboard for fraud detection monitoring."""
+"""Streamlit dashboard for fraud detection monitoring, read from the pre-aggregated rollups (monitor/rollups.py)."""
 import streamlit as st
 import pandas as pd
 import json
 import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from monitor.rollups import RollupStore, ROLLUP_DB, LIVE, HOUR, UNSCORED
+from monitor.metrics import SCORE_BUCKETS
 
 st.set_page_config(page_title="Fraud Detection Dashboard", page_icon="🛡️", layout="wide")
 st.title("🛡️ Fraud Detection Dashboard")
 
-@st.cache_data
-def load_data():
-    train_path = "data/transactions_train.csv"
-    test_path = "data/transactions_test.csv"
-    train_df = pd.read_csv(train_path) if os.path.exists(train_path) else pd.DataFrame()
-    test_df = pd.read_csv(test_path) if os.path.exists(test_path) else pd.DataFrame()
-    return train_df, test_df
+ROLLUP_PATH = os.environ.get("FRAUD_ROLLUP_DB", ROLLUP_DB)
+LIVE_WINDOWS = {"Last 15 minutes": 900, "Last hour": 3600, "Last 6 hours": 6 * 3600, "Last 24 hours": 24 * 3600}
+
+@st.cache_resource
+def get_store():
+    return RollupStore(ROLLUP_PATH)
 
 @st.cache_data
 def load_metrics():
@@ -23,36 +27,111 @@ def load_metrics():
             return json.load(f)
     return {}
 
-train_df, test_df = load_data()
+def to_datetime(seconds):
+    return pd.to_datetime(seconds, unit="s")
+
+def frame(rows, index):
+    df = pd.DataFrame(rows)
+    return df.set_index(index) if not df.empty else df
+
+if not os.path.exists(ROLLUP_PATH):
+    st.warning("No rollups yet. Run `make gen train`, or score traffic with FRAUD_ROLLUPS=1.")
+    st.stop()
+
+store = get_store()
 model_metrics = load_metrics()
+sources = store.sources()
 
 st.sidebar.header("Controls")
-data_source = st.sidebar.selectbox("Data Source", ["Train", "Test"])
-df = train_df if data_source == "Train" else test_df
+data_source = st.sidebar.selectbox("Data Source", sources, format_func=str.title) if sources else None
+
+if data_source is not None:
+    first, last = store.time_range(data_source)
+    start, end = st.sidebar.slider("Time Range", min_value=to_datetime(first).to_pydatetime(),
+                                   max_value=to_datetime(last + HOUR).to_pydatetime(),
+                                   value=(to_datetime(first).to_pydatetime(), to_datetime(last + HOUR).to_pydatetime()),
+                                   step=pd.Timedelta(hours=1).to_pytimedelta(), format="YYYY-MM-DD HH:mm")
+    start, end = int(pd.Timestamp(start).timestamp()), int(pd.Timestamp(end).timestamp())
+    totals = store.totals(data_source, start, end)
+    labeled = totals["labeled_count"]
 
-if not df.empty:
     col1, col2, col3, col4 = st.columns(4)
     with col1:
-        st.metric("Total Transactions", "{:,}".format(len(df)))
+        st.metric("Total Transactions", "{:,}".format(totals["count"]))
     with col2:
-        st.metric("Fraud Rate", "{:.2f}%".format(df["is_fraud"].mean() * 100))
+        if labeled:
+            st.metric("Fraud Rate", "{:.2f}%".format(totals["fraud_count"] / labeled * 100))
+        else:
+            st.metric("Mean Fraud Score", "{:.4f}".format(totals["score_sum"] / totals["count"]) if totals["count"] else "N/A")
     with col3:
         st.metric("Model AUC", "{:.4f}".format(model_metrics.get("auc", 0)) if model_metrics else "N/A")
     with col4:
-        st.metric("Avg Amount", "${:.2f}".format(df["amount"].mean()))
-    
+        st.metric("Avg Amount", "${:.2f}".format(totals["amount_sum"] / totals["count"]) if totals["count"] else "N/A")
+
     st.divider()
+    by_hour = pd.DataFrame(store.by_hour(data_source, start, end))
+    col1, col2 = st.columns(2)
+    with col1:
+        if labeled:
+            st.subheader("Transaction Amount by Type")
+            fraud_amount = totals["fraud_amount_sum"]
+            st.bar_chart(pd.Series({
+                0: (totals["amount_sum"] - fraud_amount) / max(labeled - totals["fraud_count"], 1),
+                1: fraud_amount / max(totals["fraud_count"], 1),
+            }, name="amount"))
+        elif not by_hour.empty:
+            st.subheader("Decisions per Hour")
+            by_hour["hour"] = to_datetime(by_hour["hour"])
+            st.bar_chart(by_hour[by_hour["decision"] != UNSCORED].pivot(index="hour", columns="decision", values="count"))
+    with col2:
+        hour_of_day = frame(store.by_hour_of_day(data_source, start, end), "hour_of_day")
+        if labeled and not hour_of_day.empty:
+            st.subheader("Fraud by Hour")
+            st.line_chart(hour_of_day["fraud_count"] / hour_of_day["labeled_count"].clip(lower=1) * 100)
+        elif not by_hour.empty:
+            st.subheader("Transactions per Hour")
+            st.line_chart(by_hour.groupby("hour")["count"].sum())
+
     col1, col2 = st.columns(2)
     with col1:
-        st.subheader("Transaction Amount by Type")
-        amount_data = df.groupby("is_fraud")["amount"].mean()
-        st.bar_chart(amount_data)
+        scores = frame(store.score_histogram(data_source, start, end), "score_bucket")
+        if not scores.empty:
+            st.subheader("Score Distribution")
+            scores.index = ["{:.2f}".format(bucket / SCORE_BUCKETS) for bucket in scores.index]
+            st.bar_chart(scores["count"])
     with col2:
-        st.subheader("Fraud by Hour")
-        hourly = df.groupby("hour")["is_fraud"].mean() * 100
-        st.line_chart(hourly)
-    
-    st.subheader("Sample Transactions")
-    st.dataframe(df.head(100)[["transaction_id", "user_id", "amount", "hour", "velocity_1h", "is_new_device", "is_fraud"]])
+        rules = frame(store.rule_counts(data_source, start, end), "rule")
+        if not rules.empty:
+            st.subheader("Rules Triggered")
+            st.bar_chart(rules["count"])
 else:
-    st.warning("No data available. Run `make gen` to generate data.")
+    st.info("No transactions rolled up yet.")
+
+@st.fragment(run_every=5)
+def live_panels():
+    st.header("Live Serving")
+    window = LIVE_WINDOWS[st.selectbox("Window", list(LIVE_WINDOWS))]
+    now = int(time.time())
+    serving = frame(store.serving(now - window, now + 60), "minute")
+    if serving.empty:
+        st.info("No live traffic in this window. Start the scorer with FRAUD_ROLLUPS=1.")
+        return
+    serving.index = to_datetime(serving.index)
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.subheader("Throughput (transactions/s)")
+        st.line_chart(serving["transactions"] / 60)
+    with col2:
+        st.subheader("Latency (ms)")
+        st.line_chart(serving[[col for col in ("p50", "p99") if col in serving]])
+    with col3:
+        st.subheader("Errors per Minute")
+        st.bar_chart(serving["errors"])
+    drift = pd.DataFrame(store.drift(now - window, now + 60))
+    if not drift.empty:
+        st.subheader("Drift (PSI, sliding hour)")
+        drift["minute"] = to_datetime(drift["minute"])
+        st.line_chart(drift.pivot(index="minute", columns="feature", values="psi"))
+
+if LIVE in sources or store.serving(int(time.time()) - 24 * 3600, int(time.time()) + 60):
+    live_panels()
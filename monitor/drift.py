@@ -1,17 +1,34 @@
 """PSI-based drift detection for fraud model."""
+import json
+import time
+import sys
+import os
 import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-def calculate_psi(expected, actual, bins=10):
-    """Calculate Population Stability Index."""
+SCORE_COLUMN = "ml_score"
+
+def reference_breakpoints(expected, bins=10):
+    """Percentile bin edges of the reference data, open-ended at both sides."""
     breakpoints = np.percentile(expected, np.linspace(0, 100, bins + 1))
     breakpoints[0] = -np.inf
     breakpoints[-1] = np.inf
+    return breakpoints
+
+def bin_percentages(counts, total, bins):
+    return (counts + 0.001) / (total + 0.001 * bins)
+
+def psi_from_percentages(expected_pct, actual_pct):
+    return np.sum((actual_pct - expected_pct) * np.log(actual_pct / expected_pct), axis=-1)
+
+def calculate_psi(expected, actual, bins=10):
+    """Calculate Population Stability Index."""
+    breakpoints = reference_breakpoints(expected, bins)
     expected_counts = np.histogram(expected, bins=breakpoints)[0]
     actual_counts = np.histogram(actual, bins=breakpoints)[0]
-    expected_pct = (expected_counts + 0.001) / (len(expected) + 0.001 * bins)
-    actual_pct = (actual_counts + 0.001) / (len(actual) + 0.001 * bins)
-    psi = np.sum((actual_pct - expected_pct) * np.log(actual_pct / expected_pct))
-    return psi
+    expected_pct = bin_percentages(expected_counts, len(expected), bins)
+    actual_pct = bin_percentages(actual_counts, len(actual), bins)
+    return psi_from_percentages(expected_pct, actual_pct)
 
 def interpret_psi(psi):
     if psi < 0.1:
@@ -21,16 +38,70 @@ def interpret_psi(psi):
     else:
         return "SIGNIFICANT_DRIFT"
 
+class ReferenceProfile:
+    """Precomputed bin edges and expected bin percentages for each column of the reference data."""
+
+    def __init__(self, columns, edges, expected_pct):
+        self.columns = list(columns)
+        # Inner edges only, shape (columns, bins - 1); the outer bins are open-ended
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.expected_pct = np.asarray(expected_pct, dtype=np.float64)
+        self.bins = self.expected_pct.shape[1]
+
+    @classmethod
+    def from_data(cls, data, columns, bins=10):
+        """Profile columns of a DataFrame or dict of arrays, or of a 2-D array whose columns are named by columns."""
+        edges, expected_pct = [], []
+        for i, col in enumerate(columns):
+            values = np.asarray(data[:, i] if isinstance(data, np.ndarray) else data[col], dtype=np.float64)
+            breakpoints = reference_breakpoints(values, bins)
+            counts = np.histogram(values, bins=breakpoints)[0]
+            edges.append(breakpoints[1:-1])
+            expected_pct.append(bin_percentages(counts, len(values), bins))
+        return cls(columns, edges, expected_pct)
+
+    def subset(self, columns):
+        idx = [self.columns.index(c) for c in columns]
+        return ReferenceProfile(columns, self.edges[idx], self.expected_pct[idx])
+
+    def bin_index(self, values):
+        """Bin of each column for one row, or for each row of a 2-D array."""
+        values = np.asarray(values, dtype=np.float64)
+        # Counting inner edges <= value matches np.histogram's half-open [a, b) bins
+        return (self.edges <= values[..., None]).sum(axis=-1)
+
+    def column_psi(self, i, values):
+        """PSI of an array of values for column i."""
+        counts = np.bincount(np.searchsorted(self.edges[i], values, side="right"), minlength=self.bins)
+        return psi_from_percentages(self.expected_pct[i], bin_percentages(counts, len(values), self.bins))
+
+    def psi(self, counts):
+        """PSI per column from (columns, bins) observed counts."""
+        totals = counts.sum(axis=1, keepdims=True)
+        return psi_from_percentages(self.expected_pct, bin_percentages(counts, totals, self.bins))
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({"columns": self.columns, "edges": self.edges.tolist(), "expected_pct": self.expected_pct.tolist()}, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data["columns"], data["edges"], data["expected_pct"])
+
 class DriftMonitor:
     def __init__(self, reference_data, feature_columns):
         self.reference = reference_data
         self.feature_columns = feature_columns
-        
+        # Reference bins are computed once instead of on every check
+        self.profile = ReferenceProfile.from_data(reference_data, [c for c in feature_columns if c in reference_data.columns])
+
     def check_drift(self, current_data):
         results = {"features": {}, "overall_status": "NO_DRIFT", "max_psi": 0.0}
-        for col in self.feature_columns:
-            if col in self.reference.columns and col in current_data.columns:
-                psi = calculate_psi(self.reference[col].values, current_data[col].values)
+        for i, col in enumerate(self.profile.columns):
+            if col in current_data.columns:
+                psi = self.profile.column_psi(i, current_data[col].values)
                 results["features"][col] = {"psi": round(psi, 4), "status": interpret_psi(psi)}
                 results["max_psi"] = max(results["max_psi"], psi)
         if results["max_psi"] >= 0.2:
@@ -38,3 +109,112 @@ class DriftMonitor:
         elif results["max_psi"] >= 0.1:
             results["overall_status"] = "SLIGHT_DRIFT"
         return results
+
+class StreamingDriftMonitor:
+    """PSI over live traffic from per-column bin counts, updated in O(1) per observation.
+
+    The sliding window is a ring of n_slots time slots of slot_seconds each; the tumbling
+    window restarts every tumbling_seconds and keeps the PSI of the last completed window.
+    """
+
+    def __init__(self, profile, slot_seconds=60, n_slots=60, tumbling_seconds=3600):
+        self.profile = profile
+        self.slot_seconds = slot_seconds
+        self.n_slots = n_slots
+        self.tumbling_seconds = tumbling_seconds
+        n_columns = len(profile.columns)
+        # Offset of each column's bins in a flattened (columns * bins) count row
+        self._offsets = np.arange(n_columns) * profile.bins
+        self._slots = np.zeros((n_slots, n_columns, profile.bins), dtype=np.int64)
+        self._slot_rows = self._slots.reshape(n_slots, -1)
+        self._tumbling = np.zeros((n_columns, profile.bins), dtype=np.int64)
+        self._tumbling_row = self._tumbling.reshape(-1)
+        self._slot_epoch = None
+        self._tumbling_epoch = None
+        self._slot = 0
+        self._boundary = -np.inf
+        self.last_tumbling = None
+        self.total = 0
+
+    def _advance(self, now):
+        """Current ring slot, expiring old slots and closing the tumbling window as time passes."""
+        if now < self._boundary:
+            return self._slot
+        slot_epoch = int(now // self.slot_seconds)
+        if self._slot_epoch is not None and slot_epoch > self._slot_epoch:
+            expired = np.arange(self._slot_epoch + 1, min(slot_epoch, self._slot_epoch + self.n_slots) + 1) % self.n_slots
+            self._slots[expired] = 0
+        self._slot_epoch = max(slot_epoch, self._slot_epoch or slot_epoch)
+        tumbling_epoch = int(now // self.tumbling_seconds)
+        if self._tumbling_epoch is not None and tumbling_epoch > self._tumbling_epoch:
+            self.last_tumbling = self._report(self._tumbling)
+            self.last_tumbling["window_start"] = self._tumbling_epoch * self.tumbling_seconds
+            self._tumbling[:] = 0
+        self._tumbling_epoch = max(tumbling_epoch, self._tumbling_epoch or tumbling_epoch)
+        self._slot = self._slot_epoch % self.n_slots
+        self._boundary = min((self._slot_epoch + 1) * self.slot_seconds, (self._tumbling_epoch + 1) * self.tumbling_seconds)
+        return self._slot
+
+    def update(self, values, now=None):
+        """Count one observation with a value per profiled column."""
+        slot = self._advance(time.time() if now is None else now)
+        idx = self._offsets + self.profile.bin_index(values)
+        self._slot_rows[slot][idx] += 1
+        self._tumbling_row[idx] += 1
+        self.total += 1
+
+    def update_batch(self, values, now=None):
+        """Count every row of a (rows, columns) array."""
+        slot = self._advance(time.time() if now is None else now)
+        bins = self.profile.bin_index(values)
+        counts = np.bincount((self._offsets + bins).ravel(), minlength=self._tumbling_row.size)
+        self._slot_rows[slot] += counts
+        self._tumbling_row += counts
+        self.total += len(bins)
+
+    def _report(self, counts):
+        observed = int(counts[0].sum())
+        psi = self.profile.psi(counts) if observed else np.zeros(len(self.profile.columns))
+        return {
+            "count": observed,
+            "max_psi": round(float(psi.max()), 4),
+            "status": interpret_psi(psi.max()),
+            "psi": {col: round(float(p), 4) for col, p in zip(self.profile.columns, psi)},
+        }
+
+    def prometheus_lines(self, name, help_text, now=None):
+        """PSI gauges per column and window for render_prometheus extra_lines."""
+        report = self.report(now)
+        lines = ["# HELP {} {}".format(name, help_text), "# TYPE {} gauge".format(name)]
+        for window in ("sliding", "tumbling"):
+            for col, psi in report[window]["psi"].items():
+                lines.append('{}{{column="{}",window="{}"}} {}'.format(name, col, window, psi))
+        return lines
+
+    def report(self, now=None):
+        """PSI per column over the sliding window, the current tumbling window and the last completed one."""
+        self._advance(time.time() if now is None else now)
+        return {
+            "sliding": self._report(self._slots.sum(axis=0)),
+            "tumbling": self._report(self._tumbling),
+            "last_tumbling": self.last_tumbling,
+        }
+
+def main():
+    """PSI of the test split against the reference profile saved with the latest model."""
+    from scorer import model_loader
+    from scorer.features import extract_features_frame, FEATURE_NAMES, INPUT_COLUMNS
+    from simulator.dataset import read_transactions, split_path
+    path, version = model_loader.resolve_model_path(model_file=model_loader.DRIFT_REFERENCE_FILE)
+    profile = ReferenceProfile.load(path).subset(FEATURE_NAMES)
+    X = extract_features_frame(read_transactions(split_path("test"), INPUT_COLUMNS))
+    print("Drift against model {} reference:".format(version))
+    max_psi = 0.0
+    for i, name in enumerate(FEATURE_NAMES):
+        psi = profile.column_psi(i, X[:, i])
+        max_psi = max(max_psi, psi)
+        print("  {}: {:.4f} {}".format(name, psi, interpret_psi(psi)))
+    print("Overall: {}".format(interpret_psi(max_psi)))
+
+if __name__ == "__main__":
+    main()
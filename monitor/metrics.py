@@ -1,46 +1,329 @@
 """Operational metrics for fraud scoring service."""
 from dataclasses import dataclass, field
-from typing import Dict
-from collections import deque
+from typing import List
+import json
+import os
 import threading
 
+DECISIONS = ("APPROVE", "REVIEW", "DECLINE")
+SCORE_BUCKETS = 20
+# Coarse bucket bounds (ms) used when exporting latency histograms to Prometheus
+PROMETHEUS_LATENCY_BOUNDS_MS = (0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+QUANTILES = {"p50": 0.5, "p90": 0.9, "p99": 0.99, "p999": 0.999}
+# Totals of exited worker processes, kept by the launcher so counters never go backwards
+RETIRED_SNAPSHOT = "retired.json"
+
+class LatencyHistogram:
+    """Log-linear (HDR-style) histogram of millisecond values in fixed integer-microsecond buckets.
+
+    Values below 2**sub_bucket_bits us get one bucket each; every power of two above that is split
+    into 2**sub_bucket_bits buckets, so relative error stays under 1 / 2**sub_bucket_bits.
+    """
+
+    def __init__(self, sub_bucket_bits=5, max_exponent=40):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_buckets = 1 << sub_bucket_bits
+        self.max_value = (1 << max_exponent) - 1
+        n_buckets = self.sub_buckets * (max_exponent - sub_bucket_bits + 1)
+        self.counts = [0] * n_buckets
+        self.total = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+
+    def index(self, value_us):
+        if value_us < self.sub_buckets:
+            return value_us
+        shift = value_us.bit_length() - 1 - self.sub_bucket_bits
+        return self.sub_buckets * (shift + 1) + (value_us >> shift) - self.sub_buckets
+
+    def bucket_bounds(self, index):
+        """[lower, upper) bucket bounds in microseconds."""
+        if index < self.sub_buckets:
+            return index, index + 1
+        shift = index // self.sub_buckets - 1
+        lower = (self.sub_buckets + index % self.sub_buckets) << shift
+        return lower, lower + (1 << shift)
+
+    def record(self, value_ms):
+        value_us = min(max(int(value_ms * 1000), 0), self.max_value)
+        self.counts[self.index(value_us)] += 1
+        self.total += 1
+        self.sum_ms += value_ms
+        if value_ms > self.max_ms:
+            self.max_ms = value_ms
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            if count:
+                self.counts[i] += count
+        self.total += other.total
+        self.sum_ms += other.sum_ms
+        self.max_ms = max(self.max_ms, other.max_ms)
+        return self
+
+    def quantile(self, q):
+        """Upper bound (ms) of the bucket holding the q-th quantile."""
+        if not self.total:
+            return 0.0
+        rank = q * self.total
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(self.bucket_bounds(i)[1] / 1000, self.max_ms)
+        return self.max_ms
+
+    def cumulative_counts(self, bounds_ms):
+        """Counts of values <= each bound, at bucket resolution."""
+        result = []
+        seen = 0
+        i = 0
+        for bound in bounds_ms:
+            bound_us = bound * 1000
+            while i < len(self.counts) and self.bucket_bounds(i)[1] <= bound_us:
+                seen += self.counts[i]
+                i += 1
+            result.append(seen)
+        return result
+
+    def to_dict(self):
+        return {"counts": {i: c for i, c in enumerate(self.counts) if c}, "sum_ms": self.sum_ms, "max_ms": self.max_ms}
+
+    @classmethod
+    def from_dict(cls, data):
+        hist = cls()
+        for i, count in data["counts"].items():
+            hist.counts[int(i)] = count
+        hist.total = sum(hist.counts)
+        hist.sum_ms = data["sum_ms"]
+        hist.max_ms = data["max_ms"]
+        return hist
+
+class _Shard:
+    """Counters owned and written by a single thread."""
+
+    def __init__(self):
+        self.request_count = 0
+        self.error_count = 0
+        self.decisions = dict.fromkeys(DECISIONS, 0)
+        self.scores = [0] * SCORE_BUCKETS
+        self.score_sum = 0.0
+        self.latency = LatencyHistogram()
+        self.batch_latency = LatencyHistogram()
+        # (endpoint, stage) -> LatencyHistogram
+        self.stages = {}
+
 @dataclass
 class MetricsCollector:
-    window_size: int = 1000
-    _latencies: deque = field(default_factory=lambda: deque(maxlen=1000))
-    _decisions: Dict[str, int] = field(default_factory=lambda: {"APPROVE": 0, "REVIEW": 0, "DECLINE": 0})
-    _scores: deque = field(default_factory=lambda: deque(maxlen=1000))
-    _request_count: int = 0
-    _error_count: int = 0
-    _lock: threading.Lock = field(default_factory=threading.Lock)
-    
+    """Request metrics recorded without locks into per-thread shards and merged on read."""
+    _shards: List[_Shard] = field(default_factory=list)
+    _local: threading.local = field(default_factory=threading.local)
+    _register_lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._register_lock:
+                self._shards.append(shard)
+        return shard
+
     def record_request(self, latency_ms, decision, fraud_score):
-        with self._lock:
-            self._latencies.append(latency_ms)
-            self._decisions[decision] = self._decisions.get(decision, 0) + 1
-            self._scores.append(fraud_score)
-            self._request_count += 1
-    
+        shard = self._shard()
+        shard.latency.record(latency_ms)
+        shard.decisions[decision] = shard.decisions.get(decision, 0) + 1
+        shard.scores[min(int(fraud_score * SCORE_BUCKETS), SCORE_BUCKETS - 1)] += 1
+        shard.score_sum += fraud_score
+        shard.request_count += 1
+
+    def record_batch(self, latency_ms, decisions, fraud_scores):
+        """One /score/batch call: a single latency sample, per-transaction decisions and scores."""
+        shard = self._shard()
+        shard.batch_latency.record(latency_ms)
+        for decision, fraud_score in zip(decisions, fraud_scores):
+            shard.decisions[decision] = shard.decisions.get(decision, 0) + 1
+            shard.scores[min(int(fraud_score * SCORE_BUCKETS), SCORE_BUCKETS - 1)] += 1
+            shard.score_sum += fraud_score
+        shard.request_count += len(decisions)
+
     def record_error(self):
-        with self._lock:
-            self._error_count += 1
-    
+        self._shard().error_count += 1
+
+    def record_stages(self, endpoint, stages_ns):
+        """perf_counter_ns durations of each stage of one request."""
+        shard = self._shard()
+        for stage, duration_ns in stages_ns.items():
+            hist = shard.stages.get((endpoint, stage))
+            if hist is None:
+                hist = shard.stages[(endpoint, stage)] = LatencyHistogram()
+            hist.record(duration_ns / 1e6)
+
+    def snapshot(self):
+        """Merged counters from every thread as a JSON-serializable dict."""
+        merged = _Shard()
+        for shard in list(self._shards):
+            merged.request_count += shard.request_count
+            merged.error_count += shard.error_count
+            for decision, count in list(shard.decisions.items()):
+                merged.decisions[decision] = merged.decisions.get(decision, 0) + count
+            merged.scores = [a + b for a, b in zip(merged.scores, shard.scores)]
+            merged.score_sum += shard.score_sum
+            merged.latency.merge(shard.latency)
+            merged.batch_latency.merge(shard.batch_latency)
+            for key, hist in list(shard.stages.items()):
+                merged.stages.setdefault(key, LatencyHistogram()).merge(hist)
+        stages = {}
+        for (endpoint, stage), hist in merged.stages.items():
+            stages.setdefault(endpoint, {})[stage] = hist.to_dict()
+        return {
+            "request_count": merged.request_count,
+            "error_count": merged.error_count,
+            "decisions": merged.decisions,
+            "scores": merged.scores,
+            "score_sum": merged.score_sum,
+            "latency": merged.latency.to_dict(),
+            "batch_latency": merged.batch_latency.to_dict(),
+            "stages": stages,
+        }
+
     def get_metrics(self):
-        with self._lock:
-            latencies = list(self._latencies)
-            if latencies:
-                latency_stats = {
-                    "p50": sorted(latencies)[len(latencies) // 2],
-                    "p95": sorted(latencies)[int(len(latencies) * 0.95)],
-                    "mean": sum(latencies) / len(latencies),
-                }
-            else:
-                latency_stats = {"p50": 0, "p95": 0, "mean": 0}
-            return {
-                "request_count": self._request_count,
-                "error_count": self._error_count,
-                "latency_ms": latency_stats,
-                "decisions": self._decisions.copy(),
-            }
+        return summarize(self.snapshot())
+
+def merge_snapshots(snapshots):
+    """Combine snapshots, e.g. from several worker processes."""
+    merged = {"request_count": 0, "error_count": 0, "decisions": dict.fromkeys(DECISIONS, 0),
+              "scores": [0] * SCORE_BUCKETS, "score_sum": 0.0}
+    latency, batch_latency = LatencyHistogram(), LatencyHistogram()
+    stages = {}
+    for snap in snapshots:
+        merged["request_count"] += snap["request_count"]
+        merged["error_count"] += snap["error_count"]
+        for decision, count in snap["decisions"].items():
+            merged["decisions"][decision] = merged["decisions"].get(decision, 0) + count
+        merged["scores"] = [a + b for a, b in zip(merged["scores"], snap["scores"])]
+        merged["score_sum"] += snap["score_sum"]
+        latency.merge(LatencyHistogram.from_dict(snap["latency"]))
+        batch_latency.merge(LatencyHistogram.from_dict(snap["batch_latency"]))
+        for endpoint, endpoint_stages in snap.get("stages", {}).items():
+            for stage, hist in endpoint_stages.items():
+                stages.setdefault((endpoint, stage), LatencyHistogram()).merge(LatencyHistogram.from_dict(hist))
+    merged["latency"] = latency.to_dict()
+    merged["batch_latency"] = batch_latency.to_dict()
+    merged["stages"] = {}
+    for (endpoint, stage), hist in stages.items():
+        merged["stages"].setdefault(endpoint, {})[stage] = hist.to_dict()
+    return merged
+
+def worker_snapshot_path(directory, pid):
+    return os.path.join(directory, "worker-{}.json".format(pid))
+
+def write_snapshot(path, snapshot):
+    """Atomically replace a snapshot file, so readers never see a partial one."""
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "w") as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)
+
+def read_snapshot(path):
+    """A snapshot file, or None when it is missing."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def read_snapshots(directory, exclude=()):
+    """Every worker and retired snapshot in a directory, except the given paths."""
+    snapshots = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.endswith(".json") and path not in exclude:
+            snapshot = read_snapshot(path)
+            if snapshot is not None:
+                snapshots.append(snapshot)
+    return snapshots
+
+def retire_snapshot(directory, pid):
+    """Fold an exited worker's last snapshot into the retired totals and remove its file."""
+    path = worker_snapshot_path(directory, pid)
+    snapshot = read_snapshot(path)
+    if snapshot is None:
+        return
+    retired_path = os.path.join(directory, RETIRED_SNAPSHOT)
+    retired = read_snapshot(retired_path)
+    write_snapshot(retired_path, merge_snapshots([retired, snapshot] if retired is not None else [snapshot]))
+    os.remove(path)
+
+def latency_stats(hist):
+    stats = {name: hist.quantile(q) for name, q in QUANTILES.items()}
+    stats["mean"] = hist.sum_ms / hist.total if hist.total else 0
+    stats["max"] = hist.max_ms
+    return stats
+
+def summarize(snapshot):
+    return {
+        "request_count": snapshot["request_count"],
+        "error_count": snapshot["error_count"],
+        "latency_ms": latency_stats(LatencyHistogram.from_dict(snapshot["latency"])),
+        "stages_ms": {
+            endpoint: {stage: latency_stats(LatencyHistogram.from_dict(hist)) for stage, hist in stages.items()}
+            for endpoint, stages in snapshot.get("stages", {}).items()
+        },
+        "decisions": dict(snapshot["decisions"]),
+    }
+
+def _prometheus_series(lines, name, hist, labels=""):
+    prefix = labels + "," if labels else ""
+    for bound, count in zip(PROMETHEUS_LATENCY_BOUNDS_MS, hist.cumulative_counts(PROMETHEUS_LATENCY_BOUNDS_MS)):
+        lines.append('{}_bucket{{{}le="{}"}} {}'.format(name, prefix, bound / 1000, count))
+    lines.append('{}_bucket{{{}le="+Inf"}} {}'.format(name, prefix, hist.total))
+    suffix = "{" + labels + "}" if labels else ""
+    lines.append("{}_sum{} {}".format(name, suffix, hist.sum_ms / 1000))
+    lines.append("{}_count{} {}".format(name, suffix, hist.total))
+
+def _prometheus_histogram(lines, name, help_text, hist):
+    lines += ["# HELP {} {}".format(name, help_text), "# TYPE {} histogram".format(name)]
+    _prometheus_series(lines, name, hist)
+
+def render_prometheus(snapshot, extra_lines=()):
+    """Prometheus text exposition (format 0.0.4) of a snapshot."""
+    latency = LatencyHistogram.from_dict(snapshot["latency"])
+    lines = [
+        "# HELP fraud_transactions_scored_total Transactions scored by /score and /score/batch.",
+        "# TYPE fraud_transactions_scored_total counter",
+        "fraud_transactions_scored_total {}".format(snapshot["request_count"]),
+        "# HELP fraud_errors_total Scoring requests that failed.",
+        "# TYPE fraud_errors_total counter",
+        "fraud_errors_total {}".format(snapshot["error_count"]),
+        "# HELP fraud_decisions_total Scoring decisions by outcome.",
+        "# TYPE fraud_decisions_total counter",
+    ]
+    for decision, count in sorted(snapshot["decisions"].items()):
+        lines.append('fraud_decisions_total{{decision="{}"}} {}'.format(decision, count))
+    _prometheus_histogram(lines, "fraud_request_latency_seconds", "Latency of single /score requests.", latency)
+    _prometheus_histogram(lines, "fraud_batch_latency_seconds", "Latency of /score/batch requests.",
+                          LatencyHistogram.from_dict(snapshot["batch_latency"]))
+    lines += ["# HELP fraud_stage_latency_seconds Time spent in each stage of a request.",
+              "# TYPE fraud_stage_latency_seconds histogram"]
+    for endpoint, stages in sorted(snapshot.get("stages", {}).items()):
+        for stage, hist in stages.items():
+            _prometheus_series(lines, "fraud_stage_latency_seconds", LatencyHistogram.from_dict(hist),
+                               'endpoint="{}",stage="{}"'.format(endpoint, stage))
+    lines += [
+        "# HELP fraud_request_latency_quantile_seconds /score latency quantiles from the HDR histogram.",
+        "# TYPE fraud_request_latency_quantile_seconds gauge",
+    ]
+    for q in QUANTILES.values():
+        lines.append('fraud_request_latency_quantile_seconds{{quantile="{}"}} {}'.format(q, latency.quantile(q) / 1000))
+    lines += ["# HELP fraud_score Distribution of blended fraud scores.", "# TYPE fraud_score histogram"]
+    seen = 0
+    for i, count in enumerate(snapshot["scores"]):
+        seen += count
+        lines.append('fraud_score_bucket{{le="{}"}} {}'.format(round((i + 1) / SCORE_BUCKETS, 4), seen))
+    lines.append('fraud_score_bucket{{le="+Inf"}} {}'.format(seen))
+    lines.append("fraud_score_sum {}".format(snapshot["score_sum"]))
+    lines.append("fraud_score_count {}".format(seen))
+    lines += list(extra_lines)
+    return "\n".join(lines) + "\n"
 
 metrics = MetricsCollector()
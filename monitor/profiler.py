@@ -0,0 +1,173 @@
+"""On-demand profiling of the scorer, switched on and off through the admin API.
+
+"sampling" is a statistical profiler: a background thread records every other thread's stack
+at a fixed interval and counts them as collapsed stacks (Brendan Gregg's folded format, one
+"frame;frame;frame count" line per stack), ready for flamegraph.pl or speedscope.
+"cprofile" runs cProfile around a random sample of requests and exports the merged pstats,
+which snakeviz and flameprof render as flame graphs.
+"""
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+MODES = ("sampling", "cprofile")
+
+def frame_name(frame):
+    code = frame.f_code
+    return "{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+def collapse_stack(frame):
+    """Root-first "a;b;c" names of a frame and its callers."""
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+class StackSampler:
+    """Counts the stacks of all other threads every interval_s seconds."""
+
+    def __init__(self, interval_s=0.005):
+        self.interval_s = interval_s
+        self.counts = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    self.counts["{};{}".format(names.get(ident, ident), collapse_stack(frame))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        # copy() is a single dict merge under the GIL, so the sampler thread can keep counting
+        return "".join("{} {}\n".format(stack, count) for stack, count in self.counts.copy().most_common())
+
+class RequestProfiler:
+    """cProfile around a sample_rate fraction of requests, merged into one pstats profile.
+
+    A profile hooks its whole thread, so on the event loop it also sees requests interleaved
+    with the sampled one; only one profile runs at a time.
+    """
+
+    def __init__(self, sample_rate=0.01):
+        self.sample_rate = sample_rate
+        self.profiled = 0
+        self.stats = None
+        self._active = False
+        self._lock = threading.Lock()
+
+    def begin(self):
+        if self._active or random.random() >= self.sample_rate:
+            return None
+        with self._lock:
+            if self._active:
+                return None
+            self._active = True
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def end(self, profile):
+        profile.disable()
+        with self._lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+            self.profiled += 1
+            self._active = False
+
+    def dump(self):
+        """The merged profile in the pstats file format (pstats.Stats(path) reads it back)."""
+        with self._lock:
+            return marshal.dumps(self.stats.stats) if self.stats is not None else None
+
+    def top(self, limit=30):
+        with self._lock:
+            if self.stats is None:
+                return ""
+            out = io.StringIO()
+            self.stats.stream = out
+            self.stats.sort_stats("cumulative").print_stats(limit)
+            return out.getvalue()
+
+class Profiler:
+    """The active profiling session; results stay available after it is stopped."""
+
+    def __init__(self):
+        self.mode = None
+        self.running = False
+        self.started_at = None
+        self.stopped_at = None
+        self.sampler = None
+        self.requests = None
+
+    def start(self, mode="sampling", interval_ms=5.0, sample_rate=0.01):
+        if mode not in MODES:
+            raise ValueError("Unknown profiler mode {!r}, expected one of {}".format(mode, ", ".join(MODES)))
+        if not 0 < sample_rate <= 1:
+            raise ValueError("sample_rate must be in (0, 1]")
+        if interval_ms <= 0:
+            raise ValueError("interval_ms must be positive")
+        self.stop()
+        self.sampler = self.requests = None
+        if mode == "sampling":
+            self.sampler = StackSampler(interval_ms / 1000)
+            self.sampler.start()
+        else:
+            self.requests = RequestProfiler(sample_rate)
+        self.mode, self.running = mode, True
+        self.started_at, self.stopped_at = time.time(), None
+        return self.status()
+
+    def stop(self):
+        if self.running:
+            if self.sampler is not None:
+                self.sampler.stop()
+            self.running = False
+            self.stopped_at = time.time()
+        return self.status()
+
+    def begin_request(self):
+        """A token for end_request when this request is sampled for cProfile, else None."""
+        requests = self.requests
+        if requests is None or not self.running:
+            return None
+        profile = requests.begin()
+        # The owner travels with the profile in case the session restarts mid-request
+        return (requests, profile) if profile is not None else None
+
+    def end_request(self, token):
+        requests, profile = token
+        requests.end(profile)
+
+    def status(self):
+        status = {"mode": self.mode, "running": self.running, "started_at": self.started_at, "stopped_at": self.stopped_at}
+        if self.sampler is not None:
+            status.update(interval_ms=self.sampler.interval_s * 1000, samples=self.sampler.samples, stacks=len(self.sampler.counts))
+        if self.requests is not None:
+            status.update(sample_rate=self.requests.sample_rate, profiled_requests=self.requests.profiled)
+        return status
+
+profiler = Profiler()
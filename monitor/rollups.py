@@ -0,0 +1,284 @@
+"""Incremental rollups of scored and labeled transactions in SQLite, for the dashboard.
+
+Transactions are counted per hour, decision and score bucket, rule hits per hour and rule, and
+serving traffic and latency per minute. A dashboard query over any time range reads a few rows
+per hour instead of the raw transactions. Writes are upserts that add to the stored counts, so
+several scorer workers and training runs can share one database.
+"""
+import os
+import sqlite3
+import threading
+from bisect import bisect_left
+import numpy as np
+
+from monitor.metrics import SCORE_BUCKETS
+
+ROLLUP_DB = os.path.join("data", "rollups.db")
+HOUR = 3600
+MINUTE = 60
+LIVE = "live"
+# Decision of rows that were never scored by the serving path, e.g. training splits
+UNSCORED = ""
+# Score bucket of rows without a score
+NO_SCORE = -1
+# Upper bounds (ms) of the per-minute latency buckets, about 19% apart from 0.05 ms to 13 s; one more bucket is unbounded
+LATENCY_BOUNDS_MS = tuple(round(0.05 * 2 ** (i / 4), 4) for i in range(73))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    source TEXT NOT NULL, hour INTEGER NOT NULL, decision TEXT NOT NULL, score_bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL, amount_sum REAL NOT NULL, score_sum REAL NOT NULL,
+    labeled_count INTEGER NOT NULL, fraud_count INTEGER NOT NULL, fraud_amount_sum REAL NOT NULL,
+    PRIMARY KEY (source, hour, decision, score_bucket)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rules (
+    source TEXT NOT NULL, hour INTEGER NOT NULL, rule TEXT NOT NULL, count INTEGER NOT NULL,
+    PRIMARY KEY (source, hour, rule)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS traffic (
+    minute INTEGER PRIMARY KEY, transactions INTEGER NOT NULL, errors INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS latency (
+    minute INTEGER NOT NULL, bucket INTEGER NOT NULL, count INTEGER NOT NULL, sum_ms REAL NOT NULL,
+    PRIMARY KEY (minute, bucket)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS drift (
+    minute INTEGER NOT NULL, feature TEXT NOT NULL, model_version TEXT NOT NULL, psi REAL NOT NULL,
+    PRIMARY KEY (minute, feature)
+) WITHOUT ROWID;
+"""
+
+UPSERT_TRANSACTIONS = """
+INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (source, hour, decision, score_bucket) DO UPDATE SET
+    count = count + excluded.count, amount_sum = amount_sum + excluded.amount_sum,
+    score_sum = score_sum + excluded.score_sum, labeled_count = labeled_count + excluded.labeled_count,
+    fraud_count = fraud_count + excluded.fraud_count, fraud_amount_sum = fraud_amount_sum + excluded.fraud_amount_sum
+"""
+UPSERT_RULES = "INSERT INTO rules VALUES (?, ?, ?, ?) ON CONFLICT (source, hour, rule) DO UPDATE SET count = count + excluded.count"
+UPSERT_TRAFFIC = """
+INSERT INTO traffic VALUES (?, ?, ?)
+ON CONFLICT (minute) DO UPDATE SET transactions = transactions + excluded.transactions, errors = errors + excluded.errors
+"""
+UPSERT_LATENCY = """
+INSERT INTO latency VALUES (?, ?, ?, ?)
+ON CONFLICT (minute, bucket) DO UPDATE SET count = count + excluded.count, sum_ms = sum_ms + excluded.sum_ms
+"""
+# Workers each see part of the traffic; the latest report for a minute wins
+UPSERT_DRIFT = "INSERT OR REPLACE INTO drift VALUES (?, ?, ?, ?)"
+
+def score_bucket(score):
+    return min(int(score * SCORE_BUCKETS), SCORE_BUCKETS - 1)
+
+def latency_bucket(latency_ms):
+    return bisect_left(LATENCY_BOUNDS_MS, latency_ms)
+
+def latency_quantile(counts, sums_ms, q):
+    """Upper bound (ms) of the latency bucket holding the q-th quantile; the mean for the unbounded bucket."""
+    total = sum(counts.values())
+    if not total:
+        return 0.0
+    seen = 0
+    for bucket in sorted(counts):
+        seen += counts[bucket]
+        if seen >= q * total:
+            break
+    if bucket < len(LATENCY_BOUNDS_MS):
+        return LATENCY_BOUNDS_MS[bucket]
+    return sums_ms[bucket] / counts[bucket]
+
+class RollupBatch:
+    """Rollup increments collected in memory and written by RollupStore.write in one transaction."""
+
+    def __init__(self):
+        # (source, hour, decision, score bucket) -> [count, amount, score, labeled, fraud, fraud amount]
+        self.transactions = {}
+        # (source, hour, rule) -> count
+        self.rules = {}
+        # minute -> [transactions, errors]
+        self.traffic = {}
+        # (minute, latency bucket) -> [count, sum ms]
+        self.latency = {}
+        # (minute, feature) -> (model version, psi)
+        self.drift = {}
+
+    def __bool__(self):
+        return bool(self.transactions or self.rules or self.traffic or self.latency or self.drift)
+
+    def _add_transactions(self, key, count, amount, score, labeled=0, fraud=0, fraud_amount=0.0):
+        row = self.transactions.get(key)
+        if row is None:
+            self.transactions[key] = [count, amount, score, labeled, fraud, fraud_amount]
+        else:
+            row[0] += count
+            row[1] += amount
+            row[2] += score
+            row[3] += labeled
+            row[4] += fraud
+            row[5] += fraud_amount
+
+    def _add_traffic(self, now, transactions, errors):
+        row = self.traffic.setdefault(int(now // MINUTE) * MINUTE, [0, 0])
+        row[0] += transactions
+        row[1] += errors
+
+    def add_scored(self, now, amount, decision, fraud_score, rules_triggered, source=LIVE):
+        """One transaction scored at epoch time now."""
+        hour = int(now // HOUR) * HOUR
+        self._add_transactions((source, hour, decision, score_bucket(fraud_score)), 1, amount, fraud_score)
+        for hit in rules_triggered:
+            key = (source, hour, hit["rule"])
+            self.rules[key] = self.rules.get(key, 0) + 1
+
+    def add_rows(self, source, timestamps, amounts, scores=None, decisions=None, is_fraud=None, rules_triggered=()):
+        """Many transactions at once: epoch-second timestamps and amounts, with optional scores, decisions and labels."""
+        hours = (np.asarray(timestamps, dtype=np.float64) // HOUR).astype(np.int64) * HOUR
+        if not len(hours):
+            return
+        amounts = np.asarray(amounts, dtype=np.float64)
+        if decisions is None:
+            names, codes = np.array([UNSCORED]), np.zeros(len(hours), dtype=np.int64)
+        else:
+            names, codes = np.unique(np.asarray(decisions), return_inverse=True)
+        if scores is None:
+            scores = np.zeros(len(hours))
+            buckets = np.full(len(hours), NO_SCORE)
+        else:
+            scores = np.asarray(scores, dtype=np.float64)
+            buckets = np.minimum((scores * SCORE_BUCKETS).astype(np.int64), SCORE_BUCKETS - 1)
+        keys, inverse = np.unique(np.stack([hours, codes.reshape(-1), buckets], axis=1), axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+
+        def total(weights):
+            return np.bincount(inverse, weights, minlength=len(keys))
+
+        counts = np.bincount(inverse, minlength=len(keys))
+        amount_sums, score_sums = total(amounts), total(scores)
+        if is_fraud is None:
+            labeled = fraud = fraud_amounts = np.zeros(len(keys))
+        else:
+            is_fraud = np.asarray(is_fraud, dtype=np.float64)
+            labeled, fraud, fraud_amounts = counts, total(is_fraud), total(amounts * is_fraud)
+        for i, (hour, code, bucket) in enumerate(keys.tolist()):
+            self._add_transactions((source, hour, str(names[code]), bucket), int(counts[i]), float(amount_sums[i]),
+                                   float(score_sums[i]), int(labeled[i]), int(fraud[i]), float(fraud_amounts[i]))
+        for hour, hits in zip(hours.tolist(), rules_triggered):
+            for hit in hits:
+                key = (source, hour, hit["rule"])
+                self.rules[key] = self.rules.get(key, 0) + 1
+
+    def add_request(self, now, latency_ms, transactions=1):
+        """One served request and the transactions it scored."""
+        self._add_traffic(now, transactions, 0)
+        row = self.latency.setdefault((int(now // MINUTE) * MINUTE, latency_bucket(latency_ms)), [0, 0.0])
+        row[0] += 1
+        row[1] += latency_ms
+
+    def add_error(self, now):
+        self._add_traffic(now, 0, 1)
+
+    def add_drift(self, now, model_version, psi):
+        """PSI per feature (or score) name at epoch time now."""
+        minute = int(now // MINUTE) * MINUTE
+        for feature, value in psi.items():
+            self.drift[(minute, feature)] = (model_version, value)
+
+class RollupStore:
+    """The rollup database; safe to share between threads, and between processes through SQLite locking."""
+
+    def __init__(self, path=ROLLUP_DB, timeout=30.0):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        # WAL lets the dashboard read while workers write
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def write(self, batch):
+        """Add a batch's increments in one transaction."""
+        if not batch:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(UPSERT_TRANSACTIONS, [key + tuple(row) for key, row in batch.transactions.items()])
+            self._conn.executemany(UPSERT_RULES, [key + (count,) for key, count in batch.rules.items()])
+            self._conn.executemany(UPSERT_TRAFFIC, [(minute,) + tuple(row) for minute, row in batch.traffic.items()])
+            self._conn.executemany(UPSERT_LATENCY, [key + tuple(row) for key, row in batch.latency.items()])
+            self._conn.executemany(UPSERT_DRIFT, [(minute, feature, version, psi)
+                                                  for (minute, feature), (version, psi) in batch.drift.items()])
+
+    def replace_source(self, source, batch):
+        """Swap a source's rollups for the batch's, e.g. when training re-scores its splits."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM transactions WHERE source = ?", (source,))
+            self._conn.execute("DELETE FROM rules WHERE source = ?", (source,))
+        self.write(batch)
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params)]
+
+    def sources(self):
+        return [row["source"] for row in self._query("SELECT DISTINCT source FROM transactions ORDER BY source")]
+
+    def time_range(self, source):
+        """First and last hour with transactions for a source, or (None, None)."""
+        row = self._query("SELECT MIN(hour) AS first, MAX(hour) AS last FROM transactions WHERE source = ?", (source,))[0]
+        return row["first"], row["last"]
+
+    def totals(self, source, start, end):
+        """Counts and sums over hours in [start, end)."""
+        return self._query(
+            "SELECT COALESCE(SUM(count), 0) AS count, COALESCE(SUM(amount_sum), 0) AS amount_sum,"
+            " COALESCE(SUM(score_sum), 0) AS score_sum, COALESCE(SUM(labeled_count), 0) AS labeled_count,"
+            " COALESCE(SUM(fraud_count), 0) AS fraud_count, COALESCE(SUM(fraud_amount_sum), 0) AS fraud_amount_sum"
+            " FROM transactions WHERE source = ? AND hour >= ? AND hour < ?", (source, start, end))[0]
+
+    def by_hour(self, source, start, end):
+        """Per hour and decision: count, amount, labeled and fraud counts."""
+        return self._query(
+            "SELECT hour, decision, SUM(count) AS count, SUM(amount_sum) AS amount_sum, SUM(labeled_count) AS labeled_count,"
+            " SUM(fraud_count) AS fraud_count FROM transactions WHERE source = ? AND hour >= ? AND hour < ?"
+            " GROUP BY hour, decision ORDER BY hour", (source, start, end))
+
+    def by_hour_of_day(self, source, start, end):
+        return self._query(
+            "SELECT (hour / 3600) % 24 AS hour_of_day, SUM(count) AS count, SUM(labeled_count) AS labeled_count,"
+            " SUM(fraud_count) AS fraud_count FROM transactions WHERE source = ? AND hour >= ? AND hour < ?"
+            " GROUP BY hour_of_day ORDER BY hour_of_day", (source, start, end))
+
+    def score_histogram(self, source, start, end):
+        return self._query(
+            "SELECT score_bucket, SUM(count) AS count, SUM(fraud_count) AS fraud_count FROM transactions"
+            " WHERE source = ? AND hour >= ? AND hour < ? AND score_bucket >= 0 GROUP BY score_bucket ORDER BY score_bucket",
+            (source, start, end))
+
+    def rule_counts(self, source, start, end):
+        return self._query(
+            "SELECT rule, SUM(count) AS count FROM rules WHERE source = ? AND hour >= ? AND hour < ?"
+            " GROUP BY rule ORDER BY count DESC", (source, start, end))
+
+    def serving(self, start, end, quantiles=(0.5, 0.99)):
+        """Per minute in [start, end): transactions, errors, requests and latency quantiles."""
+        minutes = {row["minute"]: dict(row, requests=0, latency_sum_ms=0.0) for row in self._query(
+            "SELECT minute, transactions, errors FROM traffic WHERE minute >= ? AND minute < ? ORDER BY minute", (start, end))}
+        buckets = {}
+        for row in self._query("SELECT minute, bucket, count, sum_ms FROM latency WHERE minute >= ? AND minute < ?", (start, end)):
+            counts, sums = buckets.setdefault(row["minute"], ({}, {}))
+            counts[row["bucket"]], sums[row["bucket"]] = row["count"], row["sum_ms"]
+        for minute, (counts, sums) in buckets.items():
+            stats = minutes.setdefault(minute, {"minute": minute, "transactions": 0, "errors": 0})
+            stats.update(requests=sum(counts.values()), latency_sum_ms=sum(sums.values()))
+            for q in quantiles:
+                stats["p{:g}".format(q * 100)] = latency_quantile(counts, sums, q)
+        return [minutes[minute] for minute in sorted(minutes)]
+
+    def drift(self, start, end):
+        return self._query("SELECT minute, feature, model_version, psi FROM drift WHERE minute >= ? AND minute < ?"
+                           " ORDER BY minute", (start, end))
@@ -1,18 +1,179 @@
 """FastAPI fraud scoring service."""
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import List, Dict, Any
+from fastapi.responses import PlainTextResponse, Response
+from pydantic import BaseModel, ConfigDict
+from typing import List, Dict, Any, Optional
+from contextlib import asynccontextmanager
+import asyncio
+import json
 import time
+from time import perf_counter_ns
 import sys
 import os
+import numpy as np
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from scorer.features import extract_features, features_to_array
+from scorer.features import feature_buffer, write_features, extract_features_frame, transactions_to_columns, FEATURE_NAMES
+from scorer.decisions import serving_settings, blend, decide
 from scorer.rules import RulesEngine
 from scorer.model_loader import get_model_loader
+from scorer.batcher import MicroBatcher
+from scorer.feature_store import FeatureStore
+from scorer.timing import StageTimingMiddleware, mark
+from scorer.result_cache import ResultCache, LocalCache, cache_key, make_backend
+from monitor.metrics import (metrics, render_prometheus, summarize, merge_snapshots, read_snapshots, write_snapshot,
+                            worker_snapshot_path)
+from monitor.drift import StreamingDriftMonitor, SCORE_COLUMN
+from monitor.rollups import RollupBatch, RollupStore, ROLLUP_DB, LIVE
+from monitor.profiler import profiler, MODES as PROFILER_MODES
 
-app = FastAPI(title="Fraud Scoring API", version="1.0.0")
+# Set once the startup warm-up has loaded the model and scored a row; /ready reports it
+readiness = {"ready": False, "error": None, "load_seconds": None}
+
+async def warm_up():
+    """Load the serving model off the event loop and run one row through the serving path."""
+    start = perf_counter_ns()
+    try:
+        loaded = await asyncio.get_running_loop().run_in_executor(None, get_model_loader().current)
+        drift_monitors(loaded)
+        row = np.zeros(len(FEATURE_NAMES))
+        if batcher is not None:
+            await batcher.submit(row)
+        else:
+            loaded.predict_proba(row)
+    except Exception as e:
+        readiness["error"] = "{}: {}".format(type(e).__name__, e)
+        return
+    readiness.update(ready=True, error=None, load_seconds=(perf_counter_ns() - start) / 1e9)
+
+# Set by the launcher (scorer/serve.py): each worker publishes its metrics snapshot here, and
+# /metrics and /admin/metrics report the totals of every worker
+METRICS_DIR = os.environ.get("FRAUD_METRICS_DIR")
+METRICS_PUBLISH_INTERVAL_S = float(os.environ.get("FRAUD_METRICS_PUBLISH_INTERVAL_S", "1"))
+
+def metrics_snapshot():
+    """This process's metrics, merged with the other workers' published snapshots under the launcher."""
+    snapshot = metrics.snapshot()
+    if METRICS_DIR is None:
+        return snapshot
+    others = read_snapshots(METRICS_DIR, exclude=[worker_snapshot_path(METRICS_DIR, os.getpid())])
+    return merge_snapshots([snapshot] + others)
+
+async def publish_metrics():
+    path = worker_snapshot_path(METRICS_DIR, os.getpid())
+    try:
+        while True:
+            await asyncio.sleep(METRICS_PUBLISH_INTERVAL_S)
+            write_snapshot(path, metrics.snapshot())
+    finally:
+        # Final counts for the launcher to fold into the retired totals
+        write_snapshot(path, metrics.snapshot())
+
+# With FRAUD_ROLLUPS=1 the scorer adds its decisions, rule hits, traffic, latency and drift to the
+# dashboard's SQLite rollups (FRAUD_ROLLUP_DB) every FRAUD_ROLLUP_FLUSH_S seconds
+rollups = RollupBatch() if os.environ.get("FRAUD_ROLLUPS", "0") == "1" else None
+ROLLUP_DB_PATH = os.environ.get("FRAUD_ROLLUP_DB", ROLLUP_DB)
+ROLLUP_FLUSH_S = float(os.environ.get("FRAUD_ROLLUP_FLUSH_S", "5"))
+
+def take_rollups():
+    """The increments collected since the last call, with the current drift PSI; called on the event loop."""
+    global rollups
+    batch, rollups = rollups, RollupBatch()
+    loaded, monitors = _drift
+    if monitors is not None:
+        batch.add_drift(time.time(), loaded.version, {**monitors[0].report()["sliding"]["psi"],
+                                                      **monitors[1].report()["sliding"]["psi"]})
+    return batch
+
+async def publish_rollups():
+    # Opened here, in the worker, so a SQLite connection is never carried across the launcher's fork
+    store = RollupStore(ROLLUP_DB_PATH)
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            await asyncio.sleep(ROLLUP_FLUSH_S)
+            try:
+                await loop.run_in_executor(None, store.write, take_rollups())
+            except Exception as e:
+                print("Dropped rollups after a write error: {}".format(e), file=sys.stderr)
+    finally:
+        store.write(take_rollups())
+        store.close()
+
+def record_error():
+    metrics.record_error()
+    if rollups is not None:
+        rollups.add_error(time.time())
+
+@asynccontextmanager
+async def lifespan(app):
+    # In the background so /live answers while the model loads and /ready flips when it is done
+    tasks = [asyncio.create_task(warm_up())]
+    if METRICS_DIR is not None:
+        tasks.append(asyncio.create_task(publish_metrics()))
+    if rollups is not None:
+        tasks.append(asyncio.create_task(publish_rollups()))
+    yield
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+app = FastAPI(title="Fraud Scoring API", version="1.0.0", lifespan=lifespan)
+# Adds a Server-Timing header with validation, model_lookup, features, inference, rules, response and
+# serialization times, and records them in the per-stage latency histograms
+app.add_middleware(StageTimingMiddleware)
 rules_engine = RulesEngine()
+# "all" lists every triggered rule and evaluates every rule per request; "flagged" decides with the
+# short-circuit RulesEngine.score() and lists rules only on REVIEW and DECLINE responses
+RULES_TRIGGERED = os.environ.get("FRAUD_RULES_TRIGGERED", "all")
+if RULES_TRIGGERED not in ("all", "flagged"):
+    raise ValueError("FRAUD_RULES_TRIGGERED must be all or flagged, got {!r}".format(RULES_TRIGGERED))
+
+MAX_BATCH_SIZE = 10000
+
+# Concurrent /score requests share one inference call; FRAUD_BATCH_MAX_SIZE=1 scores inline
+BATCH_MAX_SIZE = int(os.environ.get("FRAUD_BATCH_MAX_SIZE", "64"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("FRAUD_BATCH_MAX_WAIT_MS", "2"))
+
+def predict_versioned(rows):
+    """(probability, model version) per row, read from one model snapshot."""
+    loaded = get_model_loader().current()
+    return [(proba, loaded.version) for proba in loaded.predict_proba_batch(rows).tolist()]
+
+batcher = None
+if BATCH_MAX_SIZE > 1:
+    batcher = MicroBatcher(predict_versioned, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS)
+
+# With FRAUD_FEATURE_STORE=1 the scorer derives velocity and new-device features itself
+feature_store = None
+if os.environ.get("FRAUD_FEATURE_STORE", "0") == "1":
+    feature_store = FeatureStore(max_users=int(os.environ.get("FRAUD_FEATURE_STORE_MAX_USERS", "1000000")),
+                                 max_skew_seconds=float(os.environ.get("FRAUD_FEATURE_STORE_MAX_SKEW_S", "300")))
+
+# With FRAUD_RESULT_CACHE=1, /score answers repeats of a transaction under the same model and rules
+# versions from stored responses; FRAUD_RESULT_CACHE_BACKEND=redis://... shares them between workers
+result_cache = None
+if os.environ.get("FRAUD_RESULT_CACHE", "0") == "1":
+    result_cache = ResultCache(
+        LocalCache(max_entries=int(os.environ.get("FRAUD_RESULT_CACHE_MAX_ENTRIES", "100000")),
+                   max_bytes=int(float(os.environ.get("FRAUD_RESULT_CACHE_MAX_MB", "64")) * (1 << 20)),
+                   ttl_seconds=float(os.environ.get("FRAUD_RESULT_CACHE_TTL_S", "300"))),
+        make_backend(os.environ.get("FRAUD_RESULT_CACHE_BACKEND", "")),
+    )
+
+# (LoadedModel, (feature monitor, score monitor) or None), rebuilt when a new model is swapped in
+_drift = (None, None)
+
+def drift_monitors(loaded):
+    """Streaming PSI monitors for the model's reference profile, or None without one."""
+    global _drift
+    if _drift[0] is not loaded:
+        monitors = None
+        if loaded.drift_reference is not None:
+            monitors = (StreamingDriftMonitor(loaded.drift_reference.subset(FEATURE_NAMES)),
+                        StreamingDriftMonitor(loaded.drift_reference.subset([SCORE_COLUMN])))
+        _drift = (loaded, monitors)
+    return _drift[1]
 
 class Transaction(BaseModel):
     transaction_id: str
@@ -22,10 +183,12 @@ class Transaction(BaseModel):
     amount: float
     hour: int
     day_of_week: int
-    velocity_1h: int
-    is_new_device: bool
+    velocity_1h: Optional[int] = None
+    is_new_device: Optional[bool] = None
+    timestamp: Optional[float] = None
 
 class ScoreResponse(BaseModel):
+    model_config = ConfigDict(protected_namespaces=())
     transaction_id: str
     fraud_score: float
     ml_score: float
@@ -33,49 +196,306 @@ class ScoreResponse(BaseModel):
     decision: str
     rules_triggered: List[Dict[str, Any]]
     latency_ms: float
+    model_version: Optional[str] = None
 
 class HealthResponse(BaseModel):
+    model_config = ConfigDict(protected_namespaces=())
     status: str
     model_loaded: bool
+    ready: bool
+    model_version: Optional[str] = None
     version: str
 
+class ReloadRequest(BaseModel):
+    version: Optional[str] = None
+
+class ProfilerRequest(BaseModel):
+    enabled: bool
+    mode: str = "sampling"
+    interval_ms: float = 5.0
+    sample_rate: float = 0.01
+
 @app.get("/health", response_model=HealthResponse)
 async def health():
+    """Process and model state from memory; never loads anything."""
+    model_version = get_model_loader().version
+    return HealthResponse(status="healthy", model_loaded=model_version is not None, ready=readiness["ready"],
+                          model_version=model_version, version="1.0.0")
+
+@app.get("/live")
+async def live():
+    """Liveness probe: the event loop is serving requests."""
+    return {"status": "alive"}
+
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 503 until the startup warm-up has loaded the model."""
+    if not readiness["ready"]:
+        raise HTTPException(status_code=503, detail=readiness["error"] or "Model loading")
+    return {"status": "ready", "model_version": get_model_loader().version, "load_seconds": readiness["load_seconds"]}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    extra_lines = []
+    monitors = _drift[1]
+    if monitors is not None:
+        extra_lines += monitors[0].prometheus_lines("fraud_feature_psi", "PSI of each feature against the training reference.")
+        extra_lines += monitors[1].prometheus_lines("fraud_score_psi", "PSI of the model score against the training reference.")
+    if result_cache is not None:
+        extra_lines += result_cache.prometheus_lines()
+    return PlainTextResponse(render_prometheus(metrics_snapshot(), extra_lines), media_type="text/plain; version=0.0.4")
+
+@app.get("/admin/metrics")
+async def metrics_summary():
+    return summarize(metrics_snapshot())
+
+@app.post("/admin/reload")
+async def reload_model(request: Optional[ReloadRequest] = None):
+    """Load a model version off the event loop and swap it in once ready."""
+    loader = get_model_loader()
+    previous_version = loader.version
+    version = request.version if request is not None else None
+    try:
+        loaded = await asyncio.get_running_loop().run_in_executor(None, loader.reload, version)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    readiness.update(ready=True, error=None)
+    if result_cache is not None:
+        # Keys carry the model version, so old entries could not hit again; free their memory
+        result_cache.clear()
+    return {"model_version": loaded.version, "previous_version": previous_version}
+
+@app.post("/admin/rules/reload")
+async def reload_rules():
+    try:
+        compiled = rules_engine.reload()
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail="Invalid rule set: {}".format(e))
+    return {"rules_version": compiled.version, "rules": [name for name, _ in compiled.rules]}
+
+@app.get("/admin/serving")
+async def serving_settings_report():
+    """Blend weights and thresholds in use, tuned for the serving model or the defaults."""
     try:
-        get_model_loader().load()
-        model_loaded = True
-    except Exception:
-        model_loaded = False
-    return HealthResponse(status="healthy", model_loaded=model_loaded, version="1.0.0")
+        loaded = get_model_loader().current()
+    except FileNotFoundError:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    return {"model_version": loaded.version, "tuned": loaded.serving is not None, **serving_settings(loaded)}
+
+@app.get("/admin/drift")
+async def drift_report():
+    loaded, monitors = _drift
+    if monitors is None:
+        return {"enabled": False}
+    return {"enabled": True, "model_version": loaded.version, "features": monitors[0].report(), "score": monitors[1].report()}
+
+@app.get("/admin/profiler")
+async def profiler_status():
+    return profiler.status()
+
+@app.post("/admin/profiler")
+async def set_profiler(request: ProfilerRequest):
+    """Start a fresh profiling session in the given mode, or stop the current one and keep its results."""
+    if not request.enabled:
+        return profiler.stop()
+    try:
+        return profiler.start(request.mode, request.interval_ms, request.sample_rate)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/admin/profiler/dump")
+async def profiler_dump():
+    """Collapsed stacks for flamegraph.pl from the sampling mode, or a pstats file from the cProfile mode."""
+    if profiler.sampler is not None:
+        return PlainTextResponse(profiler.sampler.collapsed())
+    data = profiler.requests.dump() if profiler.requests is not None else None
+    if data is None:
+        raise HTTPException(status_code=404, detail="No profile recorded; modes are {}".format(", ".join(PROFILER_MODES)))
+    return Response(data, media_type="application/octet-stream",
+                    headers={"content-disposition": 'attachment; filename="scorer.prof"'})
+
+@app.get("/admin/batcher")
+async def batcher_stats():
+    if batcher is None:
+        return {"enabled": False}
+    return {"enabled": True, **batcher.stats()}
+
+@app.get("/admin/cache")
+async def result_cache_stats():
+    if result_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **result_cache.stats()}
+
+@app.get("/admin/feature-store")
+async def feature_store_stats():
+    if feature_store is None:
+        return {"enabled": False}
+    return {"enabled": True, **feature_store.stats()}
+
+def transaction_values(transaction):
+    """Field values for features and rules, with feature-store values when it is enabled."""
+    # Pydantic keeps field values in __dict__, so this avoids a model_dump() copy
+    txn = vars(transaction)
+    if feature_store is not None:
+        return {**txn, **feature_store.observe(txn)}
+    if txn["velocity_1h"] is None or txn["is_new_device"] is None:
+        raise HTTPException(status_code=422, detail="velocity_1h and is_new_device are required without the feature store")
+    return txn
+
+def cached_response(body, start, amount):
+    """A stored /score response with this request's latency, counted in metrics like a scored one."""
+    result = json.loads(body)
+    latency_ms = (perf_counter_ns() - start) / 1e6
+    result["latency_ms"] = round(latency_ms, 2)
+    metrics.record_request(latency_ms, result["decision"], result["fraud_score"])
+    if rollups is not None:
+        now = time.time()
+        rollups.add_scored(now, amount, result["decision"], result["fraud_score"], result["rules_triggered"])
+        rollups.add_request(now, latency_ms)
+    return Response(json.dumps(result, separators=(",", ":")).encode(), media_type="application/json", headers={"x-cache": "hit"})
 
 @app.post("/score", response_model=ScoreResponse)
 async def score(transaction: Transaction):
-    start = time.time()
-    txn_dict = transaction.model_dump()
+    mark("validation")
+    start = perf_counter_ns()
     try:
-        features = extract_features(txn_dict)
-        feature_array = features_to_array(features)
-        ml_score = get_model_loader().predict_proba(feature_array)
+        loaded = get_model_loader().current()
+        monitors = drift_monitors(loaded)
+        # One rule set for the cache key and the evaluation, even if the rules file is reloaded meanwhile
+        rules = rules_engine.current()
+        mark("model_lookup")
+        if result_cache is not None:
+            # Hits skip the feature store and drift monitors, so retries are not counted twice
+            key = cache_key(vars(transaction), loaded.version, rules.version)
+            cached = await result_cache.get(key)
+            mark("cache")
+            if cached is not None:
+                return cached_response(cached, start, transaction.amount)
+        txn_dict = transaction_values(transaction)
+        feature_array = write_features(
+            feature_buffer(), txn_dict["amount"], txn_dict["hour"], txn_dict["day_of_week"],
+            txn_dict["velocity_1h"], txn_dict["is_new_device"]
+        )
+        if monitors is not None:
+            # Before the await: the feature buffer is shared by every request on this thread
+            monitors[0].update(feature_array)
+        mark("features")
+        if batcher is not None:
+            ml_score, model_version = await batcher.submit(feature_array)
+        else:
+            ml_score = loaded.predict_proba(feature_array)
+            model_version = loaded.version
+    except HTTPException:
+        raise
     except FileNotFoundError:
+        record_error()
         raise HTTPException(status_code=503, detail="Model not loaded")
     except Exception as e:
+        record_error()
         raise HTTPException(status_code=500, detail=str(e))
-    rules_result = rules_engine.evaluate(txn_dict)
-    rules_score = rules_result["rules_score"]
-    fraud_score = 0.7 * ml_score + 0.3 * rules_score
-    if fraud_score >= 0.7:
-        decision = "DECLINE"
-    elif fraud_score >= 0.4:
-        decision = "REVIEW"
+    if monitors is not None:
+        monitors[1].update([ml_score])
+    mark("inference")
+    rules_result = rules.evaluate(txn_dict) if RULES_TRIGGERED == "all" else None
+    rules_score = rules.score(txn_dict) if rules_result is None else rules_result["rules_score"]
+    settings = serving_settings(loaded)
+    fraud_score = blend(ml_score, rules_score, settings)
+    decision = decide(fraud_score, settings)
+    if rules_result is None:
+        rules_triggered = [] if decision == "APPROVE" else rules.evaluate(txn_dict)["rules_triggered"]
     else:
-        decision = "APPROVE"
-    latency_ms = (time.time() - start) * 1000
-    return ScoreResponse(
+        rules_triggered = rules_result["rules_triggered"]
+    mark("rules")
+    latency_ms = (perf_counter_ns() - start) / 1e6
+    metrics.record_request(latency_ms, decision, fraud_score)
+    if rollups is not None:
+        now = time.time()
+        rollups.add_scored(now, txn_dict["amount"], decision, fraud_score, rules_triggered)
+        rollups.add_request(now, latency_ms)
+    response = ScoreResponse(
         transaction_id=transaction.transaction_id,
         fraud_score=round(fraud_score, 4),
         ml_score=round(ml_score, 4),
         rules_score=round(rules_score, 4),
         decision=decision,
-        rules_triggered=rules_result["rules_triggered"],
-        latency_ms=round(latency_ms, 2)
+        rules_triggered=rules_triggered,
+        latency_ms=round(latency_ms, 2),
+        model_version=model_version
     )
+    if result_cache is not None and model_version == loaded.version:
+        # Serialized once for both the cache and the client
+        body = response.model_dump_json().encode()
+        await result_cache.set(key, body)
+        mark("response")
+        return Response(body, media_type="application/json", headers={"x-cache": "miss"})
+    mark("response")
+    return response
+
+@app.post("/score/batch", response_model=List[ScoreResponse])
+async def score_batch(transactions: List[Transaction]):
+    mark("validation")
+    start = perf_counter_ns()
+    if len(transactions) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail="Batch exceeds {} transactions".format(MAX_BATCH_SIZE))
+    if not transactions:
+        return []
+    try:
+        loaded = get_model_loader().current()
+        monitors = drift_monitors(loaded)
+        mark("model_lookup")
+        rules = rules_engine.current()
+        # Rule fields beyond the model inputs, e.g. velocity_24h from the feature store
+        cols = transactions_to_columns([transaction_values(t) for t in transactions], rules.fields, rules.defaults)
+        feature_matrix = extract_features_frame(cols)
+        mark("features")
+        ml_scores = loaded.predict_proba_batch(feature_matrix)
+        if monitors is not None:
+            monitors[0].update_batch(feature_matrix)
+            monitors[1].update_batch(ml_scores[:, None])
+        mark("inference")
+    except HTTPException:
+        raise
+    except FileNotFoundError:
+        record_error()
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    except Exception as e:
+        record_error()
+        raise HTTPException(status_code=500, detail=str(e))
+    rules_result = rules.evaluate_batch(cols)
+    rules_scores = rules_result["rules_score"]
+    settings = serving_settings(loaded)
+    fraud_scores = blend(ml_scores, rules_scores, settings).tolist()
+    decisions = [decide(fraud_score, settings) for fraud_score in fraud_scores]
+    rules_triggered = rules_result["rules_triggered"]
+    if RULES_TRIGGERED == "flagged":
+        rules_triggered = [[] if decision == "APPROVE" else triggered for decision, triggered in zip(decisions, rules_triggered)]
+    mark("rules")
+    latency_ms = (perf_counter_ns() - start) / 1e6
+    metrics.record_batch(latency_ms, decisions, fraud_scores)
+    if rollups is not None:
+        now = time.time()
+        rollups.add_rows(LIVE, np.full(len(decisions), now), cols["amount"], fraud_scores, decisions,
+                         rules_triggered=rules_triggered)
+        rollups.add_request(now, latency_ms, len(decisions))
+    latency_ms = round(latency_ms, 2)
+    responses = [
+        ScoreResponse(
+            transaction_id=txn.transaction_id,
+            fraud_score=round(fraud_score, 4),
+            ml_score=round(ml_score, 4),
+            rules_score=round(rules_score, 4),
+            decision=decision,
+            rules_triggered=triggered,
+            latency_ms=latency_ms,
+            model_version=loaded.version
+        )
+        for txn, fraud_score, ml_score, rules_score, decision, triggered in zip(
+            transactions, fraud_scores, ml_scores.tolist(), rules_scores.tolist(), decisions, rules_triggered
+        )
+    ]
+    mark("response")
+    return responses
@@ -0,0 +1,99 @@
+"""Adaptive micro-batching of model inference for concurrent requests."""
+import asyncio
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+def pow2_bucket(value):
+    """Smallest power of two >= value, used as a histogram bucket bound."""
+    return 0 if value <= 0 else 1 << (value - 1).bit_length()
+
+class MicroBatcher:
+    """Groups in-flight single-row predictions into one batched inference call.
+
+    Batches grow with load; the worker only lingers up to max_wait_ms after a multi-row batch.
+    """
+
+    def __init__(self, predict_batch, max_batch_size=64, max_wait_ms=2.0):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+        self._loop = None
+        self._queue = None
+        self._worker = None
+        self._last_batch_size = 1
+        self._batches = 0
+        self._rows = 0
+        self._batch_sizes = Counter()
+        self._queue_depths = Counter()
+
+    async def submit(self, row):
+        """Queue one feature row and wait for its entry in the batch result."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._start(loop)
+        future = loop.create_future()
+        # Copy because callers pass a reused feature buffer
+        self._queue.put_nowait((np.array(row, dtype=np.float64), future))
+        return await future
+
+    def _start(self, loop):
+        if self._worker is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._worker.cancel)
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._worker = loop.create_task(self._run())
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        if self._last_batch_size > 1 and self.max_wait > 0:
+            deadline = self._loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            self._record(len(batch), self._queue.qsize())
+            rows = np.stack([row for row, _ in batch])
+            try:
+                results = await self._loop.run_in_executor(self._executor, self.predict_batch, rows)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            if isinstance(results, np.ndarray):
+                results = results.tolist()
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def _record(self, batch_size, queue_depth):
+        self._last_batch_size = batch_size
+        self._batches += 1
+        self._rows += batch_size
+        self._batch_sizes[pow2_bucket(batch_size)] += 1
+        self._queue_depths[pow2_bucket(queue_depth)] += 1
+
+    def stats(self):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "batches": self._batches,
+            "rows": self._rows,
+            "mean_batch_size": self._rows / self._batches if self._batches else 0.0,
+            "batch_size_histogram": {str(k): v for k, v in sorted(self._batch_sizes.items())},
+            "queue_depth_histogram": {str(k): v for k, v in sorted(self._queue_depths.items())},
+        }
@@ -0,0 +1,23 @@
+"""Blending model and rule scores into a decision, shared by the API and the offline pipeline."""
+
+# Defaults for models whose metrics.json has no tuned "serving" settings (see training/tune.py)
+ML_WEIGHT = 0.7
+RULES_WEIGHT = 0.3
+DECLINE_THRESHOLD = 0.7
+REVIEW_THRESHOLD = 0.4
+DEFAULT_SERVING = {"ml_weight": ML_WEIGHT, "rules_weight": RULES_WEIGHT,
+                   "decline_threshold": DECLINE_THRESHOLD, "review_threshold": REVIEW_THRESHOLD}
+
+def serving_settings(loaded):
+    return loaded.serving or DEFAULT_SERVING
+
+def blend(ml_score, rules_score, settings=DEFAULT_SERVING):
+    """Fraud score from model and rule scores, for floats or arrays."""
+    return settings["ml_weight"] * ml_score + settings["rules_weight"] * rules_score
+
+def decide(fraud_score, settings=DEFAULT_SERVING):
+    if fraud_score >= settings["decline_threshold"]:
+        return "DECLINE"
+    elif fraud_score >= settings["review_threshold"]:
+        return "REVIEW"
+    return "APPROVE"
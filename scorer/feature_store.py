@@ -0,0 +1,199 @@
+"""Real-time velocity and known-device features kept by the scorer itself."""
+import time
+import zlib
+from collections import OrderedDict
+import numpy as np
+
+HOUR = 3600
+DAY = 24 * HOUR
+# (name, number of buckets, bucket width in seconds)
+HOUR_WINDOW = ("1h", 12, 300)
+DAY_WINDOW = ("24h", 24, HOUR)
+WINDOW_SUFFIXES = ("_counts", "_amounts", "_count", "_amount", "_epoch")
+MAX_BUCKET_COUNT = np.iinfo(np.uint16).max
+# Client event times further than this from arrival time are replaced by arrival time
+MAX_SKEW_SECONDS = 300
+
+def value_hash(value):
+    """Non-zero 32-bit hash; zero marks an empty known-value slot."""
+    return zlib.crc32(str(value).encode()) or 1
+
+class WindowStore:
+    """Per-key event counts and amount sums over ring buffers of time buckets.
+
+    Each key owns one row of preallocated arrays. Running window totals are adjusted as
+    buckets expire, so recording and reading are O(1). Keys idle longer than ttl_seconds
+    are dropped, and the least recently seen key is evicted once max_keys is reached.
+    """
+
+    def __init__(self, windows, max_keys=1_000_000, ttl_seconds=DAY, initial_capacity=1024, known_values=0):
+        self.windows = windows
+        self.max_keys = max_keys
+        self.ttl_seconds = ttl_seconds
+        self.known_values = known_values
+        self.evictions = 0
+        self._index = OrderedDict()
+        self._free = []
+        self._next_slot = 0
+        self._capacity = 0
+        self._arrays = {"last_seen": (np.float64, ())}
+        for name, n_buckets, _ in windows:
+            self._arrays.update({
+                name + "_counts": (np.uint16, (n_buckets,)),
+                name + "_amounts": (np.float32, (n_buckets,)),
+                name + "_count": (np.uint32, ()),
+                name + "_amount": (np.float64, ()),
+                name + "_epoch": (np.int64, ()),
+            })
+        if known_values:
+            self._arrays.update({"known": (np.uint32, (known_values,)), "known_next": (np.uint8, ())})
+        self._grow(min(initial_capacity, max_keys))
+
+    def __len__(self):
+        return len(self._index)
+
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self._arrays)
+
+    def _grow(self, capacity):
+        for name, (dtype, shape) in self._arrays.items():
+            array = np.zeros((capacity,) + shape, dtype=dtype)
+            if self._capacity:
+                array[:self._capacity] = getattr(self, name)
+            setattr(self, name, array)
+        self._capacity = capacity
+        # Per-window array references for the hot path, rebuilt whenever the arrays grow
+        self._window_arrays = [
+            (n_buckets, bucket_seconds) + tuple(getattr(self, name + suffix) for suffix in WINDOW_SUFFIXES)
+            for name, n_buckets, bucket_seconds in self.windows
+        ]
+
+    def _reset(self, slot):
+        for name in self._arrays:
+            getattr(self, name)[slot] = 0
+
+    def _slot(self, key, now):
+        slot = self._index.get(key)
+        if slot is not None:
+            self._index.move_to_end(key)
+            if now - self.last_seen[slot] > self.ttl_seconds:
+                self._reset(slot)
+            return slot
+        self._expire(now)
+        if self._free:
+            slot = self._free.pop()
+        elif self._next_slot < self.max_keys:
+            if self._next_slot == self._capacity:
+                self._grow(min(self._capacity * 2, self.max_keys))
+            slot = self._next_slot
+            self._next_slot += 1
+        else:
+            _, slot = self._index.popitem(last=False)
+            self.evictions += 1
+        self._reset(slot)
+        self._index[key] = slot
+        return slot
+
+    def _expire(self, now, limit=2):
+        """Free a few idle keys from the LRU end; amortised O(1) per new key."""
+        for _ in range(limit):
+            if not self._index:
+                return
+            key, slot = next(iter(self._index.items()))
+            if now - self.last_seen[slot] <= self.ttl_seconds:
+                return
+            del self._index[key]
+            self._free.append(slot)
+            self.evictions += 1
+
+    def record(self, key, now, amount, known=None):
+        """Window (count, amount) totals before this event and whether known is new for key, then record it."""
+        slot = self._slot(key, now)
+        totals = []
+        for n_buckets, bucket_seconds, counts, amounts, total_count, total_amount, epochs in self._window_arrays:
+            epoch = int(now // bucket_seconds)
+            last = int(epochs[slot])
+            if epoch > last:
+                # Subtract the buckets that fall out of the window, then clear them for reuse
+                if epoch - last >= n_buckets:
+                    counts[slot] = 0
+                    amounts[slot] = 0
+                    total_count[slot] = 0
+                    total_amount[slot] = 0
+                else:
+                    expired = np.arange(last + 1, epoch + 1) % n_buckets
+                    total_count[slot] -= counts[slot, expired].sum()
+                    total_amount[slot] -= amounts[slot, expired].sum()
+                    counts[slot, expired] = 0
+                    amounts[slot, expired] = 0
+                epochs[slot] = last = epoch
+            totals.append((int(total_count[slot]), max(float(total_amount[slot]), 0.0)))
+            # Late events older than the window are not counted
+            if epoch > last - n_buckets:
+                bucket = epoch % n_buckets
+                if counts[slot, bucket] < MAX_BUCKET_COUNT:
+                    counts[slot, bucket] += 1
+                    total_count[slot] += 1
+                amounts[slot, bucket] += amount
+                total_amount[slot] += amount
+        is_new = False
+        if known is not None and self.known_values:
+            h = value_hash(known)
+            row = self.known[slot]
+            if h not in row.tolist():
+                is_new = True
+                pos = int(self.known_next[slot])
+                row[pos] = h
+                self.known_next[slot] = (pos + 1) % self.known_values
+        if now > self.last_seen[slot]:
+            self.last_seen[slot] = now
+        return totals, is_new
+
+class FeatureStore:
+    """Velocity, amount and new-device features per user, device and merchant."""
+
+    def __init__(self, max_users=1_000_000, ttl_seconds=DAY, known_devices=8, max_skew_seconds=MAX_SKEW_SECONDS):
+        self.max_skew_seconds = max_skew_seconds
+        self.clamped = 0
+        self.users = WindowStore([HOUR_WINDOW, DAY_WINDOW], max_users, ttl_seconds, known_values=known_devices)
+        self.devices = WindowStore([HOUR_WINDOW], 2 * max_users, ttl_seconds)
+        self.merchants = WindowStore([HOUR_WINDOW], max_users, ttl_seconds)
+
+    def event_time(self, timestamp, arrival):
+        """The client timestamp if it is within max_skew_seconds of arrival, else arrival.
+
+        Unchecked, a far-future or far-past timestamp would overflow the bucket epochs or write
+        into windows that later events read.
+        """
+        if timestamp is None:
+            return arrival
+        # Also false for NaN
+        if not abs(timestamp - arrival) <= self.max_skew_seconds:
+            self.clamped += 1
+            return arrival
+        return timestamp
+
+    def observe(self, txn, arrival=None):
+        """Derived features as of just before txn, then record txn."""
+        now = self.event_time(txn.get("timestamp"), time.time() if arrival is None else arrival)
+        amount = float(txn.get("amount", 0))
+        (user_1h, user_24h), is_new_device = self.users.record(txn["user_id"], now, amount, known=txn["device_id"])
+        (device_1h,), _ = self.devices.record(txn["device_id"], now, amount)
+        (merchant_1h,), _ = self.merchants.record(txn["merchant_id"], now, amount)
+        return {
+            "velocity_1h": user_1h[0],
+            "velocity_24h": user_24h[0],
+            "amount_1h": user_1h[1],
+            "amount_24h": user_24h[1],
+            "is_new_device": is_new_device,
+            "device_velocity_1h": device_1h[0],
+            "merchant_velocity_1h": merchant_1h[0],
+        }
+
+    def stats(self):
+        stats = {
+            name: {"keys": len(store), "evictions": store.evictions, "array_bytes": store.nbytes()}
+            for name, store in [("users", self.users), ("devices", self.devices), ("merchants", self.merchants)]
+        }
+        stats["timestamps_replaced"] = self.clamped
+        return stats
@@ -0,0 +1,68 @@
+"""Flat-array RandomForest inference without scikit-learn."""
+import numpy as np
+
+FORMAT = "flat_forest"
+
+def flatten_forest(model):
+    """Pack the trees of a fitted RandomForestClassifier into contiguous arrays."""
+    fraud_col = list(model.classes_).index(1)
+    trees = [est.tree_ for est in model.estimators_]
+    roots = np.cumsum([0] + [t.node_count for t in trees[:-1]]).astype(np.int32)
+    feature, threshold, left, right, value = [], [], [], [], []
+    for root, tree in zip(roots, trees):
+        nodes = np.arange(tree.node_count, dtype=np.int32) + root
+        is_leaf = tree.children_left == -1
+        # Leaves point back at themselves so every row can walk max_depth steps in lockstep
+        feature.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+        threshold.append(np.where(is_leaf, np.inf, tree.threshold))
+        left.append(np.where(is_leaf, nodes, tree.children_left + root).astype(np.int32))
+        right.append(np.where(is_leaf, nodes, tree.children_right + root).astype(np.int32))
+        counts = tree.value[:, 0, :]
+        value.append(counts[:, fraud_col] / counts.sum(axis=1))
+    return {
+        "format": FORMAT,
+        "n_features": int(model.n_features_in_),
+        "max_depth": int(max(t.max_depth for t in trees)),
+        "roots": roots,
+        "feature": np.concatenate(feature),
+        "threshold": np.concatenate(threshold),
+        "left": np.concatenate(left),
+        "right": np.concatenate(right),
+        "value": np.concatenate(value),
+    }
+
+class FlatForest:
+    """Scores rows against a flattened forest by walking all trees at once."""
+
+    def __init__(self, arrays):
+        self.n_features_in_ = int(arrays["n_features"])
+        self.max_depth = int(arrays["max_depth"])
+        self.roots = arrays["roots"]
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.left = arrays["left"]
+        self.right = arrays["right"]
+        self.value = arrays["value"]
+
+    def predict_fraud(self, X, chunk_size=256):
+        """Fraud probability for each row of a 2-D feature matrix."""
+        # sklearn trees split on float32 inputs, so round the same way before comparing
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError("Expected {} features, got shape {}".format(self.n_features_in_, X.shape))
+        out = np.empty(X.shape[0])
+        # Small row chunks keep the (rows, trees) node matrix in cache
+        for start in range(0, X.shape[0], chunk_size):
+            chunk = X[start:start + chunk_size]
+            flat = chunk.ravel()
+            offsets = (np.arange(chunk.shape[0], dtype=np.int64) * self.n_features_in_)[:, None]
+            nodes = np.repeat(self.roots[None, :], chunk.shape[0], axis=0)
+            for _ in range(self.max_depth):
+                go_left = flat.take(offsets + self.feature.take(nodes)) <= self.threshold.take(nodes)
+                nodes = np.where(go_left, self.left.take(nodes), self.right.take(nodes))
+            out[start:start + chunk_size] = self.value.take(nodes).mean(axis=1)
+        return out
+
+    def predict_proba(self, X):
+        fraud = self.predict_fraud(X)
+        return np.column_stack([1 - fraud, fraud])
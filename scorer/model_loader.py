@@ -1,35 +1,159 @@
 """Model loading utilities."""
-import joblib
+import json
 import os
+import re
+import threading
+from scorer.flat_forest import FlatForest, FORMAT as FLAT_FORMAT
+from monitor.drift import ReferenceProfile
+
+MODEL_DIR = os.environ.get("FRAUD_MODEL_DIR", "models")
+# Set to fraud_model_flat.joblib to serve the flattened forest instead of sklearn
+MODEL_FILE = os.environ.get("FRAUD_MODEL_FILE", "fraud_model.joblib")
+LATEST_FILE = "LATEST"
+# Reference bins for drift monitoring, written next to the model by training
+DRIFT_REFERENCE_FILE = "drift_reference.json"
+# Training metrics; tuning adds the blend weights and thresholds to serve the model with
+METRICS_FILE = "metrics.json"
+# A version is one directory name under versions/, never a path
+VERSION_PATTERN = re.compile(r"^[A-Za-z0-9._-]+$")
+
+def version_dir(version, model_dir=None):
+    return os.path.join(model_dir or MODEL_DIR, "versions", version)
+
+def latest_version(model_dir=None):
+    """Version named by the LATEST pointer, or None for an unversioned models directory."""
+    path = os.path.join(model_dir or MODEL_DIR, LATEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return f.read().strip() or None
+
+def check_version(version, model_dir=None):
+    """Raise FileNotFoundError unless version names a published version directory."""
+    versions_dir = os.path.join(model_dir or MODEL_DIR, "versions")
+    if (not isinstance(version, str) or not VERSION_PATTERN.match(version) or ".." in version
+            or not os.path.isdir(versions_dir) or version not in os.listdir(versions_dir)):
+        raise FileNotFoundError("Unknown model version: {!r}".format(version))
+
+def resolve_model_path(version=None, model_dir=None, model_file=None):
+    """Artifact path and version label, defaulting to the latest published version."""
+    model_dir = model_dir or MODEL_DIR
+    model_file = model_file or MODEL_FILE
+    if version is None:
+        version = latest_version(model_dir)
+    if version is None:
+        return os.path.join(model_dir, model_file), "unversioned"
+    check_version(version, model_dir)
+    return os.path.join(version_dir(version, model_dir), model_file), version
+
+def publish_version(version, model_dir=None):
+    """Atomically point LATEST at version."""
+    model_dir = model_dir or MODEL_DIR
+    tmp_path = os.path.join(model_dir, LATEST_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        f.write(version + "\n")
+    os.replace(tmp_path, os.path.join(model_dir, LATEST_FILE))
+
+def load_artifact(path):
+    if not os.path.exists(path):
+        raise FileNotFoundError("Model not found: {}".format(path))
+    # Imported here to keep it off the scorer's import path; sklearn itself is only imported
+    # when an sklearn artifact is unpickled, never for the flat one
+    import joblib
+    # Memory-mapped arrays live in the page cache, shared by every worker that loads the file.
+    # sklearn copies tree nodes on unpickling, so only the flat artifact stays shared.
+    model = joblib.load(path, mmap_mode="r")
+    if isinstance(model, dict) and model.get("format") == FLAT_FORMAT:
+        model = FlatForest(model)
+    return model
+
+def load_drift_reference(model_path):
+    """The ReferenceProfile saved alongside a model artifact, or None."""
+    path = os.path.join(os.path.dirname(model_path), DRIFT_REFERENCE_FILE)
+    return ReferenceProfile.load(path) if os.path.exists(path) else None
+
+def load_serving_settings(model_path):
+    """Tuned "serving" settings from the metrics.json saved alongside a model artifact, or None."""
+    path = os.path.join(os.path.dirname(model_path), METRICS_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f).get("serving")
+
+class LoadedModel:
+    """A model together with its version, swapped in as a whole on reload."""
+
+    def __init__(self, model, version, path=None, drift_reference=None, serving=None):
+        self.model = model
+        self.version = version
+        self.path = path
+        self.drift_reference = drift_reference
+        self.serving = serving
+
+    @classmethod
+    def from_path(cls, path, version):
+        """The artifact with the drift reference and serving settings saved next to it."""
+        return cls(load_artifact(path), version, path, load_drift_reference(path), load_serving_settings(path))
+
+    def predict_proba(self, features):
+        if len(features.shape) == 1:
+            features = features.reshape(1, -1)
+        if isinstance(self.model, FlatForest):
+            return float(self.model.predict_fraud(features)[0])
+        proba = self.model.predict_proba(features)
+        return float(proba[0][1])
+
+    def predict_proba_batch(self, features):
+        """Fraud probability for every row of a 2-D feature matrix in one call."""
+        if isinstance(self.model, FlatForest):
+            return self.model.predict_fraud(features)
+        return self.model.predict_proba(features)[:, 1]
 
 class ModelLoader:
-    """Lazy model loader with caching."""
-    
+    """Lazy model loader with atomic hot reload."""
+
     _instance = None
-    _model = None
-    
+    _current = None
+    _lock = threading.Lock()
+
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
         return cls._instance
-    
-    def load(self, model_path="models/fraud_model.joblib"):
-        if self._model is None:
-            if not os.path.exists(model_path):
-                raise FileNotFoundError("Model not found: {}".format(model_path))
-            self._model = joblib.load(model_path)
-        return self._model
-    
+
+    def current(self):
+        """The serving LoadedModel, loading the latest version on first use."""
+        current = self._current
+        if current is None:
+            with self._lock:
+                if self._current is None:
+                    path, version = resolve_model_path()
+                    self._current = LoadedModel.from_path(path, version)
+                current = self._current
+        return current
+
+    @property
+    def version(self):
+        current = self._current
+        return current.version if current is not None else None
+
+    def load(self):
+        return self.current().model
+
     def predict_proba(self, features):
-        model = self.load()
-        if len(features.shape) == 1:
-            features = features.reshape(1, -1)
-        proba = model.predict_proba(features)
-        return float(proba[0][1])
-    
-    def reload(self, model_path="models/fraud_model.joblib"):
-        self._model = None
-        return self.load(model_path)
+        return self.current().predict_proba(features)
+
+    def predict_proba_batch(self, features):
+        return self.current().predict_proba_batch(features)
+
+    def reload(self, version=None, model_path=None):
+        """Load a version fully, then swap it in; requests keep using the old model meanwhile."""
+        if model_path is None:
+            model_path, version = resolve_model_path(version)
+        with self._lock:
+            loaded = LoadedModel.from_path(model_path, version or "custom")
+            self._current = loaded
+        return loaded
 
 def get_model_loader():
     return ModelLoader()
@@ -0,0 +1,232 @@
+"""Score transaction streams offline: JSONL, CSV or Parquet in, JSONL or Parquet out.
+
+Input is read lazily and grouped into batches. Worker processes score the batches with the same
+features, model, rules and decision thresholds as /score/batch, and the results are written in
+input order as they complete. At most --max-pending batches are in flight, so reading waits for
+scoring and scoring waits for writing, and memory stays bounded by the batch size.
+
+    python scorer/pipeline.py --split test --output data/scores_test.parquet
+    python scorer/pipeline.py --input transactions.jsonl --output - --workers 0
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scorer.features import extract_features_frame, transactions_to_columns, INPUT_COLUMNS
+from scorer.rules import RulesEngine
+from scorer.model_loader import get_model_loader
+from scorer.decisions import serving_settings, blend, decide
+
+RESULT_FIELDS = ["transaction_id", "fraud_score", "ml_score", "rules_score", "decision", "rules_triggered", "model_version"]
+
+def iter_jsonl(path):
+    """One transaction dict per non-empty line; "-" reads stdin."""
+    f = sys.stdin if path == "-" else open(path)
+    try:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+def iter_queue(q, sentinel=None):
+    """Transactions from a queue.Queue until the sentinel, a local stand-in for a message queue consumer."""
+    while True:
+        item = q.get()
+        if item is sentinel:
+            return
+        yield item
+
+def batch_rows(rows, batch_size):
+    """(transaction IDs, column arrays) for every batch_size transaction dicts."""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield rows_to_batch(batch)
+            batch = []
+    if batch:
+        yield rows_to_batch(batch)
+
+def rows_to_batch(rows):
+    try:
+        return [str(row["transaction_id"]) for row in rows], transactions_to_columns(rows)
+    except (KeyError, TypeError):
+        raise ValueError("Every transaction needs transaction_id and {}".format(", ".join(INPUT_COLUMNS)))
+
+def batch_frames(path, batch_size):
+    """(transaction IDs, column arrays) batches from a CSV file, CSV shard directory or Parquet dataset."""
+    from simulator.dataset import iter_transaction_chunks
+    for chunk in iter_transaction_chunks(path, batch_size, ["transaction_id"] + INPUT_COLUMNS):
+        yield chunk["transaction_id"].astype(str).tolist(), {col: chunk[col].to_numpy() for col in INPUT_COLUMNS}
+
+def score_batch(batch, loaded, rules_engine):
+    """Result columns for a batch, computed exactly as /score/batch does."""
+    ids, cols = batch
+    ml_scores = loaded.predict_proba_batch(extract_features_frame(cols))
+    rules_result = rules_engine.evaluate_batch(cols)
+    rules_scores = rules_result["rules_score"]
+    settings = serving_settings(loaded)
+    fraud_scores = blend(ml_scores, rules_scores, settings).tolist()
+    return {
+        "transaction_id": ids,
+        "fraud_score": [round(score, 4) for score in fraud_scores],
+        "ml_score": [round(score, 4) for score in ml_scores.tolist()],
+        "rules_score": [round(score, 4) for score in rules_scores.tolist()],
+        "decision": [decide(score, settings) for score in fraud_scores],
+        "rules_triggered": rules_result["rules_triggered"],
+        "model_version": [loaded.version] * len(ids),
+    }
+
+def encode_jsonl(result):
+    rows = zip(*(result[field] for field in RESULT_FIELDS))
+    return "".join(json.dumps(dict(zip(RESULT_FIELDS, row))) + "\n" for row in rows).encode()
+
+def arrow_schema():
+    import pyarrow as pa
+    rule = pa.struct([("rule", pa.string()), ("score", pa.float64())])
+    return pa.schema([("transaction_id", pa.string()), ("fraud_score", pa.float64()), ("ml_score", pa.float64()),
+                      ("rules_score", pa.float64()), ("decision", pa.string()), ("rules_triggered", pa.list_(rule)),
+                      ("model_version", pa.string())])
+
+def encode_parquet(result):
+    import pyarrow as pa
+    return pa.Table.from_pydict({field: result[field] for field in RESULT_FIELDS}, schema=arrow_schema())
+
+ENCODERS = {"jsonl": encode_jsonl, "parquet": encode_parquet}
+
+_worker = {}
+
+def _init_worker(loaded, rules_engine, fmt):
+    _worker.update(loaded=loaded, rules_engine=rules_engine, fmt=fmt)
+
+def _score(batch):
+    """Score and encode one batch; encoding here keeps serialization off the writer."""
+    result = score_batch(batch, _worker["loaded"], _worker["rules_engine"])
+    return ENCODERS[_worker["fmt"]](result), len(result["decision"]), Counter(result["decision"])
+
+def ordered_map(fn, items, executor=None, max_pending=4):
+    """fn over items, yielding results in input order with at most max_pending items taken but not yet yielded."""
+    if executor is None:
+        for item in items:
+            yield fn(item)
+        return
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+class JsonlWriter:
+    def __init__(self, path):
+        self.file = sys.stdout.buffer if path == "-" else open(path, "wb")
+
+    def write(self, encoded):
+        self.file.write(encoded)
+
+    def close(self):
+        if self.file is sys.stdout.buffer:
+            self.file.flush()
+        else:
+            self.file.close()
+
+class ParquetWriter:
+    """One row group per batch, so each batch is on disk before the next one is written."""
+
+    def __init__(self, path):
+        import pyarrow.parquet as pq
+        self.writer = pq.ParquetWriter(path, arrow_schema())
+
+    def write(self, encoded):
+        self.writer.write_table(encoded)
+
+    def close(self):
+        self.writer.close()
+
+WRITERS = {"jsonl": JsonlWriter, "parquet": ParquetWriter}
+
+def output_format(path):
+    return "parquet" if path.endswith(".parquet") else "jsonl"
+
+def run_pipeline(batches, output, fmt="jsonl", workers=0, max_pending=None, loaded=None, rules_engine=None,
+                 progress_seconds=10.0, log=sys.stderr):
+    """Score batches into output and return throughput and decision counts; workers=0 scores in this process."""
+    loaded = loaded or get_model_loader().current()
+    # Fixed for the whole run, so every row is scored by one rule set
+    rules_engine = rules_engine or RulesEngine(reload_interval=0)
+    max_pending = max_pending or 2 * max(workers, 1)
+    stats = {"rows": 0, "batches": 0, "decisions": Counter()}
+    writer = WRITERS[fmt](output)
+    start = last_report = time.perf_counter()
+    executor = None
+    try:
+        if workers:
+            # Forked workers share the loaded model's pages instead of unpickling a copy each
+            executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork"),
+                                           initializer=_init_worker, initargs=(loaded, rules_engine, fmt))
+        else:
+            _init_worker(loaded, rules_engine, fmt)
+        for encoded, rows, decisions in ordered_map(_score, batches, executor, max_pending):
+            writer.write(encoded)
+            stats["rows"] += rows
+            stats["batches"] += 1
+            stats["decisions"].update(decisions)
+            now = time.perf_counter()
+            if log is not None and now - last_report >= progress_seconds:
+                print("{:,} rows, {:,.0f} rows/s".format(stats["rows"], stats["rows"] / (now - start)), file=log)
+                last_report = now
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        writer.close()
+    seconds = time.perf_counter() - start
+    stats.update(seconds=seconds, rows_per_second=stats["rows"] / seconds if seconds else 0.0,
+                 decisions=dict(stats["decisions"]), model_version=loaded.version, workers=workers)
+    return stats
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="JSONL file (.jsonl/.json, - for stdin), CSV file, CSV shard directory or Parquet dataset")
+    source.add_argument("--split", help="A generated split, e.g. test")
+    parser.add_argument("--output", required=True, help=".parquet, else JSONL; - for stdout")
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Scoring processes; 0 scores in this process")
+    parser.add_argument("--max-pending", type=int, default=None, help="Batches in flight; default twice the workers")
+    parser.add_argument("--version", default=None, help="Model version to score with; default models/LATEST")
+    parser.add_argument("--progress-seconds", type=float, default=10.0)
+    parser.add_argument("--stats", default=None, help="Write the run's throughput and decision counts as JSON")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.split:
+        from simulator.dataset import split_path
+        args.input = split_path(args.split)
+    if args.input == "-" or args.input.endswith((".jsonl", ".json")):
+        batches = batch_rows(iter_jsonl(args.input), args.batch_size)
+    else:
+        batches = batch_frames(args.input, args.batch_size)
+    loaded = get_model_loader().reload(args.version) if args.version else get_model_loader().current()
+    fmt = output_format(args.output)
+    stats = run_pipeline(batches, args.output, fmt, args.workers, args.max_pending, loaded,
+                         progress_seconds=args.progress_seconds)
+    print("Scored {:,} rows in {:.1f}s: {:,.0f} rows/s with {} workers, model {}".format(
+        stats["rows"], stats["seconds"], stats["rows_per_second"], args.workers, stats["model_version"]), file=sys.stderr)
+    print("Decisions: {}".format(json.dumps(stats["decisions"], sort_keys=True)), file=sys.stderr)
+    if args.stats:
+        with open(args.stats, "w") as f:
+            json.dump(stats, f, indent=2)
+    return stats
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""Cache of serialized score responses for retried and re-scored transactions."""
+import hashlib
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Approximate bytes per entry beyond the key and value objects: the OrderedDict node and the entry tuple
+ENTRY_OVERHEAD = 160
+
+def cache_key(txn, model_version, rules_version):
+    """Digest of the normalized transaction fields with the model and rules versions that scored it."""
+    parts = [model_version or "", rules_version or ""]
+    # repr gives one spelling per float and tells None, False and 0 apart
+    parts += ["{}={!r}".format(field, txn[field]) for field in sorted(txn)]
+    return hashlib.blake2b("\x1f".join(parts).encode(), digest_size=16).digest()
+
+class LocalCache:
+    """In-process LRU with a TTL, bounded by entry count and approximate bytes."""
+
+    def __init__(self, max_entries=100_000, max_bytes=64 << 20, ttl_seconds=300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.nbytes = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def entry_size(key, value):
+        return sys.getsizeof(key) + sys.getsizeof(value) + ENTRY_OVERHEAD
+
+    def get(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if now >= expires_at:
+                del self._entries[key]
+                self.nbytes -= self.entry_size(key, value)
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, now=None, ttl_seconds=None):
+        now = time.monotonic() if now is None else now
+        size = self.entry_size(key, value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.nbytes -= self.entry_size(key, previous[0])
+            self._entries[key] = (value, now + (ttl_seconds or self.ttl_seconds))
+            self.nbytes += size
+            while len(self._entries) > self.max_entries or self.nbytes > self.max_bytes:
+                old_key, (old_value, expires_at) = self._entries.popitem(last=False)
+                self.nbytes -= self.entry_size(old_key, old_value)
+                if now >= expires_at:
+                    self.expirations += 1
+                else:
+                    self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+class MemoryBackend:
+    """In-process stand-in for a shared backend, with the same async get/set interface.
+
+    Caches built on one MemoryBackend share hits the way workers sharing Redis would, which
+    is how tests and single-process deployments exercise the shared path.
+    """
+
+    def __init__(self, max_entries=1_000_000, max_bytes=256 << 20):
+        self._cache = LocalCache(max_entries, max_bytes)
+
+    async def get(self, key):
+        return self._cache.get(key)
+
+    async def set(self, key, value, ttl_seconds):
+        self._cache.set(key, value, ttl_seconds=ttl_seconds)
+
+class RedisBackend:
+    """Redis shared by every worker and host, for deployments that install the redis package."""
+
+    def __init__(self, url, prefix="fraud:score:", timeout_seconds=0.05):
+        try:
+            import redis.asyncio
+        except ImportError:
+            raise ImportError("A redis:// result cache backend needs the redis package (pip install redis)")
+        self.prefix = prefix.encode()
+        self._client = redis.asyncio.Redis.from_url(url, socket_timeout=timeout_seconds)
+
+    async def get(self, key):
+        return await self._client.get(self.prefix + key)
+
+    async def set(self, key, value, ttl_seconds):
+        await self._client.set(self.prefix + key, value, px=int(ttl_seconds * 1000))
+
+def make_backend(url):
+    """memory:// for the in-process stand-in, redis://... for Redis, empty for no shared backend."""
+    if not url:
+        return None
+    if url.startswith("memory://"):
+        return MemoryBackend()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url)
+    raise ValueError("Unsupported result cache backend: {}".format(url))
+
+class ResultCache:
+    """A local LRU/TTL tier in front of an optional shared backend.
+
+    Values are serialized responses, so the same bytes can be stored in either tier. A shared
+    backend that errors or times out counts as a miss and never fails the request.
+    """
+
+    def __init__(self, local, backend=None):
+        self.local = local
+        self.backend = backend
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.backend_errors = 0
+        self.last_backend_error = None
+
+    async def get(self, key):
+        value = self.local.get(key)
+        if value is None and self.backend is not None:
+            try:
+                value = await self.backend.get(key)
+            except Exception as e:
+                self._backend_error(e)
+            if value is not None:
+                self.local.set(key, value)
+                self.shared_hits += 1
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key, value):
+        self.local.set(key, value)
+        if self.backend is not None:
+            try:
+                await self.backend.set(key, value, self.local.ttl_seconds)
+            except Exception as e:
+                self._backend_error(e)
+
+    def _backend_error(self, error):
+        self.backend_errors += 1
+        self.last_backend_error = str(error)
+
+    def clear(self):
+        """Drop local entries; shared entries are keyed by model version and age out by TTL."""
+        self.local.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.local.evictions,
+            "expirations": self.local.expirations,
+            "entries": len(self.local),
+            "bytes": self.local.nbytes,
+            "max_entries": self.local.max_entries,
+            "max_bytes": self.local.max_bytes,
+            "ttl_seconds": self.local.ttl_seconds,
+            "shared_backend": type(self.backend).__name__ if self.backend is not None else None,
+            "backend_errors": self.backend_errors,
+            "last_backend_error": self.last_backend_error,
+        }
+
+    def prometheus_lines(self):
+        stats = self.stats()
+        lines = []
+        for name, help_text, kind in [
+            ("hits", "Score requests answered from the result cache.", "counter"),
+            ("shared_hits", "Result cache hits found in the shared backend.", "counter"),
+            ("misses", "Score requests not found in the result cache.", "counter"),
+            ("evictions", "Result cache entries evicted by the entry or memory cap.", "counter"),
+            ("entries", "Responses held in the local result cache.", "gauge"),
+            ("bytes", "Approximate memory used by the local result cache.", "gauge"),
+        ]:
+            metric = "fraud_result_cache_{}{}".format(name, "_total" if kind == "counter" else "")
+            lines += ["# HELP {} {}".format(metric, help_text), "# TYPE {} {}".format(metric, kind),
+                      "{} {}".format(metric, stats[name])]
+        return lines
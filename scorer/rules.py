@@ -1,58 +1,161 @@
 """Rules engine for fraud detection."""
+import hashlib
+import json
+import keyword
+import operator
+import os
+import threading
+import time
+import numpy as np
 
-class RulesEngine:
-    """Rule-based fraud detection layer."""
-    
-    def __init__(self):
-        self.rules = [
-            ("high_velocity", self._check_high_velocity),
-            ("new_device_high_amount", self._check_new_device_high_amount),
-            ("extreme_amount", self._check_extreme_amount),
-            ("odd_hours_activity", self._check_odd_hours),
-        ]
-    
-    def _check_high_velocity(self, txn):
-        velocity = txn.get("velocity_1h", 0)
-        if velocity >= 10:
-            return True, 0.8
-        elif velocity >= 5:
-            return True, 0.4
-        return False, 0.0
-    
-    def _check_new_device_high_amount(self, txn):
-        is_new = txn.get("is_new_device", False)
-        amount = txn.get("amount", 0)
-        if is_new and amount > 500:
-            return True, 0.6
-        elif is_new and amount > 200:
-            return True, 0.3
-        return False, 0.0
-    
-    def _check_extreme_amount(self, txn):
-        amount = txn.get("amount", 0)
-        if amount > 5000:
-            return True, 0.7
-        elif amount > 2000:
-            return True, 0.3
-        return False, 0.0
-    
-    def _check_odd_hours(self, txn):
-        hour = txn.get("hour", 12)
-        amount = txn.get("amount", 0)
-        if hour < 5 and amount > 100:
-            return True, 0.4
-        return False, 0.0
-    
-    def evaluate(self, txn):
-        triggered = []
-        max_score = 0.0
-        for rule_name, rule_func in self.rules:
-            fired, score = rule_func(txn)
-            if fired:
-                triggered.append({"rule": rule_name, "score": score})
-                max_score = max(max_score, score)
+RULES_PATH = os.environ.get("FRAUD_RULES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json"))
+
+OPS = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le, "==": operator.eq, "!=": operator.ne}
+
+def _check_condition(condition):
+    field, op, value = condition
+    if not field.isidentifier() or keyword.iskeyword(field):
+        raise ValueError("Invalid rule field: {!r}".format(field))
+    if op not in OPS:
+        raise ValueError("Invalid rule operator: {!r}".format(op))
+    if not isinstance(value, (int, float, bool)):
+        raise ValueError("Rule values must be numbers or booleans, got {!r}".format(value))
+    return field, op, value
+
+class CompiledRules:
+    """A rule set compiled into generated Python functions and NumPy column masks."""
+
+    def __init__(self, config, version=None):
+        self.version = version or hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:12]
+        self.defaults = config.get("defaults", {})
+        self.rules = []
+        for rule in config["rules"]:
+            tiers = [([_check_condition(c) for c in tier["when"]], float(tier["score"])) for tier in rule["tiers"]]
+            self.rules.append((str(rule["name"]), tiers))
+        self.fields = sorted({field for _, tiers in self.rules for conditions, _ in tiers for field, _, _ in conditions})
+        namespace = {}
+        exec(compile(self._evaluate_source() + self._score_source(), "<rules {}>".format(self.version), "exec"), namespace)
+        self.evaluate = namespace["evaluate"]
+        self.score = namespace["score"]
+
+    def _prologue(self):
+        return ["    f_{0} = txn.get({0!r}, {1!r})".format(f, self.defaults.get(f, 0)) for f in self.fields]
+
+    def _tier_lines(self, tiers, action, indent="    "):
+        lines = []
+        for i, (conditions, score) in enumerate(tiers):
+            test = " and ".join("f_{} {} {!r}".format(f, op, v) for f, op, v in conditions)
+            lines.append("{}{} {}:".format(indent, "if" if i == 0 else "elif", test))
+            lines.append(indent + "    " + action(score))
+        return lines
+
+    def _evaluate_source(self):
+        """Every rule in config order, like the API reports them."""
+        lines = ["def evaluate(txn):"] + self._prologue() + ["    triggered = []", "    best = 0.0"]
+        for name, tiers in self.rules:
+            lines += self._tier_lines(
+                tiers, lambda s, name=name: "triggered.append({{'rule': {!r}, 'score': {!r}}}); best = max(best, {!r})".format(name, s, s))
+        lines.append("    return {'rules_triggered': triggered, 'rules_score': best, 'rules_count': len(triggered)}")
+        return "\n".join(lines) + "\n"
+
+    def _score_source(self):
+        """Only the max score, trying rules by best possible score and stopping once none can beat it."""
+        lines = ["def score(txn):"] + self._prologue() + ["    best = 0.0"]
+        ordered = sorted(self.rules, key=lambda rule: max(s for _, s in rule[1]), reverse=True)
+        for i, (_, tiers) in enumerate(ordered):
+            ceiling = max(s for _, s in tiers)
+            if i > 0:
+                lines += ["    if best >= {!r}:".format(ceiling), "        return best"]
+            lines += self._tier_lines(tiers, lambda s: "best = max(best, {!r})".format(s))
+        lines.append("    return best")
+        return "\n".join(lines) + "\n"
+
+    def evaluate_batch(self, cols):
+        """Every rule as a column operation over a dict of equal-length arrays."""
+        n = len(next(iter(cols.values())))
+        def column(field):
+            return np.asarray(cols[field]) if field in cols else np.full(n, self.defaults.get(field, 0))
+        columns = {field: column(field) for field in self.fields}
+        triggered = [[] for _ in range(n)]
+        max_score = np.zeros(n)
+        rules_count = np.zeros(n, dtype=np.int64)
+        for name, tiers in self.rules:
+            masks = [np.logical_and.reduce([OPS[op](columns[f], v) for f, op, v in conditions]) for conditions, _ in tiers]
+            scores = np.select(masks, [score for _, score in tiers], 0.0)
+            fired = np.flatnonzero(np.logical_or.reduce(masks))
+            for i, score in zip(fired.tolist(), scores[fired].tolist()):
+                triggered[i].append({"rule": name, "score": score})
+            rules_count[fired] += 1
+            np.maximum(max_score, scores, out=max_score)
         return {
             "rules_triggered": triggered,
             "rules_score": max_score,
-            "rules_count": len(triggered),
+            "rules_count": rules_count,
         }
+
+class RulesEngine:
+    """Rule-based fraud detection layer, loaded from a JSON rule set and hot-reloaded on change."""
+
+    def __init__(self, path=RULES_PATH, config=None, reload_interval=1.0):
+        self.path = path
+        self.reload_interval = reload_interval if config is None else 0
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._next_check = 0.0
+        self.last_error = None
+        if config is not None:
+            self.compiled = CompiledRules(config)
+        else:
+            self.reload()
+
+    @property
+    def version(self):
+        return self.compiled.version
+
+    def reload(self):
+        """Recompile the rule set from disk; a bad file raises and keeps the current rules."""
+        with self._lock:
+            mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path) as f:
+                compiled = CompiledRules(json.load(f))
+            self.compiled, self._mtime = compiled, mtime
+        return compiled
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.reload_interval
+        mtime = self._mtime
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime != self._mtime:
+                self.reload()
+                self.last_error = None
+        except Exception as e:
+            # Keep serving the last good rule set and don't retry until the file changes again
+            self.last_error = str(e)
+            self._mtime = mtime
+
+    def current(self):
+        """The compiled rule set, reloaded first if the file changed; use one for a whole request."""
+        if self.reload_interval:
+            self._maybe_reload()
+        return self.compiled
+
+    def evaluate(self, txn):
+        if self.reload_interval:
+            self._maybe_reload()
+        return self.compiled.evaluate(txn)
+
+    def score(self, txn):
+        """Highest rule score only, with short-circuit evaluation."""
+        if self.reload_interval:
+            self._maybe_reload()
+        return self.compiled.score(txn)
+
+    def evaluate_batch(self, cols):
+        """Evaluate every rule as a column operation over a dict of equal-length arrays."""
+        if self.reload_interval:
+            self._maybe_reload()
+        return self.compiled.evaluate_batch(cols)
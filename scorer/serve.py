@@ -0,0 +1,258 @@
+"""Production launcher: load the model once, then fork CPU-pinned uvicorn workers that share it.
+
+Workers are forked after the model is loaded, so they share its pages copy-on-write (the flat
+artifact is memory-mapped and shared through the page cache anyway). They accept on one
+listening socket bound by the parent.
+
+- A worker that exits, including after --max-requests, is replaced on the same CPU.
+- SIGHUP reloads the latest model in the parent, then replaces the workers one at a time.
+- SIGTERM or SIGINT drains every worker and exits.
+"""
+import argparse
+import asyncio
+import gc
+import os
+import random
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+from collections import deque
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from monitor.metrics import retire_snapshot
+
+# How long a retiring worker keeps answering, with Connection: close, before it exits
+DRAIN_SECONDS = 2.0
+# A worker that dies sooner than this after starting is restarted after a pause, not in a tight loop
+MIN_WORKER_LIFETIME_S = 1.0
+
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def bind_socket(host, port, backlog=2048):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+def preload():
+    """Import the app and load the serving model in the parent, before any worker is forked."""
+    from scorer.app import app
+    from scorer.model_loader import get_model_loader
+    try:
+        get_model_loader().current()
+    except FileNotFoundError as e:
+        print("Model not preloaded ({}); workers will report not ready".format(e), file=sys.stderr)
+    # Objects allocated so far are never collected, so the collector doesn't touch (and copy) their pages
+    gc.collect()
+    gc.freeze()
+    return app
+
+class Recycler:
+    """ASGI wrapper that retires its worker gracefully, after max_requests or when asked to drain.
+
+    A draining worker stops accepting connections and every response carries Connection: close,
+    so keep-alive clients reconnect to another worker on their next request. The server exits
+    drain_seconds later, once busy connections have closed, instead of closing connections that
+    clients are about to reuse.
+    """
+
+    def __init__(self, app, max_requests=0, drain_seconds=DRAIN_SECONDS):
+        self.app = app
+        self.max_requests = max_requests
+        self.drain_seconds = drain_seconds
+        self.server = None
+        self.loop = None
+        self.requests = 0
+        self.draining = False
+
+    def drain(self):
+        if not self.draining:
+            self.draining = True
+            # Only this process stops listening; the other workers keep accepting on the shared socket
+            for listener in self.server.servers:
+                listener.close()
+            self.loop.call_later(self.drain_seconds, setattr, self.server, "should_exit", True)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            self.loop = asyncio.get_running_loop()
+            return await self.app(scope, receive, send)
+        self.requests += 1
+        if self.max_requests and self.requests >= self.max_requests:
+            self.drain()
+        if not self.draining:
+            return await self.app(scope, receive, send)
+
+        async def send_closing(message):
+            if message["type"] == "http.response.start":
+                message = dict(message, headers=list(message.get("headers", [])) + [(b"connection", b"close")])
+            await send(message)
+
+        await self.app(scope, receive, send_closing)
+
+def run_worker(app, sock, cpu, args):
+    for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, signal.SIG_DFL)
+    if cpu is not None:
+        os.sched_setaffinity(0, {cpu})
+    random.seed()
+    import uvicorn
+    # Jitter so workers started together are not all recycled at once
+    max_requests = args.max_requests + random.randint(0, args.max_requests_jitter) if args.max_requests else 0
+    recycler = Recycler(app, max_requests)
+    recycler.server = uvicorn.Server(uvicorn.Config(recycler, lifespan="on", log_level=args.log_level,
+                                                    timeout_graceful_shutdown=args.graceful_timeout))
+    # The launcher asks a worker to drain with SIGUSR1; SIGTERM is uvicorn's immediate graceful stop
+    signal.signal(signal.SIGUSR1, lambda signum, frame: recycler.loop.call_soon_threadsafe(recycler.drain))
+    recycler.server.run(sockets=[sock])
+
+class Launcher:
+    """Keeps one worker per slot running, replacing workers that exit."""
+
+    def __init__(self, app, sock, args, metrics_dir):
+        self.app = app
+        self.sock = sock
+        self.args = args
+        self.metrics_dir = metrics_dir
+        cpus = available_cpus()
+        self.slot_cpus = [cpus[i % len(cpus)] if args.pin else None for i in range(args.workers)]
+        # pid -> (slot, start time)
+        self.workers = {}
+        self.restart_after = [0.0] * args.workers
+        self.stopping = False
+        self.stop_deadline = None
+        self.reload_requested = False
+        self.to_replace = deque()
+        self.replacing = None
+
+    def spawn(self, slot):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                run_worker(self.app, self.sock, self.slot_cpus[slot], self.args)
+                code = 0
+            finally:
+                os._exit(code)
+        self.workers[pid] = (slot, time.monotonic())
+        print("Worker {} started in slot {} (cpu {})".format(pid, slot, self.slot_cpus[slot]), file=sys.stderr)
+        return pid
+
+    def reap(self):
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            slot, started = self.workers.pop(pid, (None, None))
+            if slot is None:
+                continue
+            retire_snapshot(self.metrics_dir, pid)
+            if pid == self.replacing:
+                self.replacing = None
+            elif not self.stopping and time.monotonic() - started < MIN_WORKER_LIFETIME_S:
+                self.restart_after[slot] = time.monotonic() + MIN_WORKER_LIFETIME_S
+            print("Worker {} exited with status {}".format(pid, os.waitstatus_to_exitcode(status)), file=sys.stderr)
+
+    def handle_stop(self, signum, frame):
+        self.stopping = True
+
+    def handle_reload(self, signum, frame):
+        self.reload_requested = True
+
+    def reload(self):
+        """Load the latest model in the parent, then queue every current worker for replacement."""
+        from scorer.model_loader import get_model_loader
+        gc.unfreeze()
+        try:
+            loaded = get_model_loader().reload()
+            print("Reloaded model {}".format(loaded.version), file=sys.stderr)
+        except Exception as e:
+            print("Reload failed, keeping the current model: {}".format(e), file=sys.stderr)
+        gc.collect()
+        gc.freeze()
+        self.to_replace.extend(self.workers)
+
+    def step(self):
+        self.reap()
+        if self.stopping:
+            if self.stop_deadline is None:
+                self.stop_deadline = time.monotonic() + self.args.graceful_timeout + 5
+                for pid in self.workers:
+                    os.kill(pid, signal.SIGTERM)
+            elif time.monotonic() > self.stop_deadline:
+                for pid in self.workers:
+                    os.kill(pid, signal.SIGKILL)
+            return
+        if self.reload_requested:
+            self.reload_requested = False
+            self.reload()
+        if self.replacing is None:
+            while self.to_replace:
+                pid = self.to_replace.popleft()
+                if pid in self.workers:
+                    # Start the replacement first so the slot never goes without a worker
+                    self.spawn(self.workers[pid][0])
+                    os.kill(pid, signal.SIGUSR1)
+                    self.replacing = pid
+                    break
+        occupied = {slot for slot, _ in self.workers.values()}
+        for slot in range(self.args.workers):
+            if slot not in occupied and time.monotonic() >= self.restart_after[slot]:
+                self.spawn(slot)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        signal.signal(signal.SIGHUP, self.handle_reload)
+        self.step()
+        while self.workers or not self.stopping:
+            time.sleep(0.1)
+            self.step()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("FRAUD_WORKERS", "0")) or len(available_cpus()),
+                        help="Default: FRAUD_WORKERS, else one per CPU in the affinity mask (set it to the CPU quota in containers)")
+    parser.add_argument("--no-pin", dest="pin", action="store_false", help="Don't pin each worker to a CPU")
+    parser.add_argument("--max-requests", type=int, default=0, help="Recycle a worker after this many requests; 0 never")
+    parser.add_argument("--max-requests-jitter", type=int, default=0)
+    parser.add_argument("--graceful-timeout", type=float, default=30.0, help="Seconds a stopping worker gets to finish requests")
+    parser.add_argument("--metrics-dir", default=None, help="Where workers publish metrics snapshots; default a temporary directory")
+    parser.add_argument("--log-level", default="warning")
+    args = parser.parse_args(argv)
+    if args.workers > 1 and os.environ.get("FRAUD_FEATURE_STORE", "0") == "1":
+        # Each worker would keep its own windows, so a user's velocity would depend on which worker answered
+        parser.error("FRAUD_FEATURE_STORE=1 needs --workers 1 (FRAUD_WORKERS=1): the feature store is per process")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    metrics_dir = args.metrics_dir or tempfile.mkdtemp(prefix="fraud-metrics-")
+    os.makedirs(metrics_dir, exist_ok=True)
+    # Read by scorer.app at import, so it is set before preload()
+    os.environ["FRAUD_METRICS_DIR"] = metrics_dir
+    app = preload()
+    sock = bind_socket(args.host, args.port)
+    print("Serving on {}:{} with {} workers".format(args.host, args.port, args.workers), file=sys.stderr)
+    try:
+        Launcher(app, sock, args, metrics_dir).run()
+    finally:
+        sock.close()
+        if args.metrics_dir is None:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
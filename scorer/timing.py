@@ -0,0 +1,63 @@
+"""Per-stage request timing, reported to clients in a Server-Timing header and aggregated in metrics."""
+import contextvars
+from time import perf_counter_ns
+from monitor.metrics import metrics
+from monitor.profiler import profiler
+
+_current = contextvars.ContextVar("stage_timer", default=None)
+
+class StageTimer:
+    """perf_counter_ns time spent in each named stage of one request."""
+
+    def __init__(self):
+        self.start = self.last = perf_counter_ns()
+        self.stages = {}
+
+    def mark(self, stage):
+        """Close the stage that ran since the previous mark."""
+        now = perf_counter_ns()
+        self.stages[stage] = self.stages.get(stage, 0) + now - self.last
+        self.last = now
+
+    def server_timing(self):
+        return ", ".join("{};dur={:.3f}".format(stage, ns / 1e6) for stage, ns in self.stages.items())
+
+def mark(stage):
+    timer = _current.get()
+    if timer is not None:
+        timer.mark(stage)
+
+class StageTimingMiddleware:
+    """Pure ASGI middleware timing validation, handler stages and serialization of the given paths.
+
+    "validation" runs until the handler's first mark, and "serialization" from its last mark to
+    the response start, so they cover body parsing and response encoding done by FastAPI.
+    Stage durations also go to the per-stage histograms in collector, and sampled requests
+    are profiled while the cProfile mode of the profiler is on.
+    """
+
+    def __init__(self, app, paths=("/score", "/score/batch"), collector=metrics):
+        self.app = app
+        self.paths = set(paths)
+        self.collector = collector
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+        timer = StageTimer()
+        token = _current.set(timer)
+        profile = profiler.begin_request()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                timer.mark("serialization")
+                self.collector.record_stages(scope["path"], timer.stages)
+                message = dict(message, headers=list(message.get("headers", [])) + [(b"server-timing", timer.server_timing().encode())])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            if profile is not None:
+                profiler.end_request(profile)
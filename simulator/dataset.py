@@ -0,0 +1,113 @@
+"""Locating, writing and reading generated transaction splits as CSV files, CSV shards or Parquet datasets."""
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+DATA_DIR = "data"
+FORMATS = ("csv", "parquet")
+# Parquet datasets are hive-partitioned by transaction month (month=2024-01/)
+PARTITION_COLUMN = "month"
+
+def data_path(split, data_dir=DATA_DIR):
+    return os.path.join(data_dir, "transactions_{}.csv".format(split))
+
+def shard_dir(split, data_dir=DATA_DIR):
+    return os.path.join(data_dir, "transactions_{}".format(split))
+
+def parquet_path(split, data_dir=DATA_DIR):
+    return os.path.join(data_dir, "transactions_{}.parquet".format(split))
+
+def shard_name(index):
+    return "part-{:05d}.csv".format(index)
+
+def split_path(split, data_dir=DATA_DIR):
+    """The Parquet dataset, else the CSV shard directory, else the single CSV file for a split."""
+    for path in (parquet_path(split, data_dir), shard_dir(split, data_dir)):
+        if os.path.isdir(path):
+            return path
+    return data_path(split, data_dir)
+
+def clear_split(split, data_dir=DATA_DIR):
+    """Remove every layout of a split so a stale one is never read."""
+    for path in (parquet_path(split, data_dir), shard_dir(split, data_dir)):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+    if os.path.exists(data_path(split, data_dir)):
+        os.remove(data_path(split, data_dir))
+
+def write_part(df, split, index, data_dir=DATA_DIR, fmt="csv"):
+    """Write one generated chunk of a split as its own part file(s)."""
+    if fmt == "parquet":
+        months = df["timestamp"].values.astype("datetime64[M]")
+        for month in np.unique(months):
+            part = df[months == month]
+            # Each file's dictionaries hold only the IDs it uses, not the whole population
+            part = part.assign(**{col: part[col].cat.remove_unused_categories() for col in part.select_dtypes("category")})
+            path = os.path.join(parquet_path(split, data_dir), "{}={}".format(PARTITION_COLUMN, month), "part-{:05d}.parquet".format(index))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            pq.write_table(pa.Table.from_pandas(part, preserve_index=False), path)
+    else:
+        os.makedirs(shard_dir(split, data_dir), exist_ok=True)
+        df.to_csv(os.path.join(shard_dir(split, data_dir), shard_name(index)), index=False)
+
+def is_parquet(path):
+    return path.endswith(".parquet")
+
+def transaction_files(path):
+    """Part files in order for a directory, or the path itself."""
+    if os.path.isdir(path):
+        if is_parquet(path):
+            return sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names if name.endswith(".parquet"))
+        return [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.startswith("part-")]
+    if not os.path.exists(path):
+        raise FileNotFoundError("Transactions not found: {}".format(path))
+    return [path]
+
+def count_rows(path):
+    """Rows in a split, from Parquet metadata or by counting CSV lines."""
+    total = 0
+    for file in transaction_files(path):
+        if is_parquet(file):
+            total += pq.ParquetFile(file).metadata.num_rows
+        else:
+            with open(file, "rb") as f:
+                total += sum(block.count(b"\n") for block in iter(lambda: f.read(1 << 20), b"")) - 1
+    return total
+
+def iter_transactions(path, columns=None, memory_map=True):
+    """One DataFrame per part file, with only the given columns, for bounded-memory passes."""
+    for file in transaction_files(path):
+        if is_parquet(file):
+            # IDs come back as categoricals from their dictionary encoding
+            yield pq.read_table(file, columns=columns, memory_map=memory_map).to_pandas()
+        else:
+            yield pd.read_csv(file, usecols=columns)
+
+def iter_transaction_chunks(path, chunk_size, columns=None, memory_map=True):
+    """DataFrames of exactly chunk_size rows (the last may be shorter), reading part files incrementally."""
+    buffered, n_buffered = [], 0
+    for file in transaction_files(path):
+        if is_parquet(file):
+            batches = (batch.to_pandas() for batch in
+                       pq.ParquetFile(file, memory_map=memory_map).iter_batches(batch_size=chunk_size, columns=columns))
+        else:
+            batches = pd.read_csv(file, usecols=columns, chunksize=chunk_size)
+        for batch in batches:
+            buffered.append(batch)
+            n_buffered += len(batch)
+            while n_buffered >= chunk_size:
+                frame = pd.concat(buffered, ignore_index=True)
+                yield frame.iloc[:chunk_size]
+                rest = frame.iloc[chunk_size:]
+                buffered, n_buffered = [rest], len(rest)
+    if n_buffered:
+        yield pd.concat(buffered, ignore_index=True)
+
+def read_transactions(path, columns=None, memory_map=True):
+    """A whole split as one DataFrame, reading only the given columns."""
+    if is_parquet(path):
+        return pq.read_table(path, columns=columns, memory_map=memory_map).to_pandas()
+    return pd.concat(iter_transactions(path, columns), ignore_index=True)
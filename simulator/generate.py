@@ -1,87 +1,200 @@
 """Synthetic transaction generator with realistic fraud patterns."""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
 import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from simulator.dataset import FORMATS, data_path, clear_split, write_part
 
-np.random.seed(42)
-
-def generate_transactions(n_transactions=100000, fraud_rate=0.02):
-    n_users = n_transactions // 50
-    n_merchants = n_transactions // 100
-    n_devices = n_users * 2
-    user_ids = ["user_{:05d}".format(i) for i in range(n_users)]
-    merchant_ids = ["merchant_{:04d}".format(i) for i in range(n_merchants)]
-    device_ids = ["device_{:06d}".format(i) for i in range(n_devices)]
-    user_profiles = {}
-    for uid in user_ids:
-        user_profiles[uid] = {
-            "avg_amount": np.random.lognormal(3, 1),
-            "primary_device": np.random.choice(device_ids[:n_users]),
-            "typical_hour_start": np.random.randint(8, 12),
-            "typical_hour_end": np.random.randint(18, 23),
-        }
-    transactions = []
-    start_date = datetime(2024, 1, 1)
-    for i in range(n_transactions):
-        user_id = np.random.choice(user_ids)
-        profile = user_profiles[user_id]
-        is_fraud = np.random.random() < fraud_rate
-        if is_fraud:
-            fraud_type = np.random.choice(["velocity", "new_device", "high_amount", "odd_hours"])
-            if fraud_type == "velocity":
-                amount = profile["avg_amount"] * np.random.uniform(0.5, 2)
-                device_id = profile["primary_device"]
-                hour = np.random.randint(profile["typical_hour_start"], profile["typical_hour_end"])
-                velocity_1h = np.random.randint(5, 20)
-            elif fraud_type == "new_device":
-                amount = profile["avg_amount"] * np.random.uniform(1, 3)
-                device_id = "device_{:06d}".format(np.random.randint(n_devices, n_devices + 10000))
-                hour = np.random.randint(0, 24)
-                velocity_1h = np.random.randint(1, 3)
-            elif fraud_type == "high_amount":
-                amount = profile["avg_amount"] * np.random.uniform(10, 50)
-                device_id = profile["primary_device"]
-                hour = np.random.randint(0, 24)
-                velocity_1h = np.random.randint(1, 5)
-            else:
-                amount = profile["avg_amount"] * np.random.uniform(1, 5)
-                device_id = profile["primary_device"]
-                hour = np.random.choice([0, 1, 2, 3, 4, 5])
-                velocity_1h = np.random.randint(1, 5)
-        else:
-            amount = max(1, np.random.lognormal(np.log(profile["avg_amount"]), 0.5))
-            device_id = profile["primary_device"] if np.random.random() > 0.1 else np.random.choice(device_ids)
-            hour = np.random.randint(profile["typical_hour_start"], profile["typical_hour_end"])
-            velocity_1h = np.random.randint(0, 3)
-        timestamp = start_date + timedelta(days=int(np.random.randint(0, 365)), hours=int(hour), minutes=int(np.random.randint(0, 60)))
-        transactions.append({
-            "transaction_id": "txn_{:08d}".format(i),
-            "user_id": user_id,
-            "merchant_id": np.random.choice(merchant_ids),
-            "device_id": device_id,
-            "amount": round(amount, 2),
-            "timestamp": timestamp,
-            "hour": hour,
-            "day_of_week": timestamp.weekday(),
-            "velocity_1h": velocity_1h,
-            "is_new_device": device_id != profile["primary_device"],
-            "is_fraud": int(is_fraud),
-        })
-    return pd.DataFrame(transactions)
-
-def main():
+START_DATE = np.datetime64("2024-01-01")
+# 2024-01-01 is a Monday
+START_WEEKDAY = 0
+FRAUD_TYPES = ("velocity", "new_device", "high_amount", "odd_hours")
+# [low, high) per fraud type: amount as a multiple of the user's average, velocity_1h, hour
+FRAUD_AMOUNT_FACTORS = np.array([[0.5, 1, 10, 1], [2, 3, 50, 5]])
+FRAUD_VELOCITY = np.array([[5, 1, 1, 1], [20, 3, 5, 5]])
+FRAUD_HOURS = np.array([[0, 0, 0, 0], [24, 24, 24, 6]])
+NEW_DEVICES = 10000
+CHUNK_SIZE = 500_000
+
+def make_population(n_transactions, rng):
+    """Per-user profile arrays, indexed by integer user code."""
+    n_users = max(n_transactions // 50, 1)
+    return {
+        "n_merchants": max(n_transactions // 100, 1),
+        "n_devices": n_users * 2,
+        "avg_amount": rng.lognormal(3, 1, n_users),
+        "primary_device": rng.integers(0, n_users, n_users),
+        "typical_hour_start": rng.integers(8, 12, n_users),
+        "typical_hour_end": rng.integers(18, 23, n_users),
+    }
+
+def id_categories(population):
+    """String labels for the integer user, merchant and device codes."""
+    n_users = len(population["avg_amount"])
+    return {
+        "user_id": ["user_{:05d}".format(i) for i in range(n_users)],
+        "merchant_id": ["merchant_{:04d}".format(i) for i in range(population["n_merchants"])],
+        "device_id": ["device_{:06d}".format(i) for i in range(population["n_devices"] + NEW_DEVICES)],
+    }
+
+def generate_chunk(population, start, size, fraud_rate, rng):
+    """Transactions start..start+size as arrays, with integer-coded user, merchant and device IDs."""
+    n_users = len(population["avg_amount"])
+    users = rng.integers(0, n_users, size)
+    avg_amount = population["avg_amount"][users]
+    primary_device = population["primary_device"][users]
+    hour_start = population["typical_hour_start"][users]
+    hour_end = population["typical_hour_end"][users]
+    is_fraud = rng.random(size) < fraud_rate
+
+    amount = np.maximum(1, rng.lognormal(np.log(avg_amount), 0.5))
+    device = np.where(rng.random(size) > 0.1, primary_device, rng.integers(0, population["n_devices"], size))
+    hour = rng.integers(hour_start, hour_end)
+    velocity_1h = rng.integers(0, 3, size)
+
+    # Fraud rows are overwritten with their pattern's ranges, looked up by fraud type code
+    fraud = np.flatnonzero(is_fraud)
+    fraud_type = rng.integers(0, len(FRAUD_TYPES), len(fraud))
+    amount_low, amount_high = FRAUD_AMOUNT_FACTORS[:, fraud_type]
+    amount[fraud] = avg_amount[fraud] * rng.uniform(amount_low, amount_high)
+    velocity_low, velocity_high = FRAUD_VELOCITY[:, fraud_type]
+    velocity_1h[fraud] = rng.integers(velocity_low, velocity_high)
+    hour_low, hour_high = FRAUD_HOURS[:, fraud_type]
+    typical = fraud_type == FRAUD_TYPES.index("velocity")
+    hour[fraud] = rng.integers(np.where(typical, hour_start[fraud], hour_low), np.where(typical, hour_end[fraud], hour_high))
+    new_device = fraud_type == FRAUD_TYPES.index("new_device")
+    device[fraud] = np.where(new_device, rng.integers(population["n_devices"], population["n_devices"] + NEW_DEVICES, len(fraud)),
+                             primary_device[fraud])
+
+    day = rng.integers(0, 365, size)
+    minute = rng.integers(0, 60, size)
+    return {
+        "transaction_id": np.arange(start, start + size),
+        "user_id": users,
+        "merchant_id": rng.integers(0, population["n_merchants"], size),
+        "device_id": device,
+        "amount": np.round(amount, 2),
+        "timestamp": START_DATE + (day * 1440 + hour * 60 + minute).astype("timedelta64[m]"),
+        "hour": hour,
+        "day_of_week": (START_WEEKDAY + day) % 7,
+        "velocity_1h": velocity_1h,
+        "is_new_device": device != primary_device,
+        "is_fraud": is_fraud.astype(np.int64),
+    }
+
+def chunk_to_frame(chunk, categories):
+    """DataFrame of a chunk with IDs as categoricals over the shared ID labels."""
+    df = pd.DataFrame(chunk)
+    df["transaction_id"] = ["txn_{:08d}".format(i) for i in chunk["transaction_id"].tolist()]
+    for col, labels in categories.items():
+        df[col] = pd.Categorical.from_codes(chunk[col], categories=labels)
+    return df
+
+def plan_chunks(n_transactions, seed, chunk_size):
+    """Population seed and (index, start, size, seed) per chunk; chunks depend only on these, not on who runs them."""
+    population_seq, chunks_seq = np.random.SeedSequence(seed).spawn(2)
+    starts = range(0, n_transactions, chunk_size)
+    chunks = [(i, start, min(chunk_size, n_transactions - start), chunk_seq)
+              for i, (start, chunk_seq) in enumerate(zip(starts, chunks_seq.spawn(len(starts))))]
+    return population_seq, chunks
+
+def iter_chunks(n_transactions=100000, fraud_rate=0.02, seed=42, chunk_size=CHUNK_SIZE):
+    """Transactions as a stream of DataFrames; each chunk has its own SeedSequence child."""
+    population_seq, chunks = plan_chunks(n_transactions, seed, chunk_size)
+    population = make_population(n_transactions, np.random.default_rng(population_seq))
+    categories = id_categories(population)
+    for _, start, size, chunk_seq in chunks:
+        yield chunk_to_frame(generate_chunk(population, start, size, fraud_rate, np.random.default_rng(chunk_seq)), categories)
+
+def generate_transactions(n_transactions=100000, fraud_rate=0.02, seed=42, chunk_size=CHUNK_SIZE):
+    return pd.concat(iter_chunks(n_transactions, fraud_rate, seed, chunk_size), ignore_index=True)
+
+def write_splits(chunks, n_transactions, train_path, test_path, train_fraction=0.8):
+    """Stream chunks into train and test CSVs, splitting at train_fraction of the rows."""
+    train_size = int(n_transactions * train_fraction)
+    stats = {"train": [0, 0], "test": [0, 0]}
+    offset = 0
+    for df in chunks:
+        cut = min(max(train_size - offset, 0), len(df))
+        for name, path, part in [("train", train_path, df.iloc[:cut]), ("test", test_path, df.iloc[cut:])]:
+            if len(part):
+                part.to_csv(path, mode="a", header=not stats[name][0], index=False)
+                stats[name][0] += len(part)
+                stats[name][1] += int(part["is_fraud"].sum())
+        offset += len(df)
+    return stats
+
+_worker = {}
+
+def _init_worker(n_transactions, fraud_rate, population_seq, train_size, output_dir, fmt):
+    population = make_population(n_transactions, np.random.default_rng(population_seq))
+    _worker.update(population=population, categories=id_categories(population), fraud_rate=fraud_rate,
+                   train_size=train_size, output_dir=output_dir, fmt=fmt)
+
+def _write_shard(chunk):
+    """Generate one chunk in a worker process and write its train and test parts."""
+    index, start, size, chunk_seq = chunk
+    rng = np.random.default_rng(chunk_seq)
+    df = chunk_to_frame(generate_chunk(_worker["population"], start, size, _worker["fraud_rate"], rng), _worker["categories"])
+    cut = min(max(_worker["train_size"] - start, 0), size)
+    stats = {}
+    for split, part in [("train", df.iloc[:cut]), ("test", df.iloc[cut:])]:
+        if len(part):
+            write_part(part, split, index, _worker["output_dir"], _worker["fmt"])
+        stats[split] = (len(part), int(part["is_fraud"].sum()))
+    return stats
+
+def write_shards(n_transactions, fraud_rate, seed, chunk_size, output_dir, workers, train_fraction=0.8, fmt="csv"):
+    """Write one shard per chunk (CSV parts or Parquet files) for each split from a pool of worker processes."""
+    population_seq, chunks = plan_chunks(n_transactions, seed, chunk_size)
+    for split in ("train", "test"):
+        clear_split(split, output_dir)
+    stats = {"train": [0, 0], "test": [0, 0]}
+    init_args = (n_transactions, fraud_rate, population_seq, int(n_transactions * train_fraction), output_dir, fmt)
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=init_args) as pool:
+        for shard_stats in pool.map(_write_shard, chunks):
+            for split, (rows, frauds) in shard_stats.items():
+                stats[split][0] += rows
+                stats[split][1] += frauds
+    return stats
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--n-transactions", type=int, default=100000)
+    parser.add_argument("--fraud-rate", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Rows generated and written at a time")
+    parser.add_argument("--output-dir", default="data")
+    parser.add_argument("--format", choices=FORMATS, default="csv",
+                        help="parquet writes month-partitioned datasets with dictionary-encoded IDs, one file per chunk")
+    parser.add_argument("--shards", action="store_true", help="Write one CSV per chunk into transactions_{train,test}/")
+    parser.add_argument("--workers", type=int, default=1, help="Processes generating shards; output does not depend on it")
+    args = parser.parse_args(argv)
+    # Parquet datasets are always written a file per chunk
+    args.shards = args.shards or args.format == "parquet"
+    if args.workers > 1 and not args.shards:
+        parser.error("--workers requires --shards or --format parquet")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
     print("Generating synthetic transactions...")
-    df = generate_transactions(n_transactions=100000, fraud_rate=0.02)
-    os.makedirs("data", exist_ok=True)
-    train_size = int(len(df) * 0.8)
-    train_df = df.iloc[:train_size]
-    test_df = df.iloc[train_size:]
-    train_df.to_csv("data/transactions_train.csv", index=False)
-    test_df.to_csv("data/transactions_test.csv", index=False)
-    print("Generated {} transactions".format(len(df)))
-    print("  Train: {} ({:.2f}% fraud)".format(len(train_df), train_df["is_fraud"].mean()*100))
-    print("  Test: {} ({:.2f}% fraud)".format(len(test_df), test_df["is_fraud"].mean()*100))
+    os.makedirs(args.output_dir, exist_ok=True)
+    if args.shards:
+        stats = write_shards(args.n_transactions, args.fraud_rate, args.seed, args.chunk_size, args.output_dir, args.workers,
+                             fmt=args.format)
+    else:
+        for split in ("train", "test"):
+            clear_split(split, args.output_dir)
+        chunks = iter_chunks(args.n_transactions, args.fraud_rate, args.seed, args.chunk_size)
+        stats = write_splits(chunks, args.n_transactions, data_path("train", args.output_dir), data_path("test", args.output_dir))
+    print("Generated {} transactions".format(args.n_transactions))
+    for name in ("train", "test"):
+        rows, frauds = stats[name]
+        print("  {}: {} ({:.2f}% fraud)".format(name.capitalize(), rows, frauds / max(rows, 1) * 100))
 
 if __name__ == "__main__":
     main()
@@ -1,11 +1,53 @@
 """Tests for fraud scoring service."""
 import pytest
+import asyncio
 import sys
 import os
+import time
+import numpy as np
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from scorer.features import extract_features, features_to_array, FEATURE_NAMES
+from fastapi.testclient import TestClient
+from sklearn.ensemble import RandomForestClassifier
+import pandas as pd
+from scorer.features import extract_features, features_to_array, extract_features_frame, feature_buffer, write_features, FEATURE_NAMES
 from scorer.rules import RulesEngine
+from scorer import model_loader
+from scorer.model_loader import get_model_loader, LoadedModel
+from scorer.flat_forest import FlatForest, flatten_forest
+from scorer.batcher import MicroBatcher
+from scorer.feature_store import FeatureStore, WindowStore, HOUR_WINDOW, DAY_WINDOW
+from scorer.app import app
+
+def make_transactions(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return [
+        {
+            "transaction_id": "txn_{:08d}".format(i),
+            "user_id": "user_{:05d}".format(int(rng.integers(0, 100))),
+            "merchant_id": "merchant_{:04d}".format(int(rng.integers(0, 50))),
+            "device_id": "device_{:06d}".format(int(rng.integers(0, 200))),
+            "amount": round(float(rng.lognormal(4, 1.5)), 2),
+            "hour": int(rng.integers(0, 24)),
+            "day_of_week": int(rng.integers(0, 7)),
+            "velocity_1h": int(rng.integers(0, 15)),
+            "is_new_device": bool(rng.random() < 0.2),
+        }
+        for i in range(n)
+    ]
+@pytest.fixture(scope="module")
+def model():
+    txns = make_transactions(500, seed=1)
+    X = np.array([features_to_array(extract_features(t)) for t in txns])
+    y = ((X[:, FEATURE_NAMES.index("velocity_1h")] > 8) | (X[:, FEATURE_NAMES.index("amount_scaled")] > 0.5)).astype(int)
+    return RandomForestClassifier(n_estimators=10, max_depth=5, random_state=0).fit(X, y)
+
+@pytest.fixture(scope="module")
+def client(model):
+    loader = get_model_loader()
+    loader._current = LoadedModel(model, "test")
+    yield TestClient(app)
+    loader._current = None
 
 class TestFeatureExtraction:
     def test_extract_features_basic(self):
@@ -32,10 +74,72 @@ class TestFeatureExtraction:
         arr = features_to_array(features)
         assert len(arr) == len(FEATURE_NAMES)
 
+class TestVectorizedFeatureParity:
+    def scalar_matrix(self, txns):
+        return np.array([features_to_array(extract_features(t)) for t in txns])
+    
+    def test_random_transactions(self):
+        txns = make_transactions(500)
+        np.testing.assert_allclose(extract_features_frame(pd.DataFrame(txns)), self.scalar_matrix(txns))
+    
+    def test_boundaries(self):
+        txns = [
+            {"amount": amount, "hour": hour, "day_of_week": dow, "velocity_1h": velocity, "is_new_device": new}
+            for amount, hour, dow, velocity, new in [
+                (0, 0, 0, 0, False), (0.01, 5, 4, 5, True), (999.99, 6, 5, 6, False),
+                (10000, 22, 6, 100, True), (250000, 23, 6, 1, False),
+            ]
+        ]
+        np.testing.assert_allclose(extract_features_frame(pd.DataFrame(txns)), self.scalar_matrix(txns))
+    
+    def test_missing_columns_use_defaults(self):
+        txns = [{"amount": 120.0}, {"amount": 5.5}]
+        np.testing.assert_allclose(extract_features_frame({"amount": np.array([120.0, 5.5])}), self.scalar_matrix(txns))
+    
+    def test_hot_path_buffer(self):
+        txns = make_transactions(200)
+        buf = feature_buffer()
+        for txn in txns:
+            out = write_features(buf, txn["amount"], txn["hour"], txn["day_of_week"], txn["velocity_1h"], txn["is_new_device"])
+            assert out is buf
+            np.testing.assert_allclose(out, features_to_array(extract_features(txn)), rtol=1e-12, atol=1e-12)
+    
+    def test_training_uses_vectorized_path(self):
+        from training.train import prepare_features
+        txns = make_transactions(50)
+        np.testing.assert_allclose(prepare_features(pd.DataFrame(txns)), self.scalar_matrix(txns))
+
 class TestRulesEngine:
     def setup_method(self):
         self.engine = RulesEngine()
     
+    def test_short_circuit_score_matches_full_evaluation(self):
+        for txn in make_transactions(500, seed=4):
+            assert self.engine.score(txn) == self.engine.evaluate(txn)["rules_score"]
+    
+    def test_rules_hot_reload(self, tmp_path):
+        import json
+        path = tmp_path / "rules.json"
+        config = {"rules": [{"name": "big", "tiers": [{"when": [["amount", ">", 100]], "score": 0.5}]}]}
+        path.write_text(json.dumps(config))
+        engine = RulesEngine(path=str(path), reload_interval=0.01)
+        assert engine.evaluate({"amount": 150})["rules_score"] == 0.5
+        config["rules"][0]["tiers"][0]["score"] = 0.9
+        path.write_text(json.dumps(config))
+        os.utime(path, ns=(0, 10**18))
+        time.sleep(0.02)
+        assert engine.evaluate({"amount": 150})["rules_score"] == 0.9
+        path.write_text("{not json")
+        os.utime(path, ns=(0, 2 * 10**18))
+        time.sleep(0.02)
+        assert engine.evaluate({"amount": 150})["rules_score"] == 0.9
+        assert engine.last_error is not None
+    
+    def test_invalid_rules_rejected(self):
+        for condition in [["__import__('os')", ">", 1], ["amount", "in", 1], ["amount", ">", "1; x"]]:
+            with pytest.raises(ValueError):
+                RulesEngine(config={"rules": [{"name": "bad", "tiers": [{"when": [condition], "score": 1}]}]})
+    
     def test_high_velocity_rule(self):
         txn = {"velocity_1h": 10, "amount": 100, "hour": 12, "is_new_device": False}
         result = self.engine.evaluate(txn)
@@ -54,5 +158,855 @@ class TestRulesEngine:
         result = self.engine.evaluate(txn)
         assert result["rules_count"] == 0
 
+class TestBatchScoring:
+    def test_batch_rules_match_scalar(self):
+        engine = RulesEngine()
+        txns = make_transactions(200)
+        cols = {k: np.array([t[k] for t in txns]) for k in ["amount", "hour", "velocity_1h", "is_new_device"]}
+        batch = engine.evaluate_batch(cols)
+        for i, txn in enumerate(txns):
+            expected = engine.evaluate(txn)
+            assert batch["rules_triggered"][i] == expected["rules_triggered"]
+            assert batch["rules_score"][i] == expected["rules_score"]
+            assert batch["rules_count"][i] == expected["rules_count"]
+    
+    def test_batch_endpoint_matches_single(self, client):
+        txns = make_transactions(100)
+        response = client.post("/score/batch", json=txns)
+        assert response.status_code == 200
+        results = response.json()
+        assert [r["transaction_id"] for r in results] == [t["transaction_id"] for t in txns]
+        for txn, result in zip(txns, results):
+            single = client.post("/score", json=txn).json()
+            for key in ["fraud_score", "ml_score", "rules_score", "decision", "rules_triggered"]:
+                assert result[key] == single[key]
+    
+    def test_flagged_rules_only_on_review_and_decline(self, client, monkeypatch):
+        from scorer import app as app_module
+        txns = make_transactions(100)
+        full = [client.post("/score", json=txn).json() for txn in txns]
+        monkeypatch.setattr(app_module, "RULES_TRIGGERED", "flagged")
+        single = [client.post("/score", json=txn).json() for txn in txns]
+        batch = client.post("/score/batch", json=txns).json()
+        assert {r["decision"] for r in full} > {"APPROVE"}
+        for expected, one, many in zip(full, single, batch):
+            assert one["fraud_score"] == many["fraud_score"] == expected["fraud_score"]
+            assert one["decision"] == many["decision"] == expected["decision"]
+            triggered = [] if expected["decision"] == "APPROVE" else expected["rules_triggered"]
+            assert one["rules_triggered"] == many["rules_triggered"] == triggered
+    
+    def test_batch_endpoint_empty(self, client):
+        response = client.post("/score/batch", json=[])
+        assert response.status_code == 200
+        assert response.json() == []
+
+class TestPipeline:
+    def test_matches_batch_endpoint_in_order(self, client, tmp_path):
+        import json
+        import pyarrow.parquet as pq
+        from scorer.pipeline import main
+        txns = make_transactions(250, seed=11)
+        path = tmp_path / "txns.jsonl"
+        path.write_text("".join(json.dumps(t) + "\n" for t in txns))
+        expected = client.post("/score/batch", json=txns).json()
+        for result in expected:
+            del result["latency_ms"]
+        for workers in [0, 2]:
+            out = tmp_path / "scores-{}.jsonl".format(workers)
+            stats = main(["--input", str(path), "--output", str(out), "--batch-size", "32", "--workers", str(workers)])
+            assert [json.loads(line) for line in out.read_text().splitlines()] == expected
+            assert stats["rows"] == 250 and stats["batches"] == 8 and stats["rows_per_second"] > 0
+        main(["--input", str(path), "--output", str(tmp_path / "scores.parquet"), "--batch-size", "100", "--workers", "0"])
+        assert pq.read_table(tmp_path / "scores.parquet").to_pylist() == expected
+    
+    def test_ordered_map_bounds_pending_items(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from scorer.pipeline import ordered_map
+        taken = []
+    
+        def items():
+            for i in range(40):
+                taken.append(i)
+                yield i
+    
+        def work(i):
+            time.sleep(0.001 * (i % 3))
+            return i * i
+    
+        results = []
+        with ThreadPoolExecutor(4) as pool:
+            for result in ordered_map(work, items(), pool, max_pending=3):
+                assert len(taken) - len(results) <= 3
+                results.append(result)
+        assert results == [i * i for i in range(40)]
+
+class TestFlatForest:
+    def test_matches_sklearn(self, model):
+        X = extract_features_frame(pd.DataFrame(make_transactions(1000, seed=3)))
+        flat = FlatForest(flatten_forest(model))
+        np.testing.assert_allclose(flat.predict_fraud(X), model.predict_proba(X)[:, 1], atol=1e-12)
+        np.testing.assert_allclose(flat.predict_fraud(X[:1]), model.predict_proba(X[:1])[:, 1], atol=1e-12)
+    
+    def test_rejects_wrong_feature_count(self, model):
+        flat = FlatForest(flatten_forest(model))
+        with pytest.raises(ValueError):
+            flat.predict_fraud(np.zeros((2, 3)))
+    
+    def test_loader_serves_flat_artifact(self, model, tmp_path):
+        from training.train import export_flat_model
+        path = str(tmp_path / "fraud_model_flat.joblib")
+        export_flat_model(model, path)
+        X = extract_features_frame(pd.DataFrame(make_transactions(20)))
+        loader = get_model_loader()
+        previous = loader._current
+        try:
+            loader.reload(model_path=path)
+            assert isinstance(loader.load(), FlatForest)
+            np.testing.assert_allclose(loader.predict_proba_batch(X), model.predict_proba(X)[:, 1], atol=1e-12)
+            assert abs(loader.predict_proba(X[0]) - model.predict_proba(X[:1])[0, 1]) < 1e-12
+        finally:
+            loader._current = previous
+
+class TestMicroBatcher:
+    def test_concurrent_requests_share_batches(self):
+        batch_sizes = []
+        def predict_batch(rows):
+            batch_sizes.append(len(rows))
+            return rows[:, 0] * 2
+        batcher = MicroBatcher(predict_batch, max_batch_size=16, max_wait_ms=5)
+        async def run():
+            return await asyncio.gather(*[batcher.submit(np.array([float(i), 0.0])) for i in range(100)])
+        results = asyncio.run(run())
+        assert results == [2.0 * i for i in range(100)]
+        assert sum(batch_sizes) == 100
+        assert max(batch_sizes) <= 16
+        assert len(batch_sizes) < 100
+        stats = batcher.stats()
+        assert stats["rows"] == 100
+        assert stats["batches"] == len(batch_sizes)
+    
+    def test_errors_reach_every_caller(self):
+        def predict_batch(rows):
+            raise FileNotFoundError("no model")
+        batcher = MicroBatcher(predict_batch)
+        async def run():
+            return await asyncio.gather(*[batcher.submit(np.zeros(2)) for _ in range(3)], return_exceptions=True)
+        assert all(isinstance(r, FileNotFoundError) for r in asyncio.run(run()))
+    
+    def test_stats_endpoint(self, client):
+        client.post("/score", json=make_transactions(1)[0])
+        stats = client.get("/admin/batcher").json()
+        assert stats["enabled"] is True
+        assert stats["rows"] >= 1
+
+class TestModelVersions:
+    def test_responses_carry_model_version(self, client):
+        assert client.get("/health").json()["model_version"] == "test"
+        assert client.post("/score", json=make_transactions(1)[0]).json()["model_version"] == "test"
+        assert client.post("/score/batch", json=make_transactions(2)).json()[0]["model_version"] == "test"
+    
+    def test_reload_swaps_published_versions(self, client, model, tmp_path, monkeypatch):
+        from training.train import save_artifacts
+        monkeypatch.setattr(model_loader, "MODEL_DIR", str(tmp_path))
+        loader = get_model_loader()
+        previous = loader._current
+        try:
+            save_artifacts(model, {"auc": 1.0}, version="v1")
+            save_artifacts(model, {"auc": 1.0}, version="v2")
+            assert model_loader.latest_version() == "v2"
+            response = client.post("/admin/reload")
+            assert response.json() == {"model_version": "v2", "previous_version": "test"}
+            response = client.post("/admin/reload", json={"version": "v1"})
+            assert response.json() == {"model_version": "v1", "previous_version": "v2"}
+            assert client.post("/score", json=make_transactions(1)[0]).json()["model_version"] == "v1"
+            assert client.post("/admin/reload", json={"version": "missing"}).status_code == 404
+            assert loader.version == "v1"
+        finally:
+            loader._current = previous
+    
+    def test_reload_rejects_paths_outside_versions(self, client, model, tmp_path, monkeypatch):
+        from training.train import save_artifacts
+        monkeypatch.setattr(model_loader, "MODEL_DIR", str(tmp_path / "models"))
+        outside = tmp_path / "evil"
+        outside.mkdir()
+        import joblib
+        joblib.dump(model, outside / "fraud_model.joblib")
+        loader = get_model_loader()
+        previous = loader._current
+        try:
+            save_artifacts(model, {"auc": 1.0}, version="v1")
+            for version in ["../../evil", str(outside), "..", "v1/../v1", ""]:
+                assert client.post("/admin/reload", json={"version": version}).status_code == 404
+            assert loader._current is previous
+        finally:
+            loader._current = previous
+
+class TestStartup:
+    def wait_ready(self, client):
+        deadline = time.time() + 10
+        while client.get("/ready").status_code != 200 and time.time() < deadline:
+            time.sleep(0.01)
+        return client.get("/ready")
+    
+    def test_lifespan_warms_up_and_reports_ready(self, client, monkeypatch):
+        import scorer.app as app_module
+        monkeypatch.setattr(app_module, "readiness", {"ready": False, "error": None, "load_seconds": None})
+        assert client.get("/ready").status_code == 503
+        with TestClient(app) as started:
+            response = self.wait_ready(started)
+            assert response.status_code == 200 and response.json()["model_version"] == "test"
+            assert started.get("/health").json()["ready"] is True
+    
+    def test_missing_model_is_live_but_not_ready(self, client, tmp_path, monkeypatch):
+        import scorer.app as app_module
+        monkeypatch.setattr(app_module, "readiness", {"ready": False, "error": None, "load_seconds": None})
+        monkeypatch.setattr(model_loader, "MODEL_DIR", str(tmp_path))
+        loader = get_model_loader()
+        previous = loader._current
+        loader._current = None
+        try:
+            with TestClient(app) as started:
+                deadline = time.time() + 10
+                while app_module.readiness["error"] is None and time.time() < deadline:
+                    time.sleep(0.01)
+                assert started.get("/live").status_code == 200
+                response = started.get("/ready")
+                assert response.status_code == 503 and "FileNotFoundError" in response.json()["detail"]
+                assert started.get("/health").json()["model_loaded"] is False
+                # Probes never try to load the model themselves
+                assert loader._current is None
+        finally:
+            loader._current = previous
+
+class TestLauncher:
+    def test_recycler_drains_before_exit(self, client):
+        import httpx
+        from types import SimpleNamespace
+        from scorer.serve import Recycler
+        
+        class Listener:
+            closed = False
+            def close(self):
+                self.closed = True
+        
+        async def run():
+            recycler = Recycler(app, max_requests=2, drain_seconds=0.05)
+            recycler.loop = asyncio.get_running_loop()
+            recycler.server = SimpleNamespace(should_exit=False, servers=[Listener()])
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=recycler), base_url="http://asgi") as http:
+                first = await http.get("/live")
+                second = await http.get("/live")
+            assert "connection" not in first.headers and second.headers["connection"] == "close"
+            assert recycler.server.servers[0].closed and not recycler.server.should_exit
+            await asyncio.sleep(0.1)
+            assert recycler.server.should_exit
+        
+        asyncio.run(run())
+    
+    @pytest.mark.skipif(not os.path.exists("/proc/self/smaps_rollup"), reason="Linux only")
+    def test_workers_share_socket_and_metrics(self, model, tmp_path):
+        import signal
+        import socket
+        import subprocess
+        import httpx
+        from training.train import save_artifacts
+        save_artifacts(model, {"auc": 1.0}, model_dir=str(tmp_path / "models"), version="served")
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, FRAUD_MODEL_DIR=str(tmp_path / "models"), FRAUD_METRICS_PUBLISH_INTERVAL_S="0.1")
+        process = subprocess.Popen([sys.executable, os.path.join(root, "scorer", "serve.py"), "--port", str(port), "--workers", "2",
+                                    "--max-requests", "10"], env=env, cwd=str(tmp_path), stderr=subprocess.DEVNULL)
+        try:
+            with httpx.Client(base_url="http://127.0.0.1:{}".format(port)) as http:
+                deadline = time.time() + 30
+                while time.time() < deadline:
+                    try:
+                        if http.get("/ready").status_code == 200:
+                            break
+                    except httpx.TransportError:
+                        time.sleep(0.1)
+                statuses = [http.post("/score", json=txn).status_code for txn in make_transactions(40)]
+                assert statuses == [200] * 40
+                time.sleep(0.5)
+                # Recycled workers' counts are kept, and live workers' are merged, whichever worker answers
+                assert http.get("/admin/metrics").json()["request_count"] == 40
+        finally:
+            process.send_signal(signal.SIGTERM)
+            assert process.wait(timeout=30) == 0
+
+class TestResultCache:
+    def test_lru_ttl_and_memory_cap(self):
+        from scorer.result_cache import LocalCache
+        cache = LocalCache(max_entries=3, ttl_seconds=10)
+        for i in range(3):
+            cache.set(b"k%d" % i, b"v", now=0)
+        assert cache.get(b"k0", now=1) == b"v"
+        cache.set(b"k3", b"v", now=1)
+        assert cache.get(b"k1", now=1) is None and cache.evictions == 1
+        assert cache.get(b"k0", now=11) is None and cache.expirations == 1
+        size = LocalCache.entry_size(b"k0", b"x" * 100)
+        cache = LocalCache(max_bytes=int(size * 2.5))
+        for i in range(5):
+            cache.set(b"k%d" % i, b"x" * 100)
+        assert len(cache) == 2 and cache.nbytes <= cache.max_bytes
+        cache.clear()
+        assert len(cache) == 0 and cache.nbytes == 0
+    
+    def test_key_normalization(self):
+        from scorer.result_cache import cache_key
+        txn = make_transactions(1)[0]
+        assert cache_key(txn, "v1", "r1") == cache_key(dict(reversed(list(txn.items()))), "v1", "r1")
+        assert cache_key(txn, "v1", "r1") != cache_key(txn, "v2", "r1")
+        assert cache_key(txn, "v1", "r1") != cache_key(txn, "v1", "r2")
+        assert cache_key(dict(txn, velocity_1h=0), "v1", "r1") != cache_key(dict(txn, velocity_1h=None), "v1", "r1")
+    
+    def test_score_endpoint_hits_and_shared_backend(self, client, monkeypatch):
+        import scorer.app as app_module
+        from scorer.result_cache import ResultCache, LocalCache, MemoryBackend
+        backend = MemoryBackend()
+        monkeypatch.setattr(app_module, "result_cache", ResultCache(LocalCache(), backend))
+        txn = make_transactions(1, seed=5)[0]
+        first = client.post("/score", json=txn)
+        second = client.post("/score", json=txn)
+        assert (first.headers["x-cache"], second.headers["x-cache"]) == ("miss", "hit")
+        assert {**second.json(), "latency_ms": None} == {**first.json(), "latency_ms": None}
+        assert "cache" in second.headers["server-timing"]
+        assert client.post("/score", json=dict(txn, amount=txn["amount"] + 1)).headers["x-cache"] == "miss"
+        stats = client.get("/admin/cache").json()
+        assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 2, 2)
+        assert "fraud_result_cache_hits_total 1" in client.get("/metrics").text
+        # Another worker's cache on the same backend
+        monkeypatch.setattr(app_module, "result_cache", ResultCache(LocalCache(), backend))
+        assert client.post("/score", json=txn).headers["x-cache"] == "hit"
+        assert client.get("/admin/cache").json()["shared_hits"] == 1
+    
+    def test_hit_reports_its_own_latency(self, client, monkeypatch):
+        import json
+        import scorer.app as app_module
+        from scorer.result_cache import ResultCache, LocalCache, cache_key
+        cache = LocalCache()
+        monkeypatch.setattr(app_module, "result_cache", ResultCache(cache))
+        txn = make_transactions(1, seed=7)[0]
+        stored = client.post("/score", json=txn).json()
+        key = cache_key(dict(txn, timestamp=None), "test", app_module.rules_engine.version)
+        cache.set(key, json.dumps(dict(stored, latency_ms=9999.0)).encode())
+        hit = client.post("/score", json=txn)
+        assert hit.headers["x-cache"] == "hit"
+        assert hit.json()["latency_ms"] < 9999.0
+        assert {**hit.json(), "latency_ms": None} == {**stored, "latency_ms": None}
+    
+    def test_rules_reload_before_lookup(self, client, tmp_path, monkeypatch):
+        import json
+        import os
+        import scorer.app as app_module
+        from scorer.result_cache import ResultCache, LocalCache
+        monkeypatch.setattr(app_module, "result_cache", ResultCache(LocalCache()))
+        path = tmp_path / "rules.json"
+        rule = {"name": "any_amount", "tiers": [{"when": [["amount", ">", 0]], "score": 0.2}]}
+        path.write_text(json.dumps({"rules": [rule]}))
+        monkeypatch.setattr(app_module, "rules_engine", RulesEngine(str(path), reload_interval=1e-9))
+        txn = make_transactions(1, seed=8)[0]
+        client.post("/score", json=txn)
+        assert client.post("/score", json=txn).headers["x-cache"] == "hit"
+        rule["tiers"][0]["score"] = 0.9
+        path.write_text(json.dumps({"rules": [rule]}))
+        os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1_000_000_000))
+        response = client.post("/score", json=txn)
+        assert response.headers["x-cache"] == "miss" and response.json()["rules_score"] == 0.9
+    
+    def test_reload_invalidates(self, client, model, tmp_path, monkeypatch):
+        import scorer.app as app_module
+        from scorer.result_cache import ResultCache, LocalCache
+        from training.train import save_artifacts
+        monkeypatch.setattr(app_module, "result_cache", ResultCache(LocalCache()))
+        monkeypatch.setattr(model_loader, "MODEL_DIR", str(tmp_path))
+        loader = get_model_loader()
+        previous = loader._current
+        try:
+            txn = make_transactions(1, seed=6)[0]
+            client.post("/score", json=txn)
+            assert client.post("/score", json=txn).headers["x-cache"] == "hit"
+            save_artifacts(model, {"auc": 1.0}, version="cached")
+            client.post("/admin/reload")
+            assert client.get("/admin/cache").json()["entries"] == 0
+            response = client.post("/score", json=txn)
+            assert response.headers["x-cache"] == "miss" and response.json()["model_version"] == "cached"
+        finally:
+            loader._current = previous
+
+class TestFeatureStore:
+    def txn(self, user="u1", device="d1", merchant="m1", amount=10.0, timestamp=1_000_000.0):
+        return {"user_id": user, "device_id": device, "merchant_id": merchant, "amount": amount, "timestamp": timestamp}
+    
+    def test_velocity_counts_prior_transactions_in_window(self):
+        store = FeatureStore()
+        t0 = 1_000_000.0
+        first = store.observe(self.txn(timestamp=t0), arrival=t0)
+        assert first["velocity_1h"] == 0
+        assert first["is_new_device"] is True
+        for i in range(1, 4):
+            features = store.observe(self.txn(amount=20.0, timestamp=t0 + 60 * i), arrival=t0 + 60 * i)
+        assert features["velocity_1h"] == 3
+        assert features["amount_1h"] == pytest.approx(50.0)
+        assert features["is_new_device"] is False
+        assert features["device_velocity_1h"] == 3
+        later = store.observe(self.txn(timestamp=t0 + 2 * 3600), arrival=t0 + 2 * 3600)
+        assert later["velocity_1h"] == 0
+        assert later["velocity_24h"] == 4
+        assert store.observe(self.txn(timestamp=t0 + 25 * 3600), arrival=t0 + 25 * 3600)["velocity_24h"] == 1
+    
+    def test_known_devices_are_per_user(self):
+        store = FeatureStore()
+        store.observe(self.txn(user="u1", device="d1"))
+        assert store.observe(self.txn(user="u2", device="d1"))["is_new_device"] is True
+        assert store.observe(self.txn(user="u1", device="d2"))["is_new_device"] is True
+        assert store.observe(self.txn(user="u1", device="d1"))["is_new_device"] is False
+    
+    def test_event_time_is_clamped_to_arrival(self):
+        store = FeatureStore(max_skew_seconds=300)
+        t0 = 1_000_000.0
+        store.observe(self.txn(timestamp=t0 - 100), arrival=t0)
+        for timestamp in [1e300, -1e300, float("nan"), t0 + 86400, t0 - 86400]:
+            features = store.observe(self.txn(timestamp=timestamp), arrival=t0)
+        # Every out-of-range event was counted at arrival time, in the same hour as the first
+        assert features["velocity_1h"] == 5
+        assert store.stats()["timestamps_replaced"] == 5
+    
+    def test_scorer_survives_extreme_timestamps(self, client, monkeypatch):
+        from scorer import app as app_module
+        monkeypatch.setattr(app_module, "feature_store", FeatureStore())
+        txn = make_transactions(1)[0]
+        for timestamp in [1e300, -1e300, time.time() + 10 * 86400]:
+            assert client.post("/score", json=dict(txn, timestamp=timestamp)).status_code == 200
+    
+    def test_bounded_keys_and_ttl(self):
+        store = WindowStore([HOUR_WINDOW, DAY_WINDOW], max_keys=4, ttl_seconds=3600, initial_capacity=2)
+        for i in range(10):
+            store.record("k{}".format(i), 1000.0 + i, 1.0)
+        assert len(store) == 4
+        assert store.evictions == 6
+        assert store.record("k9", 1100.0, 1.0)[0][0][0] == 1
+        store.record("fresh", 10000.0, 1.0)
+        assert store.record("k9", 10001.0, 1.0)[0][0][0] == 0
+    
+    def test_scorer_uses_store(self, client, monkeypatch):
+        from scorer import app as app_module
+        monkeypatch.setattr(app_module, "feature_store", FeatureStore())
+        txn = make_transactions(1)[0]
+        del txn["velocity_1h"], txn["is_new_device"]
+        for i in range(12):
+            result = client.post("/score", json=dict(txn, timestamp=1_000_000.0 + i)).json()
+        assert "high_velocity" in [r["rule"] for r in result["rules_triggered"]]
+        assert client.get("/admin/feature-store").json()["users"]["keys"] == 1
+    
+    def test_batch_matches_single_with_store_fields(self, client, monkeypatch):
+        from scorer import app as app_module
+        config = {"rules": [
+            {"name": "busy_day", "tiers": [{"when": [["velocity_24h", ">=", 3]], "score": 0.9}]},
+            {"name": "big_day", "tiers": [{"when": [["amount_24h", ">", 300.0]], "score": 0.5}]},
+            {"name": "busy_device", "tiers": [{"when": [["device_velocity_1h", ">=", 2]], "score": 0.2}]},
+        ]}
+        monkeypatch.setattr(app_module, "rules_engine", RulesEngine(config=config))
+        txns = [dict(t, user_id="user_1", device_id="device_1", amount=100.0) for t in make_transactions(8)]
+        for t in txns:
+            del t["velocity_1h"], t["is_new_device"]
+        monkeypatch.setattr(app_module, "feature_store", FeatureStore())
+        single = [client.post("/score", json=t).json() for t in txns]
+        monkeypatch.setattr(app_module, "feature_store", FeatureStore())
+        batch = client.post("/score/batch", json=txns).json()
+        for one, many in zip(single, batch):
+            for field in ["fraud_score", "rules_score", "rules_triggered", "decision"]:
+                assert one[field] == many[field]
+        assert {r["rule"] for r in batch[-1]["rules_triggered"]} == {"busy_day", "big_day", "busy_device"}
+    
+    def test_launcher_refuses_store_with_several_workers(self, monkeypatch):
+        from scorer.serve import parse_args
+        monkeypatch.setenv("FRAUD_FEATURE_STORE", "1")
+        with pytest.raises(SystemExit):
+            parse_args(["--workers", "2"])
+        assert parse_args(["--workers", "1"]).workers == 1
+    
+    def test_missing_velocity_without_store(self, client):
+        txn = make_transactions(1)[0]
+        del txn["velocity_1h"]
+        assert client.post("/score", json=txn).status_code == 422
+
+class TestMetrics:
+    def test_histogram_quantiles_within_bucket_error(self):
+        from monitor.metrics import LatencyHistogram
+        rng = np.random.default_rng(0)
+        values = rng.lognormal(0, 1, 20000)
+        hist = LatencyHistogram()
+        for value in values.tolist():
+            hist.record(value)
+        for q in [0.5, 0.9, 0.99, 0.999]:
+            assert hist.quantile(q) == pytest.approx(np.quantile(values, q), rel=0.05)
+        assert hist.max_ms == pytest.approx(values.max())
+    
+    def test_shards_merge_across_threads(self):
+        import threading
+        from monitor.metrics import MetricsCollector, merge_snapshots
+        collector = MetricsCollector()
+        def work():
+            for i in range(1000):
+                collector.record_request(1.0 + i % 5, "APPROVE" if i % 2 else "DECLINE", 0.5)
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        summary = collector.get_metrics()
+        assert summary["request_count"] == 4000
+        assert summary["decisions"] == {"APPROVE": 2000, "REVIEW": 0, "DECLINE": 2000}
+        merged = merge_snapshots([collector.snapshot(), collector.snapshot()])
+        assert merged["request_count"] == 8000
+    
+    def test_worker_snapshots_survive_retirement(self, tmp_path):
+        from monitor.metrics import MetricsCollector, write_snapshot, read_snapshots, retire_snapshot, merge_snapshots, worker_snapshot_path
+        for pid, n in [(101, 3), (102, 5)]:
+            collector = MetricsCollector()
+            for _ in range(n):
+                collector.record_request(1.0, "APPROVE", 0.1)
+            write_snapshot(worker_snapshot_path(str(tmp_path), pid), collector.snapshot())
+        assert merge_snapshots(read_snapshots(str(tmp_path)))["request_count"] == 8
+        retire_snapshot(str(tmp_path), 101)
+        retire_snapshot(str(tmp_path), 102)
+        assert not (tmp_path / "worker-101.json").exists()
+        assert merge_snapshots(read_snapshots(str(tmp_path)))["request_count"] == 8
+    
+    def test_prometheus_endpoint(self, client):
+        client.post("/score", json=make_transactions(1)[0])
+        client.post("/score/batch", json=make_transactions(3))
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        body = response.text
+        assert "# TYPE fraud_request_latency_seconds histogram" in body
+        assert 'fraud_request_latency_quantile_seconds{quantile="0.999"}' in body
+        assert 'fraud_decisions_total{decision="APPROVE"}' in body
+        assert client.get("/admin/metrics").json()["request_count"] >= 4
+    
+    def test_stage_histograms(self, client):
+        from monitor.metrics import metrics, merge_snapshots, summarize
+        client.post("/score", json=make_transactions(1)[0])
+        client.post("/score/batch", json=make_transactions(3))
+        stages = client.get("/admin/metrics").json()["stages_ms"]
+        assert set(stages) >= {"/score", "/score/batch"}
+        assert set(stages["/score"]) >= {"validation", "model_lookup", "features", "inference", "rules", "response", "serialization"}
+        assert all(stats["p50"] >= 0 for stats in stages["/score"].values())
+        snapshot = metrics.snapshot()
+        merged = summarize(merge_snapshots([snapshot, snapshot]))
+        assert merged["stages_ms"]["/score"]["inference"]["p50"] == pytest.approx(stages["/score"]["inference"]["p50"])
+        assert 'fraud_stage_latency_seconds_count{endpoint="/score",stage="inference"}' in client.get("/metrics").text
+    
+    def test_sampling_profiler_collapsed_stacks(self, client):
+        try:
+            status = client.post("/admin/profiler", json={"enabled": True, "mode": "sampling", "interval_ms": 1}).json()
+            assert status["running"] and status["mode"] == "sampling"
+            deadline = time.time() + 5
+            while client.get("/admin/profiler").json()["samples"] < 5 and time.time() < deadline:
+                client.post("/score", json=make_transactions(1)[0])
+            assert client.post("/admin/profiler", json={"enabled": False}).json()["running"] is False
+            lines = client.get("/admin/profiler/dump").text.splitlines()
+            assert lines
+            stack, count = lines[0].rsplit(" ", 1)
+            assert int(count) >= 1 and ";" in stack
+        finally:
+            client.post("/admin/profiler", json={"enabled": False})
+    
+    def test_cprofile_mode_dumps_pstats(self, client, tmp_path):
+        import pstats
+        assert client.post("/admin/profiler", json={"enabled": True, "mode": "flame"}).status_code == 400
+        try:
+            client.post("/admin/profiler", json={"enabled": True, "mode": "cprofile", "sample_rate": 1.0})
+            for txn in make_transactions(3):
+                client.post("/score", json=txn)
+            assert client.get("/admin/profiler").json()["profiled_requests"] == 3
+            client.post("/admin/profiler", json={"enabled": False})
+            path = tmp_path / "scorer.prof"
+            path.write_bytes(client.get("/admin/profiler/dump").content)
+            assert any(func[2] == "score" for func in pstats.Stats(str(path)).stats)
+        finally:
+            client.post("/admin/profiler", json={"enabled": False})
+
+class TestRollups:
+    def test_upserts_accumulate_and_queries_filter_time(self, tmp_path):
+        from monitor.rollups import RollupBatch, RollupStore, HOUR, LIVE
+        store = RollupStore(str(tmp_path / "rollups.db"))
+        t0 = 1_700_000_000 // HOUR * HOUR
+        for _ in range(2):
+            batch = RollupBatch()
+            batch.add_rows("test", [t0, t0 + 10, t0 + HOUR], [10.0, 30.0, 50.0], scores=[0.01, 0.99, 0.5], is_fraud=[0, 1, 0])
+            batch.add_scored(t0 + 5, 20.0, "DECLINE", 0.9, [{"rule": "high_velocity", "score": 0.8}])
+            batch.add_request(t0 + 5, 2.0)
+            batch.add_request(t0 + 65, 40.0, transactions=10)
+            batch.add_error(t0 + 70)
+            store.write(batch)
+        totals = store.totals("test", t0, t0 + HOUR)
+        assert (totals["count"], totals["labeled_count"], totals["fraud_count"]) == (4, 4, 2)
+        assert totals["fraud_amount_sum"] == pytest.approx(60.0)
+        assert store.totals("test", t0, t0 + 2 * HOUR)["count"] == 6
+        assert store.totals(LIVE, t0, t0 + 2 * HOUR)["count"] == 2
+        assert [(row["score_bucket"], row["count"]) for row in store.score_histogram("test", t0, t0 + 2 * HOUR)] == [(0, 2), (10, 2), (19, 2)]
+        assert store.rule_counts(LIVE, t0, t0 + HOUR) == [{"rule": "high_velocity", "count": 2}]
+        first, second = store.serving(t0, t0 + HOUR)
+        assert (first["transactions"], first["requests"], second["transactions"], second["errors"]) == (2, 2, 20, 2)
+        assert 2.0 <= first["p50"] < 2.4 and 40.0 <= second["p99"] < 48.0
+        batch = RollupBatch()
+        batch.add_rows("test", [t0], [1.0], is_fraud=[1])
+        store.replace_source("test", batch)
+        assert store.time_range("test") == (t0, t0)
+    
+    def test_scorer_records_rollups(self, client, tmp_path, monkeypatch):
+        import scorer.app as app_module
+        from monitor.rollups import RollupBatch, RollupStore, LIVE
+        monkeypatch.setattr(app_module, "rollups", RollupBatch())
+        txns = make_transactions(6, seed=9)
+        decisions = [client.post("/score", json=txns[0]).json()["decision"]]
+        decisions += [r["decision"] for r in client.post("/score/batch", json=txns[1:]).json()]
+        store = RollupStore(str(tmp_path / "rollups.db"))
+        store.write(app_module.take_rollups())
+        now = time.time()
+        rows = store.by_hour(LIVE, now - 3600, now + 3600)
+        assert {row["decision"]: row["count"] for row in rows} == {d: decisions.count(d) for d in set(decisions)}
+        minutes = store.serving(now - 3600, now + 3600)
+        assert sum(m["transactions"] for m in minutes) == 6 and sum(m["requests"] for m in minutes) == 2
+        assert not app_module.rollups
+
+class TestTuning:
+    def test_serving_search_matches_brute_force(self):
+        from training.tune import search_serving, serving_cost, ML_WEIGHTS, THRESHOLDS
+        rng = np.random.default_rng(0)
+        y = rng.random(2000) < 0.1
+        ml = np.clip(np.where(y, 0.7, 0.2) + rng.normal(0, 0.2, 2000), 0, 1)
+        rules = np.where(rng.random(2000) < 0.3, 0.8, 0.0)
+        amounts = rng.lognormal(4, 1, 2000)
+        best = search_serving(ml, rules, y, amounts)
+        assert best["cost"] == pytest.approx(serving_cost(best, ml, rules, y, amounts)["cost"], rel=1e-6)
+        brute = min(
+            serving_cost({"ml_weight": w, "rules_weight": 1 - w, "review_threshold": r, "decline_threshold": d}, ml, rules, y, amounts)["cost"]
+            for w in ML_WEIGHTS[::2] for r in THRESHOLDS[::3] for d in THRESHOLDS[::3] if r <= d
+        )
+        assert best["cost"] <= brute + 1e-6
+    
+    def test_feature_cache_rebuilds_on_rules_change(self, tmp_path, monkeypatch):
+        import json
+        from simulator.generate import generate_transactions
+        from training.tune import cache_features, load_cache
+        monkeypatch.chdir(tmp_path)
+        os.makedirs("data")
+        generate_transactions(2000, fraud_rate=0.05, seed=3).to_csv("data/transactions_train.csv", index=False)
+        rules_path = tmp_path / "rules.json"
+        rule = {"name": "any_amount", "tiers": [{"when": [["amount", ">", 0]], "score": 0.2}]}
+        rules_path.write_text(json.dumps({"rules": [rule]}))
+        out_dir = cache_features("train", "cache", rules_path=str(rules_path))
+        assert float(load_cache(out_dir)["rules"].max()) == pytest.approx(0.2)
+        rule["tiers"][0]["score"] = 1.0
+        rules_path.write_text(json.dumps({"rules": [rule]}))
+        out_dir = cache_features("train", "cache", rules_path=str(rules_path))
+        assert float(load_cache(out_dir)["rules"].min()) == 1.0
+    
+    def test_scorer_uses_tuned_settings(self, client, model, tmp_path, monkeypatch):
+        from training.train import save_artifacts
+        monkeypatch.setattr(model_loader, "MODEL_DIR", str(tmp_path))
+        loader = get_model_loader()
+        previous = loader._current
+        try:
+            assert client.get("/admin/serving").json()["tuned"] is False
+            serving = {"ml_weight": 0.0, "rules_weight": 1.0, "review_threshold": 0.01, "decline_threshold": 0.02}
+            save_artifacts(model, {"auc": 1.0, "serving": serving}, version="tuned")
+            client.post("/admin/reload")
+            assert client.get("/admin/serving").json() == {"model_version": "tuned", "tuned": True, **serving}
+            txn = dict(make_transactions(1)[0], velocity_1h=12, is_new_device=False)
+            result = client.post("/score", json=txn).json()
+            assert result["fraud_score"] == result["rules_score"] > 0
+            assert result["decision"] == "DECLINE"
+            assert client.post("/score/batch", json=[txn]).json()[0]["decision"] == "DECLINE"
+        finally:
+            loader._current = previous
+
+class TestLoadTest:
+    def test_server_timing_header(self, client):
+        from benchmarks.load_test import parse_server_timing
+        stages = parse_server_timing(client.post("/score", json=make_transactions(1)[0]).headers["server-timing"])
+        assert list(stages) == ["validation", "model_lookup", "features", "inference", "rules", "response", "serialization"]
+        assert all(duration >= 0 for duration in stages.values())
+        assert "server-timing" not in client.get("/health").headers
+    
+    def test_replays_jsonl_in_process(self, client, tmp_path):
+        import json
+        from benchmarks.load_test import main
+        path = tmp_path / "traffic.jsonl"
+        path.write_text("\n".join(json.dumps(t) for t in make_transactions(20)))
+        output = tmp_path / "results.json"
+        result = main(["--input", str(path), "--requests", "30", "--warmup", "5", "--concurrency", "4", "--output", str(output)])
+        assert result["requests"] == 30 and result["errors"] == 0
+        assert set(result["latency_ms"]) >= {"p50", "p99", "p999"}
+        assert set(result["stages_ms"]) == {"validation", "model_lookup", "features", "inference", "rules", "response", "serialization"}
+        assert json.loads(output.read_text())["requests"] == 30
+        result = main(["--input", str(path), "--requests", "10", "--warmup", "0", "--rate", "500", "--batch-size", "4"])
+        assert result["mode"] == "open_loop" and result["requests"] == 10 and result["errors"] == 0
+
+    def test_counts_timeouts_and_transport_errors(self):
+        import asyncio
+        import httpx
+        from benchmarks.load_test import Results, closed_loop
+        calls = iter(range(30))
+        
+        def handler(request):
+            i = next(calls)
+            if i % 3 == 1:
+                raise httpx.ReadTimeout("timed out", request=request)
+            if i % 3 == 2:
+                raise httpx.ConnectError("refused", request=request)
+            return httpx.Response(200, json={})
+        
+        async def replay():
+            async with httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://test") as client:
+                await closed_loop(client, "/score", [{}] * 30, 4, results)
+        
+        results = Results()
+        asyncio.run(replay())
+        summary = results.summary(1.0, 1)
+        assert summary["requests"] == 30 and summary["errors"] == 20
+        assert summary["status_codes"] == {"200": 10, "timeout": 10, "transport_error": 10}
+
+class TestDrift:
+    def test_streaming_psi_matches_batch_psi(self):
+        from monitor.drift import calculate_psi, ReferenceProfile, StreamingDriftMonitor
+        rng = np.random.default_rng(0)
+        reference = {"a": rng.normal(size=5000), "b": rng.integers(0, 2, 5000)}
+        current = np.column_stack([rng.normal(0.5, size=2000), rng.integers(0, 2, 2000)])
+        profile = ReferenceProfile.from_data(reference, ["a", "b"])
+        monitor = StreamingDriftMonitor(profile)
+        for row in current[:1000]:
+            monitor.update(row, now=1000.0)
+        monitor.update_batch(current[1000:], now=1000.0)
+        report = monitor.report(now=1000.0)
+        for i, col in enumerate(["a", "b"]):
+            expected = calculate_psi(reference[col], current[:, i])
+            assert report["sliding"]["psi"][col] == pytest.approx(expected, abs=1e-4)
+            assert report["tumbling"]["psi"][col] == pytest.approx(expected, abs=1e-4)
+        assert report["sliding"]["status"] == "SIGNIFICANT_DRIFT"
+    
+    def test_windows_expire_and_tumble(self):
+        from monitor.drift import ReferenceProfile, StreamingDriftMonitor
+        rng = np.random.default_rng(1)
+        profile = ReferenceProfile.from_data({"a": rng.normal(size=1000)}, ["a"])
+        monitor = StreamingDriftMonitor(profile, slot_seconds=10, n_slots=6, tumbling_seconds=60)
+        for i in range(120):
+            monitor.update([rng.normal()], now=float(i))
+        report = monitor.report(now=119.0)
+        assert report["sliding"]["count"] == 60
+        assert report["tumbling"]["count"] == 60
+        assert report["last_tumbling"]["count"] == 60
+        assert report["last_tumbling"]["window_start"] == 0
+        assert monitor.report(now=1000.0)["sliding"]["count"] == 0
+    
+    def test_scorer_tracks_drift_from_saved_reference(self, client, model, tmp_path, monkeypatch):
+        from training.train import save_artifacts, build_drift_reference
+        monkeypatch.setattr(model_loader, "MODEL_DIR", str(tmp_path))
+        loader = get_model_loader()
+        previous = loader._current
+        try:
+            X = extract_features_frame(pd.DataFrame(make_transactions(300, seed=2)))
+            save_artifacts(model, {"auc": 1.0}, version="v1", drift_reference=build_drift_reference(X, model.predict_proba(X)[:, 1]))
+            assert os.path.exists(os.path.join(tmp_path, "versions", "v1", model_loader.DRIFT_REFERENCE_FILE))
+            client.post("/admin/reload")
+            client.post("/score", json=make_transactions(1)[0])
+            client.post("/score/batch", json=make_transactions(9))
+            report = client.get("/admin/drift").json()
+            assert report["enabled"] and report["model_version"] == "v1"
+            assert report["features"]["sliding"]["count"] == 10
+            assert set(report["features"]["sliding"]["psi"]) == set(FEATURE_NAMES)
+            assert report["score"]["sliding"]["count"] == 10
+            assert 'fraud_score_psi{column="ml_score",window="sliding"}' in client.get("/metrics").text
+        finally:
+            loader._current = previous
+
+class TestSimulator:
+    def test_seeded_chunks_are_reproducible(self):
+        from simulator.generate import generate_transactions
+        df = generate_transactions(5000, fraud_rate=0.05, seed=7, chunk_size=2000)
+        assert df.equals(generate_transactions(5000, fraud_rate=0.05, seed=7, chunk_size=2000))
+        assert not df.equals(generate_transactions(5000, fraud_rate=0.05, seed=8, chunk_size=2000))
+        assert df["transaction_id"].is_unique and len(df) == 5000
+        assert df["user_id"].dtype == "category"
+        assert 0.03 < df["is_fraud"].mean() < 0.07
+        assert df.loc[df["is_fraud"] == 1, "velocity_1h"].mean() > df.loc[df["is_fraud"] == 0, "velocity_1h"].mean()
+        assert (df["day_of_week"] == df["timestamp"].dt.weekday).all()
+    
+    def test_shards_do_not_depend_on_worker_count(self, tmp_path):
+        from simulator.generate import write_shards, generate_transactions
+        from simulator.dataset import read_transactions, shard_dir
+        for workers in [1, 2]:
+            stats = write_shards(3000, 0.05, 7, 1000, str(tmp_path / str(workers)), workers)
+            assert stats["train"][0] == 2400 and stats["test"][0] == 600
+        for split in ["train", "test"]:
+            one, two = shard_dir(split, str(tmp_path / "1")), shard_dir(split, str(tmp_path / "2"))
+            assert sorted(os.listdir(one)) == sorted(os.listdir(two))
+            for name in os.listdir(one):
+                with open(os.path.join(one, name), "rb") as a, open(os.path.join(two, name), "rb") as b:
+                    assert a.read() == b.read()
+        train = read_transactions(shard_dir("train", str(tmp_path / "2")))
+        expected = generate_transactions(3000, fraud_rate=0.05, seed=7, chunk_size=1000).iloc[:2400]
+        assert train["transaction_id"].tolist() == expected["transaction_id"].tolist()
+        np.testing.assert_allclose(train["amount"], expected["amount"])
+    
+    def test_parquet_dataset_round_trip(self, tmp_path):
+        from simulator.generate import write_shards, generate_transactions
+        from simulator.dataset import read_transactions, split_path
+        from training.train import load_data, TRAIN_COLUMNS
+        write_shards(3000, 0.05, 7, 1000, str(tmp_path), 1, fmt="parquet")
+        path = split_path("train", str(tmp_path))
+        assert path.endswith("transactions_train.parquet")
+        assert any(name.startswith("month=") for name in os.listdir(path))
+        df = read_transactions(path)
+        assert len(df) == 2400 and df["user_id"].dtype == "category"
+        expected = generate_transactions(3000, fraud_rate=0.05, seed=7, chunk_size=1000).iloc[:2400]
+        merged = df.merge(expected, on="transaction_id", suffixes=("", "_csv"))
+        assert len(merged) == 2400
+        assert (merged["user_id"].astype(str) == merged["user_id_csv"].astype(str)).all()
+        np.testing.assert_allclose(merged["amount"], merged["amount_csv"])
+        assert list(load_data(path).columns) == TRAIN_COLUMNS
+    
+    def test_chunked_training_streams_every_row(self, tmp_path):
+        from simulator.generate import write_shards
+        from simulator.dataset import iter_transaction_chunks, split_path
+        from training.train import train_model_chunked, predict_chunked
+        write_shards(6000, 0.1, 7, 1000, str(tmp_path), 1, fmt="parquet")
+        path = split_path("train", str(tmp_path))
+        sizes = [len(chunk) for chunk in iter_transaction_chunks(path, 1500, ["amount"])]
+        assert sizes == [1500, 1500, 1500, 300]
+        model, X_reference = train_model_chunked(path, 1500, trees_per_chunk=2, reference_rows=400)
+        assert len(model.estimators_) == 8
+        assert X_reference.shape == (400, len(FEATURE_NAMES))
+        counts, score_sample = predict_chunked(model, split_path("test", str(tmp_path)), 500, sample_size=100)
+        assert counts.sum() == 1200 and len(score_sample) == 100
+        centres = np.arange(counts.shape[1]) + 0.5
+        assert (counts[1] * centres).sum() / counts[1].sum() > (counts[0] * centres).sum() / counts[0].sum()
+    
+    def test_chunked_training_bounds_trees_and_samples(self, tmp_path):
+        from simulator.generate import write_shards
+        from simulator.dataset import split_path
+        from training.train import train_model_chunked, tree_schedule, Reservoir
+        assert tree_schedule(4, 10, 20) == [5, 5, 5, 5]
+        assert tree_schedule(8, 10, 3) == [0, 0, 1, 0, 0, 1, 0, 1]
+        assert sum(tree_schedule(5, 2, 100)) == 10
+        write_shards(6000, 0.1, 7, 1000, str(tmp_path), 1, fmt="parquet")
+        model, X_reference = train_model_chunked(split_path("train", str(tmp_path)), 500, trees_per_chunk=5, max_trees=6,
+                                                 reference_rows=50)
+        assert len(model.estimators_) == 6 and len(X_reference) == 50
+        # Every stream position is equally likely to end up in the sample
+        hits = np.zeros(1000)
+        for seed in range(400):
+            reservoir = Reservoir(100, seed=seed)
+            for start in range(0, 1000, 300):
+                reservoir.add(np.arange(start, min(start + 300, 1000)))
+            hits[reservoir.sample()] += 1
+        assert hits.sum() == 40000 and abs(hits[:500].sum() - hits[500:].sum()) < 0.05 * hits.sum()
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
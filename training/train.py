@@ -1,5 +1,5 @@
 """Train fraud detection model."""
-import pandas as pd
+import argparse
 import numpy as np
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import classification_report, roc_auc_score, precision_recall_curve
@@ -7,36 +7,130 @@ import joblib
 import os
 import sys
 import json
+import warnings
+from datetime import datetime, timezone
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from scorer.features import extract_features, features_to_array, FEATURE_NAMES
+from scorer.features import extract_features_frame, FEATURE_NAMES, INPUT_COLUMNS
+from scorer.flat_forest import flatten_forest
+from scorer import model_loader
+from simulator.dataset import read_transactions, iter_transaction_chunks, split_path, count_rows
+from monitor.drift import ReferenceProfile, SCORE_COLUMN
+from monitor.rollups import RollupBatch, RollupStore, ROLLUP_DB
 
-def load_data(path):
-    return pd.read_csv(path)
+TRAIN_COLUMNS = INPUT_COLUMNS + ["is_fraud"]
+ROLLUP_COLUMNS = TRAIN_COLUMNS + ["timestamp"]
+
+def load_data(path, columns=TRAIN_COLUMNS):
+    """The columns training needs from a split: a CSV file, a CSV shard directory or a Parquet dataset."""
+    return read_transactions(path, columns)
 
 def prepare_features(df):
-    features_list = []
-    for _, row in df.iterrows():
-        txn = row.to_dict()
-        features = extract_features(txn)
-        features_list.append(features_to_array(features))
-    return np.array(features_list)
+    return extract_features_frame(df)
+
+FOREST_PARAMS = {"n_estimators": 100, "max_depth": 10, "min_samples_split": 10, "min_samples_leaf": 5}
+
+def make_model(**params):
+    """The forest with default hyperparameters, overridden by params."""
+    return RandomForestClassifier(**{**FOREST_PARAMS, "class_weight": "balanced", "random_state": 42, "n_jobs": -1, **params})
 
 def train_model(X_train, y_train):
-    model = RandomForestClassifier(
-        n_estimators=100, max_depth=10, min_samples_split=10,
-        min_samples_leaf=5, class_weight="balanced", random_state=42, n_jobs=-1
-    )
+    model = make_model()
     model.fit(X_train, y_train)
     return model
 
+MAX_TREES = 200
+REFERENCE_ROWS = 100_000
+# Test scores are counted in bins this wide, so chunked metrics use constant memory
+SCORE_BINS = 10_000
+
+class Reservoir:
+    """A uniform sample of at most size rows from a stream of arrays (Algorithm R)."""
+
+    def __init__(self, size, seed=42):
+        self.size = size
+        self.seen = 0
+        self.rows = None
+        self.rng = np.random.default_rng(seed)
+
+    def add(self, rows):
+        if self.rows is None:
+            self.rows = np.empty((self.size,) + rows.shape[1:], dtype=rows.dtype)
+        fill = min(max(self.size - self.seen, 0), len(rows))
+        self.rows[self.seen:self.seen + fill] = rows[:fill]
+        # Stream row t replaces a random slot with probability size / (t + 1); later rows win, as in sequence
+        t = self.seen + np.arange(fill, len(rows))
+        slots = (self.rng.random(len(t)) * (t + 1)).astype(np.int64)
+        keep = slots < self.size
+        self.rows[slots[keep]] = rows[fill:][keep]
+        self.seen += len(rows)
+
+    def sample(self):
+        return self.rows[:min(self.seen, self.size)]
+
+def tree_schedule(n_chunks, trees_per_chunk, max_trees=MAX_TREES):
+    """Trees to add at each chunk: trees_per_chunk each, spread evenly when that would pass max_trees."""
+    total = min(trees_per_chunk * n_chunks, max_trees)
+    return [total * (i + 1) // n_chunks - total * i // n_chunks for i in range(n_chunks)]
+
+def train_model_chunked(path, chunk_size, trees_per_chunk=10, max_trees=MAX_TREES, reference_rows=REFERENCE_ROWS):
+    """Grow one forest chunk by chunk with warm_start; peak memory follows chunk_size, not the dataset.
+
+    The forest stops at max_trees, so model size and inference latency do not grow with the data.
+    Returns the model and a uniform row sample of the training features for the drift reference.
+    """
+    model = make_model(n_estimators=0, warm_start=True)
+    schedule = tree_schedule(-(-count_rows(path) // chunk_size), trees_per_chunk, max_trees)
+    reference = Reservoir(reference_rows)
+    pending = 0
+    for i, chunk in enumerate(iter_transaction_chunks(path, chunk_size, TRAIN_COLUMNS)):
+        X, y = prepare_features(chunk), chunk["is_fraud"].values
+        reference.add(X)
+        # A chunk that cannot be fitted hands its trees to the next one
+        pending += schedule[i] if i < len(schedule) else 0
+        if not pending:
+            continue
+        if len(np.unique(y)) < 2:
+            print("  Chunk {}: skipped, only one class in {} rows".format(i, len(y)))
+            continue
+        model.n_estimators += pending
+        pending = 0
+        with warnings.catch_warnings():
+            # Balanced weights come from each chunk, which is a sample of the same generated distribution
+            warnings.filterwarnings("ignore", message=".*class_weight presets.*")
+            model.fit(X, y)
+        print("  Chunk {}: {} rows, {} trees".format(i, len(y), model.n_estimators))
+    if not model.n_estimators:
+        raise ValueError("No training chunk contained both classes")
+    return model, reference.sample()
+
+def predict_chunked(model, path, chunk_size, sample_size=REFERENCE_ROWS):
+    """Per-class counts of fraud probabilities in SCORE_BINS bins for a split, and a uniform sample of the probabilities."""
+    counts = np.zeros((2, SCORE_BINS), dtype=np.int64)
+    sample = Reservoir(sample_size)
+    for chunk in iter_transaction_chunks(path, chunk_size, TRAIN_COLUMNS):
+        y = chunk["is_fraud"].values.astype(bool)
+        proba = model.predict_proba(prepare_features(chunk))[:, 1]
+        bins = np.minimum((proba * SCORE_BINS).astype(np.int64), SCORE_BINS - 1)
+        counts[0] += np.bincount(bins[~y], minlength=SCORE_BINS)
+        counts[1] += np.bincount(bins[y], minlength=SCORE_BINS)
+        sample.add(proba)
+    return counts, sample.sample()
+
+def evaluate_counts(model, counts):
+    """evaluate_scores from per-class binned probabilities, each bin scored at its centre."""
+    label, bin_index = np.nonzero(counts)
+    return evaluate_scores(model, label, (bin_index + 0.5) / SCORE_BINS, sample_weight=counts[label, bin_index])
+
 def evaluate_model(model, X_test, y_test):
-    y_pred = model.predict(X_test)
-    y_proba = model.predict_proba(X_test)[:, 1]
+    return evaluate_scores(model, y_test, model.predict_proba(X_test)[:, 1])
+
+def evaluate_scores(model, y_test, y_proba, sample_weight=None):
+    y_pred = (y_proba > 0.5).astype(int)
     print("\nClassification Report:")
-    print(classification_report(y_test, y_pred, target_names=["Legit", "Fraud"]))
-    auc = roc_auc_score(y_test, y_proba)
+    print(classification_report(y_test, y_pred, target_names=["Legit", "Fraud"], sample_weight=sample_weight))
+    auc = roc_auc_score(y_test, y_proba, sample_weight=sample_weight)
     print("ROC-AUC: {:.4f}".format(auc))
-    precision, recall, thresholds = precision_recall_curve(y_test, y_proba)
+    precision, recall, thresholds = precision_recall_curve(y_test, y_proba, sample_weight=sample_weight)
     f1_scores = 2 * (precision * recall) / (precision + recall + 1e-10)
     best_idx = np.argmax(f1_scores)
     best_threshold = thresholds[best_idx] if best_idx < len(thresholds) else 0.5
@@ -46,10 +140,48 @@ def evaluate_model(model, X_test, y_test):
         print("  {}: {:.4f}".format(name, importance))
     return {"auc": auc, "best_threshold": best_threshold, "feature_importances": dict(zip(FEATURE_NAMES, model.feature_importances_.tolist()))}
 
-def main():
+def export_flat_model(model, path):
+    """Save the forest as flat node arrays for sklearn-free inference."""
+    joblib.dump(flatten_forest(model), path)
+
+def build_drift_reference(X_train, ml_scores):
+    """Reference bins for every feature and for the model score, computed once at training time."""
+    columns = {name: X_train[:, i] for i, name in enumerate(FEATURE_NAMES)}
+    columns[SCORE_COLUMN] = ml_scores
+    return ReferenceProfile.from_data(columns, FEATURE_NAMES + [SCORE_COLUMN])
+
+def save_artifacts(model, metrics, model_dir=None, version=None, drift_reference=None):
+    """Write a new model version directory and publish it as LATEST."""
+    model_dir = model_dir or model_loader.MODEL_DIR
+    version = version or datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    out_dir = model_loader.version_dir(version, model_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    metrics = dict(metrics, version=version)
+    joblib.dump(model, os.path.join(out_dir, "fraud_model.joblib"))
+    export_flat_model(model, os.path.join(out_dir, "fraud_model_flat.joblib"))
+    if drift_reference is not None:
+        drift_reference.save(os.path.join(out_dir, model_loader.DRIFT_REFERENCE_FILE))
+    for path in [os.path.join(out_dir, "metrics.json"), os.path.join(model_dir, "metrics.json")]:
+        with open(path, "w") as f:
+            json.dump(metrics, f, indent=2)
+    model_loader.publish_version(version, model_dir)
+    return out_dir
+
+def rollup_splits(model, store, chunk_size=500_000):
+    """Replace the dashboard's train and test rollups: labels and amounts per hour, and model scores for the test split."""
+    for split in ["train", "test"]:
+        batch = RollupBatch()
+        for chunk in iter_transaction_chunks(split_path(split), chunk_size, ROLLUP_COLUMNS):
+            # Timestamps are naive UTC, as datetimes from Parquet and strings from CSV
+            timestamps = np.asarray(chunk["timestamp"].values, dtype="datetime64[s]").astype(np.int64)
+            scores = model.predict_proba(prepare_features(chunk))[:, 1] if split == "test" else None
+            batch.add_rows(split, timestamps, chunk["amount"].values, scores, is_fraud=chunk["is_fraud"].values)
+        store.replace_source(split, batch)
+
+def main_in_memory():
     print("Loading training data...")
-    train_df = load_data("data/transactions_train.csv")
-    test_df = load_data("data/transactions_test.csv")
+    train_df = load_data(split_path("train"))
+    test_df = load_data(split_path("test"))
     print("Train: {} samples, {:.2f}% fraud".format(len(train_df), train_df["is_fraud"].mean()*100))
     print("Test: {} samples, {:.2f}% fraud".format(len(test_df), test_df["is_fraud"].mean()*100))
     print("\nExtracting features...")
@@ -61,14 +193,42 @@ def main():
     print("\nTraining model...")
     model = train_model(X_train, y_train)
     print("\nEvaluating model...")
-    metrics = evaluate_model(model, X_test, y_test)
-    os.makedirs("models", exist_ok=True)
-    model_path = "models/fraud_model.joblib"
-    joblib.dump(model, model_path)
-    print("\nModel saved to {}".format(model_path))
-    with open("models/metrics.json", "w") as f:
-        json.dump(metrics, f, indent=2)
-    print("Metrics saved to models/metrics.json")
+    y_proba = model.predict_proba(X_test)[:, 1]
+    metrics = evaluate_scores(model, y_test, y_proba)
+    return model, metrics, build_drift_reference(X_train, y_proba)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunk-size", type=int, default=None,
+                        help="Stream the data in chunks of this many rows and grow the forest per chunk")
+    parser.add_argument("--trees-per-chunk", type=int, default=10)
+    parser.add_argument("--max-trees", type=int, default=MAX_TREES, help="Forest size cap, spread evenly over the chunks")
+    parser.add_argument("--rollup-db", default=ROLLUP_DB, help="SQLite rollups for the dashboard; empty to skip")
+    return parser.parse_args(argv)
+
+def main_chunked(args):
+    print("Training on {} in chunks of {} rows...".format(split_path("train"), args.chunk_size))
+    model, X_reference = train_model_chunked(split_path("train"), args.chunk_size, args.trees_per_chunk, args.max_trees)
+    print("\nEvaluating model...")
+    counts, score_sample = predict_chunked(model, split_path("test"), args.chunk_size)
+    print("Test: {} samples, {:.2f}% fraud".format(counts.sum(), counts[1].sum() / counts.sum() * 100))
+    metrics = evaluate_counts(model, counts)
+    return model, metrics, build_drift_reference(X_reference, score_sample)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.chunk_size:
+        model, metrics, drift_reference = main_chunked(args)
+    else:
+        model, metrics, drift_reference = main_in_memory()
+    out_dir = save_artifacts(model, metrics, drift_reference=drift_reference)
+    print("\nModel, flat model, metrics and drift reference saved to {}".format(out_dir))
+    print("Published {} as models/LATEST".format(os.path.basename(out_dir)))
+    if args.rollup_db:
+        store = RollupStore(args.rollup_db)
+        rollup_splits(model, store, args.chunk_size or 500_000)
+        store.close()
+        print("Dashboard rollups written to {}".format(args.rollup_db))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,187 @@
+"""Tune forest hyperparameters, ML/rules blending and decision thresholds against fraud costs."""
+import argparse
+import hashlib
+import inspect
+import itertools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from sklearn.metrics import roc_auc_score
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import scorer.features
+from scorer.features import FEATURE_NAMES
+from scorer.rules import RulesEngine, RULES_PATH
+from simulator.dataset import iter_transaction_chunks, count_rows, split_path, transaction_files
+from training.train import TRAIN_COLUMNS, prepare_features, make_model, evaluate_scores, build_drift_reference, save_artifacts
+
+CACHE_DIR = os.path.join("data", "features")
+CACHE_ARRAYS = {"X": (np.float32, (len(FEATURE_NAMES),)), "y": (np.int8, ()), "amount": (np.float32, ()), "rules": (np.float32, ())}
+SEARCH_SPACE = {
+    "n_estimators": [50, 100, 200],
+    "max_depth": [8, 10, 14, None],
+    "min_samples_leaf": [1, 5, 20],
+    "max_features": ["sqrt", 0.5, 1.0],
+}
+ML_WEIGHTS = np.round(np.arange(0.5, 1.0001, 0.05), 2)
+THRESHOLDS = np.round(np.arange(0.05, 0.9501, 0.025), 3)
+# A missed fraud costs its amount; these are per transaction
+FALSE_DECLINE_COST = 10.0
+REVIEW_COST = 2.0
+
+def cache_signature(path):
+    return [[file, os.path.getsize(file), os.path.getmtime(file)] for file in transaction_files(path)]
+
+def feature_code_version():
+    """Digest of the feature extraction code, so editing it rebuilds the cache."""
+    source = inspect.getsource(scorer.features) + inspect.getsource(prepare_features)
+    return hashlib.sha256(source.encode()).hexdigest()[:12]
+
+def cache_features(split, cache_dir=CACHE_DIR, chunk_size=500_000, rebuild=False, rules_path=RULES_PATH):
+    """Features, labels, amounts and rule scores for a split as .npy files, rebuilt when the data, features or rules change."""
+    source = split_path(split)
+    out_dir = os.path.join(cache_dir, split)
+    meta_path = os.path.join(out_dir, "meta.json")
+    rules_engine = RulesEngine(rules_path, reload_interval=0)
+    meta = {"source": source, "signature": cache_signature(source), "features": FEATURE_NAMES,
+            "feature_code": feature_code_version(), "rules": rules_engine.version}
+    if not rebuild and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f) == meta:
+                return out_dir
+    os.makedirs(out_dir, exist_ok=True)
+    n = count_rows(source)
+    arrays = {name: np.lib.format.open_memmap(os.path.join(out_dir, name + ".npy"), mode="w+", dtype=dtype, shape=(n,) + shape)
+              for name, (dtype, shape) in CACHE_ARRAYS.items()}
+    start = 0
+    for chunk in iter_transaction_chunks(source, chunk_size, TRAIN_COLUMNS):
+        end = start + len(chunk)
+        arrays["X"][start:end] = prepare_features(chunk)
+        arrays["y"][start:end] = chunk["is_fraud"].values
+        arrays["amount"][start:end] = chunk["amount"].values
+        arrays["rules"][start:end] = rules_engine.evaluate_batch({col: chunk[col].values for col in TRAIN_COLUMNS})["rules_score"]
+        start = end
+    for array in arrays.values():
+        array.flush()
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+    return out_dir
+
+def load_cache(out_dir):
+    """Memory-mapped cache arrays; worker processes share their pages."""
+    return {name: np.load(os.path.join(out_dir, name + ".npy"), mmap_mode="r") for name in CACHE_ARRAYS}
+
+def search_serving(ml_scores, rules_scores, y, amounts, false_decline_cost=FALSE_DECLINE_COST, review_cost=REVIEW_COST):
+    """Blend weight and review/decline thresholds with the lowest total cost.
+
+    For every weight the scores are sorted once; cumulative sums then give each threshold's
+    missed-fraud amount, declined legit count and flagged count without rescanning the rows.
+    """
+    y = np.asarray(y, dtype=bool)
+    missed_amount = np.where(y, amounts, 0.0)
+    n, n_legit = len(y), int((~y).sum())
+    best = None
+    for ml_weight in ML_WEIGHTS:
+        scores = ml_weight * ml_scores + (1 - ml_weight) * rules_scores
+        order = np.argsort(scores, kind="stable")
+        below = np.searchsorted(scores[order], THRESHOLDS, side="left")
+        missed = np.concatenate([[0.0], np.cumsum(missed_amount[order])])[below]
+        legit_at_or_above = n_legit - np.concatenate([[0], np.cumsum(~y[order])])[below]
+        flagged = n - below
+        # cost[r, d]: approve below THRESHOLDS[r], review up to THRESHOLDS[d], decline from there
+        cost = (missed[:, None] + false_decline_cost * legit_at_or_above[None, :]
+                + review_cost * (flagged[:, None] - flagged[None, :]))
+        cost[np.tril_indices(len(THRESHOLDS), -1)] = np.inf
+        r, d = np.unravel_index(np.argmin(cost), cost.shape)
+        if best is None or cost[r, d] < best["cost"]:
+            best = {
+                "cost": float(cost[r, d]),
+                "ml_weight": float(ml_weight),
+                "rules_weight": float(round(1 - ml_weight, 2)),
+                "review_threshold": float(THRESHOLDS[r]),
+                "decline_threshold": float(THRESHOLDS[d]),
+            }
+    return best
+
+def serving_cost(settings, ml_scores, rules_scores, y, amounts, false_decline_cost=FALSE_DECLINE_COST, review_cost=REVIEW_COST):
+    """Cost and decision rates of fixed serving settings."""
+    y = np.asarray(y, dtype=bool)
+    scores = settings["ml_weight"] * ml_scores + settings["rules_weight"] * rules_scores
+    decline = scores >= settings["decline_threshold"]
+    review = (scores >= settings["review_threshold"]) & ~decline
+    return {
+        "cost": float(amounts[y & ~decline & ~review].sum() + false_decline_cost * (decline & ~y).sum() + review_cost * review.sum()),
+        "decline_rate": float(decline.mean()),
+        "review_rate": float(review.mean()),
+        "fraud_caught": float((decline | review)[y].mean()) if y.any() else 0.0,
+        "false_decline_rate": float(decline[~y].mean()) if (~y).any() else 0.0,
+    }
+
+def run_trial(params, train_dir, validation_fraction, costs):
+    """Fit one parameter set on the head of the train cache and tune serving on its tail."""
+    cache = load_cache(train_dir)
+    split = int(len(cache["y"]) * (1 - validation_fraction))
+    model = make_model(**params, n_jobs=1)
+    model.fit(cache["X"][:split], cache["y"][:split])
+    ml_scores = model.predict_proba(cache["X"][split:])[:, 1]
+    y, amounts, rules_scores = cache["y"][split:], cache["amount"][split:], cache["rules"][split:]
+    serving = search_serving(ml_scores, rules_scores, y, amounts, *costs)
+    return {"params": params, "auc": float(roc_auc_score(y, ml_scores)), "cost": serving.pop("cost"), "serving": serving}
+
+def sample_params(n_trials, seed=42):
+    grid = [dict(zip(SEARCH_SPACE, values)) for values in itertools.product(*SEARCH_SPACE.values())]
+    rng = np.random.default_rng(seed)
+    return [grid[i] for i in rng.choice(len(grid), min(n_trials, len(grid)), replace=False)]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--trials", type=int, default=12, help="Parameter sets sampled from the search space")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--validation-fraction", type=float, default=0.2, help="Tail of the train split used to score trials")
+    parser.add_argument("--false-decline-cost", type=float, default=FALSE_DECLINE_COST)
+    parser.add_argument("--review-cost", type=float, default=REVIEW_COST)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--rebuild-cache", action="store_true")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    costs = (args.false_decline_cost, args.review_cost)
+    print("Caching features...")
+    train_dir = cache_features("train", args.cache_dir, rebuild=args.rebuild_cache)
+    test_dir = cache_features("test", args.cache_dir, rebuild=args.rebuild_cache)
+    trials = sample_params(args.trials, args.seed)
+    print("Running {} trials on {} workers...".format(len(trials), args.workers))
+    results = []
+    with ProcessPoolExecutor(args.workers) as pool:
+        for result in pool.map(run_trial, trials, itertools.repeat(train_dir), itertools.repeat(args.validation_fraction),
+                               itertools.repeat(costs)):
+            print("  cost {:>12,.2f}  auc {:.4f}  {}".format(result["cost"], result["auc"], result["params"]))
+            results.append(result)
+    best = min(results, key=lambda result: result["cost"])
+    print("\nBest: {} {}".format(best["params"], best["serving"]))
+
+    print("\nTraining the chosen model on the full train split...")
+    train, test = load_cache(train_dir), load_cache(test_dir)
+    model = make_model(**best["params"])
+    model.fit(train["X"], train["y"])
+    y_proba = model.predict_proba(test["X"])[:, 1]
+    metrics = evaluate_scores(model, np.asarray(test["y"]), y_proba)
+    test_cost = serving_cost(best["serving"], y_proba, test["rules"], test["y"], test["amount"], *costs)
+    print("Test cost with tuned settings: {:,.2f}".format(test_cost["cost"]))
+    metrics["serving"] = best["serving"]
+    metrics["tuning"] = {
+        "params": best["params"],
+        "validation_cost": best["cost"],
+        "test": test_cost,
+        "false_decline_cost": args.false_decline_cost,
+        "review_cost": args.review_cost,
+        "trials": results,
+    }
+    out_dir = save_artifacts(model, metrics, drift_reference=build_drift_reference(train["X"], y_proba))
+    print("\nTuned model and serving settings saved to {}".format(out_dir))
+
+if __name__ == "__main__":
+    main()